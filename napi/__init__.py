@@ -19,8 +19,11 @@ from .functions import *
 
 from .transformers import *
 from . import transformers
+from .instrument import stats
+from .decorators import vectorize_logic
 
-__all__ = ['nsource', 'nexec', 'neval'] + transformers.__all__
+__all__ = ['nsource', 'nexec', 'neval', 'ncompile', 'any_of', 'all_of',
+           'count_of', 'stats', 'vectorize_logic'] + transformers.__all__
 
 __version__ = '0.2.1'
 
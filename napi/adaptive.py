@@ -0,0 +1,164 @@
+"""This module defines a cost model for choosing how logical operations of
+arrays are evaluated.
+
+When :term:`short-circuiting` threshold is set to ``'auto'``, e.g.
+``neval(expr, sc='auto')`` or ``%napi sc auto``, density of **True**
+elements of operands is estimated from a small strided sample, and one of
+the following strategies is chosen based on the estimated cost:
+
+  * ``'dense'``, element-wise operation on whole arrays,
+  * ``'shortcircuit'``, gathering elements of later operands at indices
+    whose outcome is not yet decided, see :func:`.short_circuit_and`,
+  * ``'chunked'``, block-wise evaluation, see :func:`.chunked_and`.
+
+Costs per element of underlying NumPy operations are measured once per
+machine by :func:`.calibrate` and cached on disk in :file:`~/.napi`
+directory, or in the directory given by :envvar:`NAPI_HOME` environment
+variable."""
+
+import os
+import json
+import timeit
+import platform
+
+import numpy
+
+from .kernels import CHUNK, chunked_and
+
+__all__ = ['AUTO', 'STRATEGIES', 'calibrate', 'load_costs', 'estimate',
+           'choose_strategy']
+
+AUTO = 'auto'
+
+STRATEGIES = ('dense', 'shortcircuit', 'chunked')
+
+SAMPLE = 1024
+
+_costs = {}
+
+
+def _time(func, repeat):
+    """Return the best time of calling *func*."""
+
+    return min(timeit.Timer(func).repeat(repeat, 1))
+
+
+def calibrate(size=1000000, repeat=3):
+    """Return a dictionary of costs per element of operations, in seconds,
+    measured using arrays with *size* elements."""
+
+    random = numpy.random.RandomState(0)
+    a = random.random_sample(size) < 0.5
+    b = random.random_sample(size) < 0.5
+    zeros = numpy.zeros(size, bool)
+    ones = numpy.ones(size, bool)
+    out = numpy.empty(size, bool)
+    index = a.nonzero()[0]
+    n = float(size)
+    scan = _time(zeros.nonzero, repeat) / n
+    return {
+        'dense': _time(lambda: numpy.logical_and(a, b, out=out), repeat) / n,
+        'scan': scan,
+        'emit': max(_time(ones.nonzero, repeat) / n - scan, 0.),
+        'gather': _time(lambda: b[index], repeat) / len(index),
+        'scatter': _time(lambda: out.__setitem__(index, True),
+                         repeat) / len(index),
+        'chunk': _time(lambda: chunked_and([a, b], a.shape),
+                       repeat) / (2 * n),
+    }
+
+
+def _path(directory=None):
+
+    if directory is None:
+        directory = os.environ.get('NAPI_HOME',
+                                   os.path.join(os.path.expanduser('~'),
+                                                '.napi'))
+    return os.path.join(directory, 'calibration.json')
+
+
+def _machine():
+
+    return '-'.join([platform.node(), platform.machine(),
+                     platform.python_version(), numpy.__version__])
+
+
+def load_costs(directory=None, recalibrate=False):
+    """Return costs of operations for this machine.  Costs are read from
+    the calibration file in *directory*, or are measured and written into it
+    when they are not available or when *recalibrate* is true.  Costs are
+    kept in memory after the first call."""
+
+    path = _path(directory)
+    machine = _machine()
+    if not recalibrate and path in _costs:
+        return _costs[path]
+    data = {}
+    try:
+        with open(path) as inp:
+            data = json.load(inp)
+    except (IOError, OSError, ValueError):
+        pass
+    if recalibrate or machine not in data:
+        data[machine] = calibrate()
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            temp = '{}.{}'.format(path, os.getpid())
+            with open(temp, 'w') as out:
+                json.dump(data, out, indent=1, sort_keys=True)
+            getattr(os, 'replace', os.rename)(temp, path)
+        except (IOError, OSError):
+            pass
+    costs = _costs[path] = data[machine]
+    return costs
+
+
+def density(array):
+    """Return fraction of non-zero elements in a strided sample of
+    *array*."""
+
+    step = max(array.size // SAMPLE, 1)
+    sample = array.flat[::step]
+    if not sample.size:
+        return 0.
+    return numpy.count_nonzero(sample) / float(sample.size)
+
+
+def estimate(arrays, conjunction=True, costs=None):
+    """Return a dictionary of estimated costs of strategies for evaluating
+    logical *and* (when *conjunction* is true) or *or* operation on
+    *arrays*.  Operands are assumed to be independent."""
+
+    if costs is None:
+        costs = load_costs()
+    size = float(arrays[0].size)
+    fractions = [density(a) if conjunction else 1. - density(a)
+                 for a in arrays]
+    count = len(arrays)
+
+    dense = size * (count - 1) * costs['dense']
+
+    undecided = fractions[0]
+    short = size * costs['scan'] + size * undecided * costs['emit']
+    for fraction in reversed(fractions[1:]):
+        short += size * undecided * (costs['gather'] + costs['emit'])
+        undecided *= fraction
+    short += size * undecided * costs['scatter']
+
+    undecided = fractions[0]
+    visits = 1.
+    for fraction in fractions[1:]:
+        visits += 1. - (1. - undecided) ** CHUNK
+        undecided *= fraction
+    chunked = size * visits * costs['chunk']
+
+    return {'dense': dense, 'shortcircuit': short, 'chunked': chunked}
+
+
+def choose_strategy(arrays, conjunction=True, costs=None):
+    """Return name of the strategy with the lowest estimated cost, see
+    :func:`.estimate`."""
+
+    estimates = estimate(arrays, conjunction, costs)
+    return min(STRATEGIES, key=estimates.__getitem__)
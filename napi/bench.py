@@ -0,0 +1,252 @@
+"""This module defines a benchmark suite that compares *napi* functions and
+transformers with plain NumPy operations.  Run it as follows::
+
+  $ python -m napi.bench --output before.json
+  $ python -m napi.bench --output after.json --compare before.json
+
+Benchmarks vary array size, number of dimensions, dtype, number of operands,
+density of **True** elements, and :term:`short-circuiting` threshold, one at
+a time around a baseline configuration.  :func:`.neval` with
+:class:`.NapiTransformer`, :class:`.CompiledTransformer`, and
+:class:`.LazyTransformer`, and
+:func:`.napi_and`, :func:`.napi_or`, and :func:`.napi_compare` functions are
+timed.  Results are written in JSON format, and timings of a previous run
+can be compared to detect performance regressions."""
+
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+from functools import reduce
+
+import numpy
+
+__all__ = ['BASELINE', 'VARIATIONS', 'iter_cases', 'make_operands',
+           'run_case', 'run', 'compare', 'main']
+
+BASELINE = {'size': 1000000, 'ndim': 1, 'dtype': 'bool', 'operands': 3,
+            'density': 0.5, 'sc': 0}
+
+VARIATIONS = {
+    'size': [100, 10000, 20000, 100000, 10000000],
+    'ndim': [2, 3],
+    'dtype': ['int32', 'float64'],
+    'operands': [2, 5, 8],
+    'density': [0.001, 0.1, 0.9, 0.999],
+    'sc': [1000, 10000],
+}
+
+QUICK = {'size': 10000}
+
+BENCHMARKS = ['napi_and', 'napi_or', 'napi_compare', 'neval', 'compiled',
+              'lazy']
+
+
+def iter_cases(benchmarks=BENCHMARKS, baseline=BASELINE,
+               variations=VARIATIONS):
+    """Yield dictionaries of benchmark parameters, varying parameters one at
+    a time around *baseline*."""
+
+    for name in benchmarks:
+        yield dict(baseline, benchmark=name)
+        for key in sorted(variations):
+            for value in variations[key]:
+                if value != baseline[key]:
+                    params = dict(baseline, benchmark=name)
+                    params[key] = value
+                    yield params
+
+
+def make_operands(params, seed=0):
+    """Return a list of operand arrays for benchmark *params*.  Arrays have
+    *size* elements in *ndim* dimensions, and a *density* fraction of their
+    elements are **True** or non-zero."""
+
+    random = numpy.random.RandomState(seed)
+    ndim = params['ndim']
+    side = int(round(params['size'] ** (1. / ndim)))
+    shape = (side,) * (ndim - 1) + (params['size'] // side ** (ndim - 1),)
+    return [(random.random_sample(shape) < params['density'])
+            .astype(params['dtype']) for i in range(params['operands'])]
+
+
+def _functions(params, arrays):
+    """Return a pair of callables that evaluate benchmark *params* using
+    *napi* and NumPy."""
+
+    from napi import neval
+    from napi.transformers import napi_and, napi_or, napi_compare
+    from napi.transformers import NapiTransformer, LazyTransformer
+    from napi.transformers import CompiledTransformer
+
+    name = params['benchmark']
+    kwargs = {'sc': params['sc']}
+    if name == 'napi_and':
+        return (lambda: napi_and(list(arrays), **kwargs),
+                lambda: reduce(numpy.logical_and, arrays))
+    if name == 'napi_or':
+        return (lambda: napi_or(list(arrays), **kwargs),
+                lambda: reduce(numpy.logical_or, arrays))
+    if name == 'napi_compare':
+        # a chained comparison 0 <= a0 < a1 < ... < hi of *operands* arrays,
+        # where ai = a0 + i, so that *density* elements are true
+        dtype = 'float64' if params['dtype'] == 'bool' else params['dtype']
+        random = numpy.random.RandomState(0)
+        a = random.random_sample(arrays[0].shape) * 1000
+        values = [(a + i).astype(dtype) for i in range(len(arrays))]
+        hi = params['density'] * 1000 + len(arrays) - 1
+        ops = ['LtE'] + ['Lt'] * len(values)
+        comparators = values[1:] + [hi]
+
+        def plain():
+            masks = [0 <= values[0]]
+            masks.extend(left < right for left, right
+                         in zip(values, comparators))
+            return reduce(numpy.logical_and, masks)
+
+        return (lambda: napi_compare(0, ops, list(values) + [hi], **kwargs),
+                plain)
+    names = ['a{}'.format(i) for i in range(len(arrays))]
+    ns = dict(zip(names, arrays))
+    source = ' and '.join(names)
+    kwargs['transformer'] = {'neval': NapiTransformer,
+                             'compiled': CompiledTransformer,
+                             'lazy': LazyTransformer}[name]
+    return (lambda: neval(source, ns, **kwargs),
+            lambda: reduce(numpy.logical_and, arrays))
+
+
+def _best(func, repeat):
+    """Return the best time per call of *func* in seconds."""
+
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= 0.05 or number >= 10000:
+            break
+        number *= 10
+    times = [elapsed]
+    if repeat > 1:
+        times.extend(timer.repeat(repeat - 1, number))
+    return min(times) / number
+
+
+def run_case(params, repeat=3):
+    """Return a dictionary of benchmark *params* and timings of *napi* and
+    NumPy, and their ratio."""
+
+    arrays = make_operands(params)
+    napi_func, numpy_func = _functions(params, arrays)
+    result = dict(params)
+    result['napi'] = _best(napi_func, repeat)
+    result['numpy'] = _best(numpy_func, repeat)
+    result['ratio'] = result['napi'] / result['numpy']
+    return result
+
+
+def run(cases, repeat=3, stream=None):
+    """Run benchmark *cases* and return results, a dictionary that contains
+    information on the platform and package versions and a list of case
+    results.  When *stream* is given, results are reported as they become
+    available."""
+
+    import napi
+
+    results = {'napi': napi.__version__, 'numpy': numpy.__version__,
+               'python': platform.python_version(),
+               'machine': platform.machine(),
+               'processor': platform.processor(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'results': []}
+    for params in cases:
+        result = run_case(params, repeat)
+        results['results'].append(result)
+        if stream is not None:
+            stream.write(_format(result) + '\n')
+            stream.flush()
+    return results
+
+
+def _key(result):
+
+    return tuple(sorted((key, result[key]) for key in
+                        ['benchmark'] + sorted(BASELINE)))
+
+
+def _format(result, previous=None):
+
+    line = ('{benchmark:<13s} size={size:<9d} ndim={ndim} '
+            'dtype={dtype:<8s} operands={operands} density={density:<6g} '
+            'sc={sc:<6d} napi={napi:.3e}s numpy={numpy:.3e}s '
+            'ratio={ratio:.2f}').format(**result)
+    if previous is not None:
+        line += ' change={:.2f}'.format(result['napi'] / previous['napi'])
+    return line
+
+
+def compare(results, previous, threshold=1.2, stream=sys.stdout):
+    """Compare *results* with *previous* results and report cases whose
+    *napi* timings changed.  Return a list of cases that became slower by
+    more than *threshold* fold."""
+
+    previous = dict((_key(result), result)
+                    for result in previous['results'])
+    slower = []
+    for result in results['results']:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        change = result['napi'] / old['napi']
+        if change > threshold:
+            slower.append(result)
+        stream.write(_format(result, old) +
+                     (' SLOWER' if change > threshold else '') + '\n')
+    return slower
+
+
+def main(argv=None):
+    """Run benchmarks using command line arguments *argv*."""
+
+    parser = argparse.ArgumentParser(prog='python -m napi.bench',
+        description='Compare napi with plain NumPy operations.')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write results to FILE in JSON format')
+    parser.add_argument('-c', '--compare', metavar='FILE',
+                        help='compare results with those in FILE')
+    parser.add_argument('-b', '--benchmark', action='append',
+                        choices=BENCHMARKS,
+                        help='run only given benchmarks')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timing repeats (default: 3)')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2,
+                        help='slow down ratio reported as regression '
+                             '(default: 1.2)')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='use small arrays for a quick run')
+    args = parser.parse_args(argv)
+
+    baseline = dict(BASELINE, **QUICK) if args.quick else BASELINE
+    variations = VARIATIONS
+    if args.quick:
+        variations = dict(VARIATIONS,
+                          size=[n for n in VARIATIONS['size'] if n <= 10000])
+    cases = iter_cases(args.benchmark or BENCHMARKS, baseline, variations)
+    results = run(cases, args.repeat, sys.stdout)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as inp:
+            previous = json.load(inp)
+        sys.stdout.write('\nComparison with {}:\n'.format(args.compare))
+        slower = compare(results, previous, args.threshold)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
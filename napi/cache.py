@@ -0,0 +1,317 @@
+"""This module defines a bounded cache for code objects compiled from
+transformed abstract syntax trees.
+
+:func:`.ncompile`, and :func:`.neval` and :func:`.nexec` when they are used
+with :class:`.LazyTransformer`, store code objects in :data:`code_cache`,
+so that parsing, transformation, and compilation of the same source is
+performed only once:
+
+>>> from napi.cache import code_cache
+>>> code_cache.maxsize = 1024
+>>> code_cache.info()
+{'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 1024}
+>>> code_cache.clear()
+
+Code objects can also be persisted on disk, so that short-lived processes
+do not transform the same expressions again.  :func:`enable_disk` attaches
+a :class:`DiskCache` to :data:`code_cache`, which is consulted when a code
+object is not in memory:
+
+>>> from napi.cache import enable_disk
+>>> disk = enable_disk()  # doctest: +SKIP
+
+Setting :envvar:`NAPI_DISK_CACHE` environment variable to a directory, or to
+``1`` for the default directory, enables the disk cache when this module
+is imported.  The default directory is :file:`code` in :envvar:`NAPI_HOME`
+or :file:`~/.napi`.  Entries are keyed on source, transformer options,
+*napi* version, and Python version, and least recently used entries are
+removed when the total size exceeds *maxbytes*."""
+
+import os
+import sys
+import types
+import marshal
+import hashlib
+import threading
+from collections import OrderedDict
+
+__all__ = ['CodeCache', 'DiskCache', 'code_cache', 'make_key',
+           'enable_disk', 'disable_disk']
+
+
+def make_key(source, filename, mode, transformer, options):
+    """Return a key for storing a code object compiled from *source* using
+    *transformer* with *options*.  If an option value is not hashable,
+    return **None** to indicate that the code object cannot be cached."""
+
+    key = (source, filename, mode, transformer,
+           tuple(sorted(options.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class CodeCache(object):
+
+    """A least-recently-used cache of code objects.  When number of stored
+    items exceeds *maxsize*, least recently used items are discarded.
+    Number of cache hits and misses are counted.  When *disk* is a
+    :class:`DiskCache`, items missing in memory are looked up on disk, and
+    stored items are also written to disk."""
+
+    def __init__(self, maxsize=256, disk=None):
+
+        self.maxsize = maxsize
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+
+        return len(self._data)
+
+    def __contains__(self, key):
+
+        return key in self._data
+
+    def get(self, key):
+        """Return code object stored for *key* and mark it as recently used.
+        If *key* is not in the cache, return **None**."""
+
+        try:
+            code = self._data.pop(key)
+        except KeyError:
+            code = None if self.disk is None else self.disk.get(key)
+            if code is None:
+                self.misses += 1
+                return None
+        self._store(key, code)
+        self.hits += 1
+        return code
+
+    def set(self, key, code):
+        """Store *code* for *key*, discarding least recently used items."""
+
+        self._store(key, code)
+        if self.disk is not None:
+            self.disk.set(key, code)
+
+    def _store(self, key, code):
+
+        self._data.pop(key, None)
+        self._data[key] = code
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all items and reset hit and miss counters."""
+
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Return a dictionary of cache statistics."""
+
+        info = {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+        if self.disk is not None:
+            info['disk'] = self.disk.info()
+        return info
+
+
+def _stable(item):
+    """Return a string that identifies *item* across processes, or **None**
+    if *item* cannot be identified, e.g. a code object."""
+
+    if item is None or isinstance(item, (bool, int, float, str, bytes)):
+        return repr(item)
+    if isinstance(item, type):
+        return '{}.{}'.format(item.__module__, item.__name__)
+    if isinstance(item, tuple):
+        items = [_stable(each) for each in item]
+        if None in items:
+            return None
+        return '(' + ', '.join(items) + ')'
+    return None
+
+
+class DiskCache(object):
+
+    """A cache of marshalled code objects stored in *directory*, one file
+    per code object.  Files are written atomically, so that processes can
+    share a directory, and when total size of files exceeds *maxbytes*,
+    least recently used files are removed."""
+
+    suffix = '.code'
+
+    def __init__(self, directory=None, maxbytes=64 * 2 ** 20):
+
+        if directory is None:
+            directory = os.path.join(
+                os.environ.get('NAPI_HOME', os.path.join(
+                    os.path.expanduser('~'), '.napi')), 'code')
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def digest(self, key):
+        """Return file name for *key*, or **None** if *key* cannot be
+        stored on disk."""
+
+        key = _stable(key)
+        if key is None:
+            return None
+        import napi
+        text = '\n'.join([napi.__version__, sys.version,
+                          str(marshal.version), key])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest() + self.suffix
+
+    def get(self, key):
+        """Return code object stored for *key*, or **None**.  Runtime
+        functions are bound to the code object, see :func:`.bind`."""
+
+        from .transformers import bind
+
+        name = self.digest(key)
+        if name is None:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as inp:
+                code = marshal.loads(inp.read())
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except (EOFError, ValueError, TypeError):
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except (IOError, OSError):
+            pass
+        self.hits += 1
+        return bind(code)
+
+    def set(self, key, code):
+        """Write *code* for *key* into a temporary file and rename it, and
+        remove least recently used files when size exceeds the limit.
+        Objects other than code objects, such as parsed expressions stored
+        by :func:`.pushdown_plan`, are not written.  Runtime functions bound
+        to *code* are unbound before marshalling, see :func:`.unbind`."""
+
+        from .transformers import unbind
+
+        if not isinstance(code, types.CodeType):
+            return
+        name = self.digest(key)
+        if name is None:
+            return
+        data = marshal.dumps(unbind(code))
+        path = os.path.join(self.directory, name)
+        temp = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(temp, 'wb') as out:
+                out.write(data)
+            getattr(os, 'replace', os.rename)(temp, path)
+        except (IOError, OSError):
+            self._remove(temp)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += len(data)
+            if self._size > self.maxbytes:
+                self.evict()
+
+    def _remove(self, path):
+
+        try:
+            os.remove(path)
+        except (IOError, OSError):
+            pass
+
+    def _files(self):
+        """Return a list of *(mtime, size, path)* tuples of stored files."""
+
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except (IOError, OSError):
+            return files
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except (IOError, OSError):
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        """Return total size of stored files in bytes."""
+
+        return sum(size for _, size, _ in self._files())
+
+    def evict(self, maxbytes=None):
+        """Remove least recently used files until their total size is below
+        three quarters of *maxbytes*."""
+
+        if maxbytes is None:
+            maxbytes = self.maxbytes
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        limit = maxbytes * 3 // 4
+        while files and size > limit:
+            _, each, path = files.pop(0)
+            self._remove(path)
+            size -= each
+        self._size = size
+
+    def clear(self):
+        """Remove all stored files and reset hit and miss counters."""
+
+        self.evict(0)
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Return a dictionary of cache statistics."""
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'bytes': self.size(), 'maxbytes': self.maxbytes,
+                'directory': self.directory}
+
+
+code_cache = CodeCache()
+
+
+def enable_disk(directory=None, maxbytes=64 * 2 ** 20):
+    """Attach a :class:`DiskCache` to :data:`code_cache` and return it."""
+
+    code_cache.disk = DiskCache(directory, maxbytes)
+    return code_cache.disk
+
+
+def disable_disk():
+    """Detach disk cache from :data:`code_cache`."""
+
+    code_cache.disk = None
+
+
+if os.environ.get('NAPI_DISK_CACHE'):
+    enable_disk(None if os.environ['NAPI_DISK_CACHE'] == '1'
+                else os.environ['NAPI_DISK_CACHE'])
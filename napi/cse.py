@@ -0,0 +1,187 @@
+"""This module defines common subexpression elimination for logical
+operations and comparisons.
+
+Generated expressions often repeat comparisons, such as ``x > 0`` in
+``(x > 0 and y) or (x > 0 and z)``, which are then computed for each
+occurrence.  When *cse* option is true, structurally identical pure
+subexpressions are computed once per evaluation:
+
+>>> neval('(x > 0 and y) or (x > 0 and z)', cse=True)  # doctest: +SKIP
+
+Pure subexpressions are names, constants, attribute reads, subscripts,
+comparisons, and arithmetic, logical, and unary operations of pure
+subexpressions.  Function calls are never eliminated.
+
+:class:`.LazyTransformer` and :class:`.CompiledTransformer` run
+:func:`eliminate` over the AST before rewriting it, so that the first
+evaluated occurrence of a repeated subexpression is assigned to a temporary
+name, e.g. ``(__cse0__ := x > 0)``, and other occurrences read it.  This
+requires assignment expressions, i.e. Python 3.8 or later, and is not
+performed when operands are deferred using *defer* option, since deferred
+operands may never be evaluated.  :class:`.NapiTransformer` keeps values of
+evaluated subexpressions in its :class:`.Frame` instead."""
+
+import ast
+
+__all__ = ['eliminate', 'is_pure', 'release', 'TEMP']
+
+TEMP = '__cse{}__'
+
+NamedExpr = getattr(ast, 'NamedExpr', None)
+
+LEAVES = tuple(getattr(ast, name) for name in
+               ('Name', 'Constant', 'Num', 'Str', 'Bytes', 'NameConstant',
+                'Ellipsis') if hasattr(ast, name))
+
+NODES = tuple(getattr(ast, name) for name in
+              ('Attribute', 'Subscript', 'Compare', 'BinOp', 'UnaryOp',
+               'BoolOp', 'Tuple', 'Index', 'Slice', 'ExtSlice')
+              if hasattr(ast, name))
+
+CANDIDATES = (ast.Attribute, ast.Subscript, ast.Compare, ast.BinOp,
+              ast.UnaryOp, ast.BoolOp)
+
+OPERATORS = (ast.operator, ast.cmpop, ast.boolop, ast.unaryop,
+             ast.expr_context)
+
+OPAQUE = tuple(getattr(ast, name) for name in
+               ('Lambda', 'ListComp', 'SetComp', 'DictComp', 'GeneratorExp')
+               if hasattr(ast, name))
+
+BINDING = tuple(getattr(ast, name) for name in
+                ('NamedExpr', 'Yield', 'YieldFrom', 'Await')
+                if hasattr(ast, name))
+
+
+def is_pure(node):
+    """Return **True** if evaluating *node* has no side effects other than
+    reading names and attributes."""
+
+    if isinstance(node, LEAVES):
+        return True
+    if not isinstance(node, NODES):
+        return False
+    for child in ast.iter_child_nodes(node):
+        if not isinstance(child, OPERATORS) and not is_pure(child):
+            return False
+    return True
+
+
+def _size(node):
+
+    return sum(1 for _ in ast.walk(node))
+
+
+def _eager(node):
+    """Yield child expressions of *node* that are always evaluated, in order
+    of evaluation."""
+
+    if isinstance(node, OPAQUE):
+        return
+    if isinstance(node, ast.IfExp):
+        yield node.test
+    elif isinstance(node, ast.Dict):
+        for key, value in zip(node.keys, node.values):
+            if key is not None:
+                yield key
+            yield value
+    else:
+        for child in ast.iter_child_nodes(node):
+            if not isinstance(child, OPERATORS):
+                yield child
+
+
+def _occurrences(node, found, parent=None):
+    """Collect pure candidate subexpressions of *node* in order of
+    evaluation, as *(parent, node)* pairs keyed by :func:`ast.dump`."""
+
+    if (isinstance(node, CANDIDATES) and
+            isinstance(getattr(node, 'ctx', ast.Load()), ast.Load) and
+            is_pure(node)):
+        found.setdefault(ast.dump(node), []).append((parent, node))
+    for child in _eager(node):
+        _occurrences(child, found, node)
+
+
+def _branches(node):
+    """Yield conditional expressions in the eagerly evaluated part of
+    *node*, whose branches are eliminated separately."""
+
+    if isinstance(node, ast.IfExp):
+        yield node
+    for child in _eager(node):
+        for item in _branches(child):
+            yield item
+
+
+def _replace(parent, old, new):
+
+    for field, value in ast.iter_fields(parent):
+        if value is old:
+            setattr(parent, field, new)
+            return
+        if isinstance(value, list):
+            for i, item in enumerate(value):
+                if item is old:
+                    value[i] = new
+                    return
+
+
+def _root(node, counter):
+    """Eliminate repeated subexpressions of expression *node*, and return
+    the new node."""
+
+    if any(isinstance(item, BINDING) for item in ast.walk(node)):
+        return node
+    holder = ast.Expression(body=node)
+    while True:
+        found = {}
+        _occurrences(holder.body, found, holder)
+        repeated = [items for items in found.values() if len(items) > 1]
+        if not repeated:
+            break
+        items = max(repeated, key=lambda items: _size(items[0][1]))
+        name = TEMP.format(next(counter))
+        first = items[0][1]
+        _replace(items[0][0], first, ast.copy_location(NamedExpr(
+            target=ast.Name(id=name, ctx=ast.Store()), value=first), first))
+        for parent, item in items[1:]:
+            _replace(parent, item, ast.copy_location(
+                ast.Name(id=name, ctx=ast.Load()), item))
+    for item in list(_branches(holder.body)):
+        item.body = _root(item.body, counter)
+        item.orelse = _root(item.orelse, counter)
+    return holder.body
+
+
+class _Eliminator(ast.NodeTransformer):
+
+    def __init__(self):
+
+        self._counter = iter(range(2 ** 31))
+
+    def visit(self, node):
+
+        if isinstance(node, ast.expr):
+            return ast.fix_missing_locations(_root(node, self._counter))
+        return self.generic_visit(node)
+
+
+def eliminate(tree):
+    """Replace repeated pure subexpressions in each expression of *tree*
+    with assignment expressions and names, and return *tree*.  Statements
+    are processed separately, since names may be rebound between them.
+    *tree* is returned unchanged when assignment expressions are not
+    supported."""
+
+    if NamedExpr is None:
+        return tree
+    return _Eliminator().visit(tree)
+
+
+def release(code, namespace):
+    """Remove temporary names assigned by *code* from *namespace*."""
+
+    for name in code.co_names:
+        if name.startswith('__cse') and name.endswith('__'):
+            namespace.pop(name, None)
@@ -0,0 +1,153 @@
+"""This module defines a decorator that gives functions *napi* semantics.
+
+Source of a function decorated with :func:`.vectorize_logic` is transformed
+using :class:`.LazyTransformer` once, when the function is defined, so that
+calls to the function do not parse or transform any strings:
+
+>>> from numpy import arange
+>>> from napi import vectorize_logic
+>>> @vectorize_logic
+... def between(a, lo, hi):
+...     return lo <= a < hi and a != 3
+>>> between(arange(6), 1, 5)
+array([False,  True,  True, False,  True, False], dtype=bool)
+
+Keyword arguments of the decorator are passed to the transformer, e.g.
+``@vectorize_logic(sc=10000, defer=True)``, and *transformer* option
+selects another transformer class, such as :class:`.CompiledTransformer`.
+Defaults, keyword-only defaults, closures, and globals of the function are
+preserved, and functions defined in classes keep their name mangling and
+argument-less :func:`super` calls.  Runtime functions that transformed code
+calls are bound in the closure of the function, so that no names are added
+to globals of its module.
+
+Transformed code is stored in :data:`napi.cache.code_cache`, keyed on code
+object of the function and transformer options, so that functions created
+repeatedly, e.g. by a factory function, are transformed only once.  The
+decorator must be applied to a function directly, since source of the
+function is used."""
+
+import ast
+import inspect
+import textwrap
+import functools
+from types import FunctionType, CodeType
+
+from .cache import code_cache, make_key
+from .transformers import LazyTransformer, runtime
+
+__all__ = ['vectorize_logic', 'transform_function']
+
+PREFIX = '_napi_'
+
+
+def _find_code(code, name):
+    """Return code object of function *name* nested in *code*."""
+
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            if const.co_name == name:
+                return const
+            found = _find_code(const, name)
+            if found is not None:
+                return found
+    return None
+
+
+def _cell(value):
+    """Return a closure cell that holds *value*."""
+
+    return (lambda: value).__closure__[0]
+
+
+def _wrapper(func, prefix):
+    """Return source of a module with a function that defines free variables
+    of *func* and runtime functions with *prefix*, and, for methods, a class
+    with the name of the owner class, in which the transformed function is
+    to be inserted.  Runtime functions are thus free variables of the
+    transformed function, rather than globals of its module."""
+
+    lines = ['def __napi_outer__():']
+    indent = '    '
+    for name in func.__code__.co_freevars + tuple(sorted(runtime(prefix))):
+        if name != '__class__':
+            lines.append(indent + '{} = None'.format(name))
+    parts = getattr(func, '__qualname__', func.__name__).split('.')
+    if len(parts) > 1 and parts[-2] != '<locals>':
+        lines.append(indent + 'class {}:'.format(parts[-2]))
+        indent += '    '
+    lines.append(indent + 'pass')
+    return '\n'.join(lines) + '\n'
+
+
+def transform_function(func, **kwargs):
+    """Return code object of *func* transformed using *transformer* with
+    options in *kwargs*.  Code objects are cached, see :func:`.ncompile`
+    for *cache* argument."""
+
+    cache = kwargs.pop('cache', True)
+    if cache is True:
+        cache = code_cache
+    elif cache is False:
+        cache = None
+    transformer = kwargs.pop('transformer', LazyTransformer)
+    kwargs.setdefault('prefix', PREFIX)
+
+    filename = func.__code__.co_filename
+    key = None
+    if cache is not None:
+        key = make_key(func.__code__, filename, 'function', transformer,
+                       kwargs)
+    if key is not None:
+        code = cache.get(key)
+        if code is not None:
+            return code
+
+    source = textwrap.dedent(inspect.getsource(func))
+    tree = ast.parse(source, filename, 'exec')
+    node = tree.body[0] if tree.body else None
+    if (not isinstance(node, (ast.FunctionDef,
+                              getattr(ast, 'AsyncFunctionDef', ())))
+            or node.name != func.__name__):
+        raise ValueError('source of {!r} is not a function definition'
+                         .format(func))
+    node.decorator_list = []
+    ast.increment_lineno(tree, func.__code__.co_firstlineno - 1)
+    node = transformer(**kwargs).visit(node)
+
+    module = ast.parse(_wrapper(func, kwargs['prefix']), filename, 'exec')
+    body = module.body[0]
+    while isinstance(body.body[-1], (ast.ClassDef, ast.FunctionDef)):
+        body = body.body[-1]
+    body.body[-1] = node
+    code = compile(ast.fix_missing_locations(module), filename, 'exec')
+    code = _find_code(code, func.__name__)
+    if key is not None:
+        cache.set(key, code)
+    return code
+
+
+def vectorize_logic(func=None, **kwargs):
+    """Return *func* with chained comparisons and logical operations in its
+    body replaced with calls to :func:`.napi_compare`, :func:`.napi_and`,
+    and :func:`.napi_or`.  When called without *func*, return a decorator
+    that passes *kwargs* to the transformer."""
+
+    if func is None:
+        return lambda func: vectorize_logic(func, **kwargs)
+    if hasattr(func, '__wrapped__'):
+        raise ValueError('vectorize_logic must be applied to a function '
+                         'before other decorators')
+
+    code = transform_function(func, **dict(kwargs))
+    prefix = kwargs.get('prefix', PREFIX)
+    cells = dict((name, _cell(value))
+                 for name, value in runtime(prefix).items())
+    cells.update(zip(func.__code__.co_freevars, func.__closure__ or ()))
+    closure = tuple(cells[name] for name in code.co_freevars) or None
+    result = FunctionType(code, func.__globals__, func.__name__,
+                          func.__defaults__, closure)
+    kwdefaults = getattr(func, '__kwdefaults__', None)
+    if kwdefaults:
+        result.__kwdefaults__ = dict(kwdefaults)
+    return functools.update_wrapper(result, func)
@@ -0,0 +1,440 @@
+"""This module defines plans that explain how *napi* evaluates an expression.
+
+:func:`.neval` returns a plan instead of the outcome when called with
+``explain=True``.  Logical operations and chained comparisons that are
+replaced with *napi* calls are nodes of the plan, and their operands are
+leaves:
+
+>>> from numpy import arange
+>>> from napi import neval
+>>> a = arange(100000)
+>>> print(neval('a > 10 and (a < 100 or a > 1000)', explain=True))
+napi_and 'a > 10 and (a < 100 or a > 1000)' shape=(100000,) dtype=bool ...
+  operand 'a > 10' shape=(100000,) dtype=bool
+  napi_or 'a < 100 or a > 1000' shape=(100000,) dtype=bool ...
+    operand 'a < 100' shape=(100000,) dtype=bool
+    operand 'a > 1000' shape=(100000,) dtype=bool
+
+For each node, the plan tells the *strategy* that will be used, i.e.
+``'dense'``, ``'shortcircuit'``, ``'adaptive'``, ``'chunked'``,
+``'packed'``, ``'fused'``, ``'deferred'`` or ``'decided'``, whether arrays
+will be squeezed or broadcast, and estimated number of array elements
+visited and bytes of temporary arrays.  Estimates assume that no operand
+decides the outcome early, unless density of the first operand is known.
+
+Shapes and dtypes of operands are inferred from names, constants,
+arithmetic operations and comparisons without evaluating them.  When
+*explain* is ``'run'``, operands are evaluated, and each node is evaluated
+and annotated with measured *time*, in seconds, and number of *survivors*,
+i.e. elements that are **True**.  Note that measured times of nodes include
+times of their descendants.
+
+In IPython, ``%napi explain expr`` and ``%napi explain --run expr`` print
+plans using options of the ``%napi`` magic."""
+
+import ast
+import copy
+import time
+
+from ast import Expression
+from ast import fix_missing_locations as fml
+
+import numpy
+from numpy import ndarray
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+from .kernels import FUSE, range_bounds
+from .masks import PackedMask
+from .adaptive import AUTO, density
+from .transformers import ARRAYS, RESERVED, LazyTransformer
+from .transformers import NapiTransformer, CompiledTransformer
+from .transformers import blockwise, broadcast_shape, bind
+
+__all__ = ['Plan', 'Planner', 'explain']
+
+UNKNOWN = object()
+
+
+class Plan(object):
+
+    """A node of an evaluation plan of *kind* ``'napi_and'``, ``'napi_or'``,
+    ``'napi_compare'``, or ``'operand'`` for *source* expression, whose
+    outcome has *shape* and *dtype*.  Estimates and measurements are stored
+    in *details* dictionary."""
+
+    def __init__(self, kind, source, shape=None, dtype=None, children=(),
+                 **details):
+
+        self.kind = kind
+        self.source = source
+        self.shape = shape
+        self.dtype = dtype
+        self.children = list(children)
+        self.details = details
+        self.value = UNKNOWN
+
+    def __iter__(self):
+        """Yield this node and its descendants, depth first."""
+
+        yield self
+        for child in self.children:
+            for node in child:
+                yield node
+
+    def __str__(self):
+
+        return '\n'.join(self._lines(0))
+
+    __repr__ = __str__
+
+    def _lines(self, indent):
+
+        line = '{}{} {!r}'.format('  ' * indent, self.kind, self.source)
+        if self.shape is not None:
+            line += ' shape={}'.format(self.shape)
+        if self.dtype is not None:
+            line += ' dtype={}'.format(self.dtype)
+        for key in sorted(self.details):
+            value = self.details[key]
+            if isinstance(value, float):
+                value = '{:.3g}'.format(value)
+            line += ' {}={}'.format(key, value)
+        lines = [line]
+        for child in self.children:
+            lines.extend(child._lines(indent + 1))
+        return lines
+
+
+def _dtype(value):
+
+    if isinstance(value, PackedMask):
+        return numpy.dtype(bool)
+    try:
+        return numpy.asarray(value).dtype
+    except Exception:
+        return None
+
+
+def _shape(value):
+
+    if isinstance(value, ARRAYS):
+        return value.shape
+    return ()
+
+
+class Planner(ast.NodeVisitor):
+
+    """An :mod:`ast` visitor that returns a :class:`.Plan` for an expression
+    transformed by *transformer* with options in *kwargs*.  When *run* is
+    true, operands and nodes are evaluated."""
+
+    def __init__(self, source, globals, locals, transformer=NapiTransformer,
+                 run=False, **kwargs):
+
+        self._source = source
+        self._g, self._l = globals, locals
+        self._transformer = transformer
+        self._run = run
+        kwargs.pop('prefix', None)
+        kwargs.pop('bound', None)
+        kwargs.pop('cache', None)
+        self._kwargs = kwargs
+        self._lazy = issubclass(transformer, LazyTransformer)
+        if issubclass(transformer, CompiledTransformer):
+            self._sq = True
+            self._sc = kwargs.get('sc', 10000)
+        elif self._lazy:
+            self._sq = kwargs.get('sq', kwargs.get('squeeze', False))
+            self._sc = kwargs.get('sc', kwargs.get('shortcircuit', 0))
+        else:
+            self._sq = True
+            self._sc = kwargs.get('sc', 10000)
+
+    def _segment(self, node):
+
+        segment = getattr(ast, 'get_source_segment', None)
+        if segment is not None:
+            text = segment(self._source, node)
+            if text is not None:
+                return text
+        return ast.dump(node)
+
+    def evaluate(self, node):
+        """Return value of *node* evaluated using the transformer."""
+
+        expr = Expression(body=copy.deepcopy(node))
+        if self._lazy:
+            expr = self._transformer(bound=True, **self._kwargs).visit(expr)
+            code = bind(compile(fml(expr), '<explain>', 'eval'))
+            return eval(code, self._g, self._l)
+        trans = self._transformer(globals=self._g, locals=self._l,
+                                  **self._kwargs)
+        try:
+            expr = trans.visit(expr)
+            code = compile(fml(expr), '<explain>', 'eval')
+            return eval(code, self._g, trans.frame.scope(self._l))
+        finally:
+            trans.frame.clear()
+
+    def plan(self, node):
+        """Return plan of *node*, measuring times when *run* is true."""
+
+        if isinstance(node, Expression):
+            node = node.body
+        plan = self.visit(node)
+        if self._run:
+            for item in plan:
+                if item.kind != 'operand':
+                    start = time.time()
+                    value = self.evaluate(item._node)
+                    item.details['time'] = time.time() - start
+                    if isinstance(value, PackedMask):
+                        item.details['survivors'] = value.count()
+                    elif isinstance(value, ndarray):
+                        item.details['survivors'] = \
+                            int(numpy.count_nonzero(value))
+                    item.shape, item.dtype = _shape(value), _dtype(value)
+        return plan
+
+    def _leaf(self, node, shape=None, dtype=None, value=UNKNOWN):
+
+        children = [self.visit(child) for child in _nested(node)]
+        if self._run and value is UNKNOWN:
+            value = self.evaluate(node)
+        if value is not UNKNOWN:
+            shape, dtype = _shape(value), _dtype(value)
+        plan = Plan('operand', self._segment(node), shape, dtype, children)
+        plan.value = value
+        plan._node = node
+        return plan
+
+    def generic_visit(self, node):
+
+        return self._leaf(node)
+
+    def visit_Name(self, node):
+
+        for ns in (self._l, self._g):
+            if node.id in ns:
+                return self._leaf(node, value=ns[node.id])
+        if node.id in RESERVED:
+            return self._leaf(node, value=RESERVED[node.id])
+        if hasattr(builtins, node.id):
+            return self._leaf(node, value=getattr(builtins, node.id))
+        return self._leaf(node)
+
+    def visit_Num(self, node):
+
+        return self._leaf(node, value=node.n)
+
+    def visit_Str(self, node):
+
+        return self._leaf(node, value=node.s)
+
+    def visit_Constant(self, node):
+
+        return self._leaf(node, value=node.value)
+
+    visit_NameConstant = visit_Constant
+
+    def _infer(self, nodes, dtype=None):
+        """Return broadcast shape and result dtype of operand *nodes*, or
+        **None** for those that are not known."""
+
+        plans = [self.visit(node) for node in nodes]
+        shapes = [plan.shape for plan in plans]
+        shape = None
+        if None not in shapes:
+            try:
+                shape = broadcast_shape(shapes)
+            except ValueError:
+                shape = None
+        if dtype is None:
+            dtypes = [plan.dtype for plan in plans]
+            if None not in dtypes:
+                try:
+                    dtype = numpy.result_type(*dtypes)
+                except TypeError:
+                    dtype = None
+        return shape, dtype
+
+    def visit_BinOp(self, node):
+
+        if self._run:
+            return self._leaf(node)
+        shape, dtype = self._infer([node.left, node.right])
+        return self._leaf(node, shape, dtype)
+
+    def visit_UnaryOp(self, node):
+
+        if self._run:
+            return self._leaf(node)
+        dtype = numpy.dtype(bool) if isinstance(node.op, ast.Not) else None
+        shape, dtype = self._infer([node.operand], dtype)
+        return self._leaf(node, shape, dtype)
+
+    def visit_BoolOp(self, node):
+
+        conjunction = isinstance(node.op, ast.And)
+        children = [self.visit(value) for value in node.values]
+        plan = Plan('napi_and' if conjunction else 'napi_or',
+                    self._segment(node), children=children)
+        plan._node = node
+        self._estimate(plan, children, conjunction)
+        return plan
+
+    def visit_Compare(self, node):
+
+        if len(node.ops) == 1:
+            if self._run:
+                return self._leaf(node)
+            nodes = [node.left, node.comparators[0]]
+            if isinstance(node.ops[0], (ast.In, ast.NotIn)):
+                nodes = nodes[:1]
+            shape, dtype = self._infer(nodes, numpy.dtype(bool))
+            return self._leaf(node, shape, dtype)
+
+        children = [self.visit(value)
+                    for value in [node.left] + node.comparators]
+        plan = Plan('napi_compare', self._segment(node), children=children)
+        plan._node = node
+        ops = [op.__class__.__name__ for op in node.ops]
+        shapes = [child.shape for child in children]
+        if None in shapes:
+            plan.details['strategy'] = 'unknown'
+            return plan
+        try:
+            shape = broadcast_shape(shapes)
+        except ValueError:
+            plan.details['strategy'] = 'error'
+            return plan
+        plan.shape, plan.dtype = shape, numpy.dtype(bool)
+        size = int(numpy.prod(shape))
+        arrays = [child for child in children if child.shape]
+        if self._kwargs.get('defer', False):
+            plan.details.update(strategy='deferred', visits=size * len(ops),
+                                bytes=size * len(ops))
+            return plan
+        bounds = None
+        if self._kwargs.get('fuse', True):
+            proxies = [numpy.empty(1) if child.shape else 0
+                       for child in children]
+            bounds = range_bounds(proxies[0], ops, proxies[1:])
+        options = blockwise(shape, self._kwargs)
+        if ((bounds is not None and (options is not None or size > FUSE))
+                or (options is not None and
+                    len(set(child.shape for child in arrays)) == 1)):
+            plan.details.update(strategy='fused', visits=size * len(arrays),
+                                bytes=size)
+            return plan
+        masks = []
+        for i in range(len(ops)):
+            mask = Plan('operand', '', shape if (children[i].shape or
+                                                 children[i + 1].shape)
+                        else (), numpy.dtype(bool))
+            masks.append(mask)
+        self._estimate(plan, masks, True)
+        plan.details['visits'] += size * len(arrays)
+        plan.details['bytes'] += size * len(ops)
+        return plan
+
+    def _estimate(self, plan, children, conjunction):
+        """Set strategy and estimates of logical operation of *children*."""
+
+        details = plan.details
+        arrays = [child for child in children if child.shape]
+        if any(child.shape is None for child in children):
+            details['strategy'] = 'unknown'
+            return
+        for child in children:
+            if (not child.shape and child.value is not UNKNOWN and
+                    bool(child.value) != conjunction):
+                details.update(strategy='decided', visits=0)
+                if arrays:
+                    plan.shape = arrays[0].shape
+                    plan.dtype = numpy.dtype(bool)
+                    details['bytes'] = int(numpy.prod(plan.shape))
+                return
+        if not arrays:
+            return
+        shapes = set(child.shape for child in arrays)
+        shape = arrays[0].shape
+        if len(shapes) > 1:
+            if self._kwargs.get('bc', self._kwargs.get('broadcast', False)):
+                shape = broadcast_shape(shapes)
+                details['broadcast'] = True
+            elif self._sq:
+                squeezed = set(tuple(n for n in s if n != 1) for s in shapes)
+                if len(squeezed) > 1:
+                    details['strategy'] = 'error'
+                    return
+                shape = squeezed.pop()
+                details['squeeze'] = True
+            else:
+                details['strategy'] = 'error'
+                return
+        plan.shape, plan.dtype = shape, numpy.dtype(bool)
+        size = int(numpy.prod(shape))
+        count = len(arrays)
+        visits = size * count
+        nbytes = size
+        first = arrays[0].value
+        fraction = 1.
+        if isinstance(first, ndarray) and first.shape:
+            fraction = density(first)
+            if not conjunction:
+                fraction = 1. - fraction
+        sc = self._sc
+        if self._lazy and self._kwargs.get('defer', False):
+            strategy = 'deferred'
+        elif (self._kwargs.get('packed', False) or
+              any(isinstance(child.value, PackedMask) for child in arrays)):
+            strategy = 'packed'
+            nbytes = -(-size // 64) * 8 * 2
+        elif blockwise(shape, self._kwargs):
+            strategy = 'chunked'
+        elif sc == AUTO:
+            strategy = 'adaptive'
+        elif sc and size >= sc:
+            strategy = 'shortcircuit'
+            visits = int(size + (count - 1) * size * fraction)
+            nbytes += int(size * fraction) * len(shape) * 8
+        else:
+            strategy = 'dense'
+            if count > 2 and not details.get('broadcast'):
+                nbytes += sum(size * child.dtype.itemsize
+                              for child in arrays)
+        details.update(strategy=strategy, visits=visits, bytes=nbytes,
+                       shortcircuit=strategy == 'shortcircuit')
+
+
+def _nested(node):
+    """Yield logical operations and chained comparisons that are nested in
+    *node* without other logical operations between them."""
+
+    for child in ast.iter_child_nodes(node):
+        if (isinstance(child, ast.BoolOp) or
+                (isinstance(child, ast.Compare) and len(child.ops) > 1)):
+            yield child
+        elif not isinstance(child, ast.Lambda):
+            for item in _nested(child):
+                yield item
+
+
+def explain(expression, globals=None, locals=None, **kwargs):
+    """Return a :class:`.Plan` for evaluating *expression* using *globals*
+    and *locals* dictionaries.  When *run* is true, the expression is
+    evaluated and plan nodes are annotated with measured times.  Remaining
+    keyword arguments, including *transformer*, are those of
+    :func:`.neval`."""
+
+    if globals is None:
+        globals = {}
+    if locals is None:
+        locals = {}
+    node = ast.parse(expression, '<explain>', 'eval')
+    return Planner(expression, globals, locals, **kwargs).plan(node)
@@ -1,61 +1,271 @@
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
 
 
 def neval(expression, globals=None, locals=None, **kwargs):
     """Evaluate *expression* using *globals* and *locals* dictionaries as
     *global* and *local* namespace.  *expression* is transformed using
-    :class:`.NapiTransformer`."""
+    :class:`.CompiledTransformer`, that behaves like
+    :class:`.NapiTransformer`, or another transformer class passed as
+    *transformer* keyword argument.  When *transformer* is a
+    :class:`.LazyTransformer`, compiled code is cached and reused, see
+    :func:`.ncompile`.  When *debug* is true, :class:`.NapiTransformer` is
+    used by default.
 
-    try:
-        import __builtin__ as builtins
-    except ImportError:
-        import builtins
+    When *pushdown* is true, *expression* is evaluated using
+    :class:`.PushdownEvaluator`, that computes later operands of logical
+    operations only for elements whose outcome is not yet decided.
+
+    When *explain* is true, a :class:`.Plan` that describes how *expression*
+    would be evaluated is returned instead.  When *explain* is ``'run'``,
+    the plan is annotated with measured times, see :mod:`napi.explain`.
+
+    Other keyword arguments, such as *sc* (short-circuiting threshold, or
+    ``'auto'``, see :mod:`napi.adaptive`), *sq* (squeezing), *cse* (common
+    subexpression elimination, see :mod:`napi.cse`), *output*
+    (``'indices'``, ``'flat'``, or ``'count'`` for obtaining survivors
+    instead of a mask, see :func:`.napi_and`), *chunk* (number
+    of elements per block for block-wise evaluation), *threads* (number of
+    worker threads), and *grain* (minimum number of elements per thread) are
+    passed to the transformer, see :mod:`napi.kernels`."""
 
     from ast import parse
     from ast import fix_missing_locations as fml
 
+    from napi.transformers import LazyTransformer
+    from napi.instrument import measure
+    from napi.indexes import unpacked
+
     try:
-        transformer = kwargs['transformer']
+        transformer = kwargs.pop('transformer')
     except KeyError:
-        from napi.transformers import NapiTransformer as transformer
+        if kwargs.get('debug', False):
+            from napi.transformers import NapiTransformer as transformer
+        else:
+            from napi.transformers import CompiledTransformer as transformer
 
-    #try:
-    node = parse(expression, '<string>', 'eval')
-    #except ImportError:
-    #    builtins.eval(expression)
-    #else:
     if globals is None:
         globals = builtins.globals()
     if locals is None:
         locals = {}
-    trans = transformer(globals=globals, locals=locals, **kwargs)
-    trans.visit(node)
-    code = compile(fml(node), '<string>', 'eval')
-    return builtins.eval(code, globals, locals)
+
+    explain = kwargs.pop('explain', False)
+    if explain:
+        from napi.explain import explain as plan
+        kwargs.pop('pushdown', None)
+        return plan(expression, globals, locals, transformer=transformer,
+                    run=explain == 'run', **kwargs)
+
+    with measure(expression) as clock:
+
+        if kwargs.pop('pushdown', False):
+            from napi.pushdown import PushdownEvaluator, pushdown_plan
+            plan = pushdown_plan(expression, kwargs.pop('cache', True))
+            clock.mark('parse')
+            result = PushdownEvaluator(globals, locals, **kwargs).visit(plan)
+            clock.mark('evaluate')
+            return result
+
+        if issubclass(transformer, LazyTransformer):
+            kwargs.setdefault('bound', True)
+            code = ncompile(expression, '<string>', 'eval',
+                            transformer=transformer, **kwargs)
+            clock.mark()
+            result = builtins.eval(code, globals, locals)
+            if kwargs.get('cse'):
+                from napi.cse import release
+                release(code, locals)
+            clock.mark('evaluate')
+            return unpacked(result, kwargs)
+
+        kwargs.pop('cache', None)
+        output = kwargs.pop('output', None)
+        #try:
+        node = parse(expression, '<string>', 'eval')
+        #except ImportError:
+        #    builtins.eval(expression)
+        #else:
+        clock.mark('parse')
+        trans = transformer(globals=globals, locals=locals, **kwargs)
+        frame = getattr(trans, 'frame', None)
+        try:
+            trans.visit(node)
+            clock.mark('transform')
+            code = compile(fml(node), '<string>', 'eval')
+            result = builtins.eval(code, globals, locals if frame is None
+                                   else frame.scope(locals))
+        finally:
+            if frame is not None:
+                frame.clear()
+        if output is not None and output != 'mask':
+            from napi.transformers import survivors
+            result = survivors(result, output)
+        clock.mark('evaluate')
+        return unpacked(result, kwargs)
 
 
 def nexec(statement, globals=None, locals=None, **kwargs):
     """Execute *statement* using *globals* and *locals* dictionaries as
     *global* and *local* namespace.  *statement* is transformed using
-    :class:`.NapiTransformer`."""
+    :class:`.CompiledTransformer`, or another transformer class passed as
+    *transformer* keyword argument.
+
+    Logical operations and chained comparisons in loops and function bodies
+    are replaced with calls that are evaluated each time they are reached,
+    and compiled code is cached, so that executing a statement again does
+    not transform it again, see :func:`.ncompile`.  When *debug* is true,
+    :class:`.NapiTransformer` is used by default, which evaluates operations
+    once while transforming the statement."""
+
+    from ast import parse
+    from napi.transformers import LazyTransformer
+    from napi.instrument import measure
+    from ast import fix_missing_locations as fml
 
     try:
-        import __builtin__ as builtins
-    except ImportError:
-        import builtins
+        transformer = kwargs.pop('transformer')
+    except KeyError:
+        if kwargs.get('debug', False):
+            from napi.transformers import NapiTransformer as transformer
+        else:
+            from napi.transformers import CompiledTransformer as transformer
+
+    with measure(statement) as clock:
+
+        if issubclass(transformer, LazyTransformer):
+            if globals is None:
+                globals = builtins.globals()
+            if locals is None:
+                locals = {}
+            kwargs.setdefault('bound', True)
+            code = ncompile(statement, '<string>', 'exec',
+                            transformer=transformer, **kwargs)
+            clock.mark()
+            result = builtins.eval(code, globals, locals)
+            if kwargs.get('cse'):
+                from napi.cse import release
+                release(code, locals)
+            clock.mark('evaluate')
+            return result
+
+        kwargs.pop('cache', None)
+        try:
+            node = parse(statement, '<string>', 'exec')
+        except ImportError:#KeyError:
+            exec(statement)
+        else:
+            clock.mark('parse')
+            if globals is None:
+                globals = builtins.globals()
+            if locals is None:
+                locals = {}
+            trans = transformer(globals=globals, locals=locals, **kwargs)
+            frame = getattr(trans, 'frame', None)
+            try:
+                trans.visit(node)
+                clock.mark('transform')
+                code = compile(fml(node), '<string>', 'exec')
+                result = builtins.eval(code, globals, locals if frame is None
+                                       else frame.scope(locals))
+            finally:
+                if frame is not None:
+                    frame.clear()
+            clock.mark('evaluate')
+            return result
+
+
+def any_of(expression, globals=None, locals=None, **kwargs):
+    """Return **True** if any element of the outcome of *expression* is
+    true.  *expression* is evaluated block by block, until a block with a
+    true element is found, see :mod:`napi.reductions`.  Keyword arguments
+    are passed to the transformer, see :func:`.neval`."""
+
+    from napi.reductions import reduce_expression
+
+    if globals is None:
+        globals = builtins.globals()
+    if locals is None:
+        locals = {}
+    return reduce_expression('any', expression, globals, locals, **kwargs)
+
+
+def all_of(expression, globals=None, locals=None, **kwargs):
+    """Return **True** if all elements of the outcome of *expression* are
+    true.  *expression* is evaluated block by block, until a block with a
+    false element is found, see :mod:`napi.reductions`."""
+
+    from napi.reductions import reduce_expression
+
+    if globals is None:
+        globals = builtins.globals()
+    if locals is None:
+        locals = {}
+    return reduce_expression('all', expression, globals, locals, **kwargs)
+
+
+def count_of(expression, globals=None, locals=None, **kwargs):
+    """Return the number of true elements of the outcome of *expression*,
+    evaluated block by block without building the whole mask, see
+    :mod:`napi.reductions`."""
+
+    from napi.reductions import reduce_expression
+
+    if globals is None:
+        globals = builtins.globals()
+    if locals is None:
+        locals = {}
+    return reduce_expression('count', expression, globals, locals, **kwargs)
+
+
+def ncompile(source, filename='<string>', mode='eval', **kwargs):
+    """Compile *source* into a code object that can be executed by
+    :func:`eval` or :func:`exec`.  *source* is transformed using
+    :class:`.LazyTransformer`, so that chained comparisons and logical
+    operations are replaced with calls to :func:`.napi_compare`,
+    :func:`.napi_and`, and :func:`.napi_or`.  Remaining keyword arguments
+    are passed to the transformer.  When *bound* is true, runtime functions
+    are bound to the code object, see :func:`.bind`, otherwise they are
+    looked up by name, see :func:`.runtime`.
+
+    Code objects are stored in :data:`napi.cache.code_cache` and are keyed on
+    *source*, *filename*, *mode*, and transformer options.  Pass
+    ``cache=False`` to bypass the cache, or a :class:`.CodeCache` instance
+    to use it instead."""
 
     from ast import parse
-    from napi.transformers import NapiTransformer
     from ast import fix_missing_locations as fml
+    from napi.cache import code_cache, make_key
+    from napi.instrument import measure
+
+    cache = kwargs.pop('cache', True)
+    if cache is True:
+        cache = code_cache
+    elif cache is False:
+        cache = None
     try:
-        node = parse(statement, '<string>', 'exec')
-    except ImportError:#KeyError:
-        exec(statement)
-    else:
-        if globals is None:
-            globals = builtins.globals()
-        if locals is None:
-            locals = {}
-        trans = NapiTransformer(globals=globals, locals=locals, **kwargs)
-        trans.visit(node)
-        code = compile(fml(node), '<string>', 'exec')
-        return builtins.eval(code, globals, locals)
+        transformer = kwargs.pop('transformer')
+    except KeyError:
+        from napi.transformers import LazyTransformer as transformer
+
+    key = None
+    if cache is not None:
+        key = make_key(source, filename, mode, transformer, kwargs)
+    if key is not None:
+        code = cache.get(key)
+        if code is not None:
+            return code
+
+    with measure(source) as clock:
+        node = parse(source, filename, mode)
+        clock.mark('parse')
+        node = transformer(**kwargs).visit(node)
+        code = compile(fml(node), filename, mode)
+        if kwargs.get('bound', False):
+            from napi.transformers import bind
+            code = bind(code)
+        clock.mark('transform')
+    if key is not None:
+        cache.set(key, code)
+    return code
@@ -0,0 +1,181 @@
+"""This module defines an opt-in import hook that transforms whole modules
+using :class:`.LazyTransformer`.
+
+:func:`install` adds a :class:`NapiFinder` to :data:`sys.meta_path`.
+Modules whose name matches one of *prefixes*, or whose source starts with a
+marker comment, are transformed when they are imported:
+
+>>> import napi.importer
+>>> finder = napi.importer.install(prefixes=['filters'], sc=10000)
+>>> import filters.quality  # doctest: +SKIP
+
+A module is marked by a ``# napi: transform`` comment line in its first
+:data:`HEAD` bytes.  Marked modules are found only when *marker* option is
+true, which is the default, at the cost of reading the head of every source
+file imported after the hook is installed.  Pass ``marker=False`` to
+transform only modules matching *prefixes*.
+
+Keyword arguments of :func:`install` other than *prefixes* and *marker* are
+passed to the transformer.  Transformed bytecode is written to
+``__pycache__`` next to the source, e.g.
+``quality.cpython-311.napi-1a2b3c4d.pyc``, where the tag depends on *napi*
+version, transformer, and its options, so that later imports skip parsing
+and transformation and ordinary bytecode files are left untouched.
+
+This module requires Python 3."""
+
+import re
+import sys
+import ast
+import struct
+import marshal
+import hashlib
+from importlib import machinery, util
+
+from .transformers import LazyTransformer, bind, unbind
+
+__all__ = ['NapiFinder', 'NapiLoader', 'install', 'uninstall', 'MARKER',
+           'HEAD']
+
+MARKER = re.compile(br'^#[ \t]*napi:[ \t]*transform[ \t]*\r?$', re.M)
+
+HEAD = 2048
+
+
+def tag(transformer, options):
+    """Return bytecode file tag for *transformer* with *options*."""
+
+    import napi
+    text = repr((napi.__version__, transformer.__module__,
+                 transformer.__name__, sorted(options.items())))
+    return 'napi-' + hashlib.md5(text.encode()).hexdigest()[:8]
+
+
+class NapiLoader(machinery.SourceFileLoader):
+
+    """A source file loader that transforms modules using *transformer* with
+    *options*, and caches transformed bytecode under a *napi* tag.  Runtime
+    functions are bound to the code, see :func:`.bind`, so that no names
+    are added to module globals."""
+
+    def __init__(self, fullname, path, transformer=LazyTransformer,
+                 options=None):
+
+        machinery.SourceFileLoader.__init__(self, fullname, path)
+        self.transformer = transformer
+        self.options = dict(options or {})
+        self.options.setdefault('bound', True)
+        self.tag = tag(transformer, self.options)
+
+    def cache_path(self, path):
+        """Return path to transformed bytecode file of source *path*."""
+
+        cached = util.cache_from_source(path)
+        return cached[:-len('.pyc')] + '.' + self.tag + '.pyc'
+
+    def source_to_code(self, data, path, *args, **kwargs):
+
+        tree = ast.parse(data, path, 'exec')
+        tree = self.transformer(**self.options).visit(tree)
+        return bind(compile(ast.fix_missing_locations(tree), path, 'exec',
+                            dont_inherit=True))
+
+    def get_code(self, fullname):
+
+        path = self.get_filename(fullname)
+        cached = self.cache_path(path)
+        stats = self.path_stats(path)
+        header = util.MAGIC_NUMBER + struct.pack(
+            '<III', 0, int(stats['mtime']) & 0xFFFFFFFF,
+            stats['size'] & 0xFFFFFFFF)
+        try:
+            data = self.get_data(cached)
+        except OSError:
+            pass
+        else:
+            if data[:len(header)] == header:
+                try:
+                    return bind(marshal.loads(data[len(header):]))
+                except (EOFError, ValueError, TypeError):
+                    pass
+        code = self.source_to_code(self.get_data(path), path)
+        if not sys.dont_write_bytecode:
+            try:
+                self.set_data(cached, header + marshal.dumps(unbind(code)))
+            except (OSError, NotImplementedError):
+                pass
+        return code
+
+
+class NapiFinder(object):
+
+    """A :data:`sys.meta_path` finder that delegates to
+    :class:`importlib.machinery.PathFinder` and loads source modules matching
+    *prefixes* or marked with :data:`MARKER` using :class:`NapiLoader`."""
+
+    def __init__(self, prefixes=(), marker=True, transformer=LazyTransformer,
+                 **options):
+
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        self.prefixes = tuple(prefixes)
+        self.marker = marker
+        self.transformer = transformer
+        self.options = options
+
+    def matches(self, fullname):
+        """Return **True** if *fullname* is or is in one of prefixes."""
+
+        for prefix in self.prefixes:
+            if fullname == prefix or fullname.startswith(prefix + '.'):
+                return True
+        return False
+
+    def marked(self, path):
+        """Return **True** if source at *path* has a marker comment."""
+
+        try:
+            with open(path, 'rb') as inp:
+                return MARKER.search(inp.read(HEAD)) is not None
+        except OSError:
+            return False
+
+    def find_spec(self, fullname, path=None, target=None):
+
+        matches = self.matches(fullname)
+        if not matches and not self.marker:
+            return None
+        spec = machinery.PathFinder.find_spec(fullname, path, target)
+        if (spec is None or not spec.has_location or
+                not isinstance(spec.loader, machinery.SourceFileLoader)):
+            return None
+        if not matches and not self.marked(spec.origin):
+            return None
+        loader = NapiLoader(fullname, spec.origin, self.transformer,
+                            self.options)
+        spec.loader = loader
+        spec.cached = loader.cache_path(spec.origin)
+        return spec
+
+    def invalidate_caches(self):
+
+        machinery.PathFinder.invalidate_caches()
+
+
+def install(prefixes=(), marker=True, **kwargs):
+    """Insert a :class:`NapiFinder` at the beginning of :data:`sys.meta_path`
+    and return it.  Modules that are already imported are not affected."""
+
+    finder = NapiFinder(prefixes, marker, **kwargs)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def uninstall(finder=None):
+    """Remove *finder*, or all :class:`NapiFinder` instances, from
+    :data:`sys.meta_path`."""
+
+    sys.meta_path[:] = [item for item in sys.meta_path
+                        if not (item is finder or
+                                finder is None and
+                                isinstance(item, NapiFinder))]
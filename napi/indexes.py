@@ -0,0 +1,406 @@
+"""This module defines a registry of array indexes that answer comparisons
+without scanning arrays.
+
+An array whose elements are sorted in ascending order can be declared
+sorted, and for other arrays a sort permutation can be attached, so that
+range tests, such as ``lo <= t < hi``, and comparisons with a scalar, such
+as ``t == k``, are answered by :func:`numpy.searchsorted` in logarithmic
+time:
+
+>>> from napi.indexes import register_sorted
+>>> t = arange(10 ** 8)
+>>> index = register_sorted(t)
+>>> neval('1000 <= t < 2000', output='count')
+1000
+
+Masks are then built by setting a slice, or elements at indices in the
+permutation, instead of comparing elements, and survivors requested using
+*output* option are obtained without building a mask.  Chained range tests
+use indexes whenever arrays are registered.  Single comparisons are
+evaluated using indexes when *index* option is true, which routes them
+through :func:`.napi_compare`.
+
+For arrays with few distinct values, such as categories or status codes, a
+bitmap index keeps a :class:`.PackedMask` of elements equal to each value,
+which is built once:
+
+>>> from napi.indexes import register_bitmap
+>>> status = arange(10 ** 8) % 5
+>>> index = register_bitmap(status)
+>>> neval('status == 2 or status == 4 and x', index=True)  # doctest: +SKIP
+
+Equality and inequality tests, range tests, and membership tests, such as
+``status in (1, 3)``, are then answered by combining bitmaps, and when
+*index* option is true, :func:`.napi_and` and :func:`.napi_or` combine the
+packed masks directly, so that the array is never read.  The outcome of
+:func:`.neval` is unpacked to a boolean array unless *packed* option is
+true, but values assigned by statements are :class:`.PackedMask`
+instances.
+
+Registered arrays are made read-only, unless *freeze* is false, so that an
+index cannot silently become stale.  Views of writeable arrays are not
+registered, since their elements may change through the base array.  An
+index is dropped when its array is garbage collected or made writeable
+again, or when :func:`unregister` is called."""
+
+import weakref
+from numbers import Number
+
+import numpy
+
+from .kernels import range_bounds
+from .masks import PackedMask, packed_or
+
+__all__ = ['Index', 'SortedIndex', 'BitmapIndex', 'register_sorted',
+           'register_bitmap', 'unregister', 'lookup', 'clear',
+           'indexed_compare', 'unpacked', 'MAXVALUES']
+
+_registry = {}
+
+MAXVALUES = 256
+
+FLIP = {'Lt': 'Gt', 'LtE': 'GtE', 'Gt': 'Lt', 'GtE': 'LtE', 'Eq': 'Eq',
+        'NotEq': 'NotEq'}
+
+
+def _bases(array):
+    """Yield arrays that *array* is a view of."""
+
+    base = array.base
+    while isinstance(base, numpy.ndarray):
+        yield base
+        base = base.base
+
+
+class Index(object):
+
+    """Base class of indexes of *array*, that makes *array* read-only unless
+    *freeze* is false.  Derived classes keep distinct or sorted *values* of
+    the flattened array, of which those from position :attr:`stop` on are
+    NaNs, and answer comparisons by finding positions of values."""
+
+    def __init__(self, array, freeze=True):
+
+        self.shape = array.shape
+        self.size = array.size
+        self.bases = tuple(_bases(array))
+        if freeze and any(base.flags.writeable for base in self.bases):
+            raise ValueError('array is a view of a writeable array, '
+                             'register a copy or make the base read-only')
+        self.guarded = freeze
+        self.frozen = freeze and array.flags.writeable
+        if self.frozen:
+            array.flags.writeable = False
+        self._ref = weakref.ref(array)
+
+    def valid(self, array):
+        """Return **True** if index is still valid for *array*, i.e. when
+        *array* and arrays it is a view of remain read-only, unless the index
+        was built with *freeze* false."""
+
+        if self._ref() is not array:
+            return False
+        return not (self.guarded and
+                    (array.flags.writeable or
+                     any(base.flags.writeable for base in self.bases)))
+
+    def release(self):
+        """Restore writeability of the array if it was frozen."""
+
+        array = self._ref()
+        if array is not None and self.frozen and not array.flags.writeable:
+            try:
+                array.flags.writeable = True
+            except ValueError:
+                pass
+
+    def bounds(self, op, value):
+        """Return *(start, stop)* positions of sorted values for which
+        ``values op value`` is true.  For ``'NotEq'``, positions of values
+        that are equal are returned."""
+
+        values = self.values
+        if value != value:
+            return (0, 0)
+        if op in ('Eq', 'NotEq'):
+            return (int(numpy.searchsorted(values, value, 'left')),
+                    int(numpy.searchsorted(values, value, 'right')))
+        if op == 'Lt':
+            return 0, int(numpy.searchsorted(values, value, 'left'))
+        if op == 'LtE':
+            return 0, int(numpy.searchsorted(values, value, 'right'))
+        if op == 'Gt':
+            return (int(numpy.searchsorted(values, value, 'right')),
+                    self.stop)
+        return int(numpy.searchsorted(values, value, 'left')), self.stop
+
+    def range(self, lo, lo_strict, hi, hi_strict):
+        """Return *(start, stop)* positions of sorted values within the range
+        from *lo* to *hi*."""
+
+        if lo != lo or hi != hi:
+            return (0, 0)
+        start = self.bounds('Gt' if lo_strict else 'GtE', lo)[0]
+        stop = self.bounds('Lt' if hi_strict else 'LtE', hi)[1]
+        return start, max(start, stop)
+
+
+class SortedIndex(Index):
+
+    """An index of *array* whose flattened elements are sorted, or are
+    sorted when taken in *order*.  Elements are compared in order of the
+    flattened array."""
+
+    def __init__(self, array, order=None, freeze=True):
+
+        Index.__init__(self, array, freeze)
+        flat = array.reshape(-1)
+        self.order = order
+        if order is not None:
+            self.values = flat[order]
+        elif self.guarded:
+            self.values = flat
+        else:
+            self.values = flat.copy()
+        self.stop = self.size
+        if self.values.dtype.kind in 'fc':
+            self.stop = int(numpy.searchsorted(self.values, numpy.nan))
+
+    def select(self, start, stop, output=None, invert=False):
+        """Return a mask of elements at sorted positions from *start* to
+        *stop*, or of other elements when *invert* is true, or survivors in
+        *output* form, see :func:`.napi_and`."""
+
+        if output == 'count':
+            count = stop - start
+            return self.size - count if invert else count
+        if output is None:
+            mask = numpy.empty(self.size, bool)
+            mask.fill(invert)
+            if self.order is None:
+                mask[start:stop] = not invert
+            else:
+                mask[self.order[start:stop]] = not invert
+            return mask.reshape(self.shape)
+        if invert:
+            flat = numpy.flatnonzero(self.select(start, stop, None, True))
+        elif self.order is None:
+            flat = numpy.arange(start, stop)
+        else:
+            flat = numpy.sort(self.order[start:stop])
+        if output == 'flat':
+            return flat
+        return numpy.unravel_index(flat, self.shape)
+
+
+class BitmapIndex(Index):
+
+    """An index of *array* that keeps a :class:`.PackedMask` of elements
+    equal to each of its distinct *values*, which are sorted and do not
+    include NaNs.  Masks for comparisons are obtained by combining bitmaps
+    of matching values, without reading *array*."""
+
+    def __init__(self, array, values=None, freeze=True):
+
+        Index.__init__(self, array, freeze)
+        if values is None:
+            values = numpy.unique(array)
+        self.values = values[values == values]
+        self.stop = len(self.values)
+        self.bitmaps = [PackedMask.from_bool(array == value)
+                        for value in self.values]
+        self.counts = [bitmap.count() for bitmap in self.bitmaps]
+
+    def positions(self, values):
+        """Return positions of distinct values that are in *values*, a
+        sequence, set, or array of values."""
+
+        if not isinstance(values, numpy.ndarray):
+            values = list(values)
+        values = numpy.unique(values)
+        which = numpy.searchsorted(self.values, values)
+        found = which < self.stop
+        which, values = which[found], values[found]
+        return which[self.values[which] == values]
+
+    def select(self, start, stop, output=None, invert=False, packed=False):
+        """Return a mask of elements equal to distinct values at positions
+        from *start* to *stop*, or of other elements when *invert* is true,
+        as a :class:`.PackedMask` when *packed* is true, or survivors in
+        *output* form, see :func:`.napi_and`."""
+
+        return self.combine(range(start, stop), output, invert, packed)
+
+    def combine(self, positions, output=None, invert=False, packed=False):
+        """Return *or* of bitmaps of distinct values at *positions*, like
+        :meth:`select` does."""
+
+        positions = list(positions)
+        if output == 'count':
+            count = sum(self.counts[i] for i in positions)
+            return self.size - count if invert else count
+        if not positions:
+            mask = PackedMask.zeros(self.shape)
+        elif len(positions) == 1:
+            mask = PackedMask(self.bitmaps[positions[0]].words.copy(),
+                              self.shape)
+        else:
+            mask = packed_or([self.bitmaps[i] for i in positions],
+                             self.shape)
+        if invert:
+            mask = ~mask
+        if output == 'flat':
+            return mask.flatnonzero()
+        if output:
+            return mask.nonzero()
+        return mask if packed else mask.to_bool()
+
+
+def register_sorted(array, order=None, check=False, freeze=True):
+    """Register a :class:`SortedIndex` of *array* and return it.  *array*
+    is declared sorted when *order* is **None**.  Otherwise, *order* is a
+    permutation of flat indices that sorts *array*, or **True** to compute
+    it using :func:`numpy.argsort`.  When *check* is true, sortedness is
+    verified and :exc:`ValueError` is raised if elements are not sorted.
+    Unless *freeze* is false, *array* is made read-only, and
+    :exc:`ValueError` is raised if it is a view of a writeable array."""
+
+    if order is True:
+        order = numpy.argsort(array.reshape(-1), kind='mergesort')
+    if order is not None:
+        order = numpy.asarray(order)
+        if order.shape != (array.size,):
+            raise ValueError('order must have one index per element')
+    unregister(array)
+    index = SortedIndex(array, order, freeze)
+    if check and index.size > 1:
+        values = index.values[:index.stop]
+        if not (values[1:] >= values[:-1]).all():
+            index.release()
+            raise ValueError('array is not sorted')
+    return _register(array, index)
+
+
+def register_bitmap(array, maxvalues=MAXVALUES, freeze=True):
+    """Register a :class:`BitmapIndex` of *array* and return it.  When
+    *array* has more than *maxvalues* distinct values, :exc:`ValueError` is
+    raised, since bitmaps take ``size / 8`` bytes per value.  *freeze* is
+    handled as by :func:`register_sorted`."""
+
+    values = numpy.unique(array)
+    if len(values) > maxvalues:
+        raise ValueError('array has more than {} distinct values'
+                         .format(maxvalues))
+    unregister(array)
+    return _register(array, BitmapIndex(array, values, freeze))
+
+
+def _register(array, index):
+
+    key = id(array)
+
+    def drop(ref):
+        if getattr(_registry.get(key), '_ref', None) is ref:
+            del _registry[key]
+
+    index._ref = weakref.ref(array, drop)
+    _registry[key] = index
+    return index
+
+
+def unregister(array):
+    """Remove index of *array*, and restore writeability of *array* if it
+    was made read-only."""
+
+    index = _registry.pop(id(array), None)
+    if index is not None:
+        index.release()
+
+
+def clear():
+    """Remove all indexes."""
+
+    for index in list(_registry.values()):
+        index.release()
+    _registry.clear()
+
+
+def lookup(array):
+    """Return a valid index of *array*, or **None**."""
+
+    if not _registry:
+        return None
+    index = _registry.get(id(array))
+    if index is not None and not index.valid(array):
+        _registry.pop(id(array), None)
+        return None
+    return index
+
+
+def _name(op):
+
+    return getattr(op, '__name__', op)
+
+
+def _scalar(value):
+
+    return isinstance(value, (Number, numpy.generic)) and not (
+        isinstance(value, numpy.ndarray))
+
+
+def indexed_compare(left, ops, comparators, output=None, packed=False):
+    """Return outcome of a comparison with a scalar, or of a range test with
+    scalar bounds, of a registered array, or of a membership test of an
+    array that has a :class:`BitmapIndex`, as a mask or survivors in
+    *output* form.  Masks obtained using a :class:`BitmapIndex` are
+    returned as :class:`.PackedMask` instances when *packed* is true.  If
+    there is no index to use, return **None**."""
+
+    if not _registry:
+        return None
+    ops = [_name(op) for op in ops]
+    if len(ops) == 1 and ops[0] in ('In', 'NotIn'):
+        index = lookup(left)
+        if not isinstance(index, BitmapIndex):
+            return None
+        return index.combine(index.positions(comparators[0]), output,
+                             ops[0] == 'NotIn', packed)
+    if len(ops) == 1:
+        array, value, op = left, comparators[0], ops[0]
+        if _scalar(array):
+            array, value, op = value, array, FLIP.get(op)
+        if op not in FLIP or not _scalar(value):
+            return None
+        index = lookup(array)
+        if index is None:
+            return None
+        start, stop = index.bounds(op, value)
+        return _select(index, start, stop, output, op == 'NotEq', packed)
+    if len(ops) != 2:
+        return None
+    bounds = range_bounds(left, ops, comparators)
+    if bounds is None or not (_scalar(bounds[0]) and _scalar(bounds[3])):
+        return None
+    index = lookup(bounds[2])
+    if index is None:
+        return None
+    start, stop = index.range(bounds[0], bounds[1], bounds[3], bounds[4])
+    return _select(index, start, stop, output, False, packed)
+
+
+def _select(index, start, stop, output, invert, packed):
+
+    if isinstance(index, BitmapIndex):
+        return index.select(start, stop, output, invert, packed)
+    return index.select(start, stop, output, invert)
+
+
+def unpacked(result, kwargs):
+    """Return *result* as a boolean array if it is a :class:`.PackedMask`
+    and *kwargs* have *index* option true and *packed* option false, so that
+    masks obtained using bitmap indexes are not returned packed."""
+
+    if (isinstance(result, PackedMask) and kwargs.get('index', False) and
+            not kwargs.get('packed', False)):
+        return result.to_bool()
+    return result
@@ -0,0 +1,215 @@
+"""This module defines opt-in instrumentation of logical operations and
+comparisons of arrays.
+
+When instrumentation is enabled, :func:`.napi_and`, :func:`.napi_or`,
+:func:`.napi_compare`, and :class:`.NapiTransformer` record the strategy
+used for each operation, number of array elements touched, number of
+surviving elements, i.e. elements whose outcome is **True**, and bytes of
+temporary arrays allocated.  :func:`.neval` and :func:`.nexec` also record
+time spent for parsing, transforming, and evaluating expressions.  Records
+are grouped by expression:
+
+>>> import napi
+>>> napi.instrument.enable()
+>>> mask = napi.neval('a > 0 and b > 0', {'a': arange(8), 'b': arange(8)})
+>>> napi.stats()['a > 0 and b > 0']['operations']
+{'dense': 1}
+
+Operations performed outside of :func:`.neval` and :func:`.nexec`, e.g. by
+code transformed by ``%napi`` magic, are grouped under ``'<napi>'``.  In
+IPython, ``%napi stats`` prints records, and ``%napi stats on``,
+``%napi stats off``, and ``%napi stats reset`` control instrumentation.
+
+Note that :class:`.NapiTransformer` evaluates logical operations and
+comparisons while transforming expressions, so their cost is included in
+*transform* phase.
+
+When instrumentation is disabled, which is the default, instrumented
+functions only check :data:`enabled` flag."""
+
+import time
+import threading
+from collections import OrderedDict
+
+__all__ = ['enable', 'disable', 'reset', 'stats', 'report', 'record',
+           'record_temps', 'measure', 'expression']
+
+PHASES = ('parse', 'transform', 'evaluate')
+
+enabled = False
+
+_records = OrderedDict()
+
+_lock = threading.Lock()
+
+_local = threading.local()
+
+
+def enable():
+    """Enable instrumentation."""
+
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Disable instrumentation.  Records are kept until :func:`.reset` is
+    called."""
+
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Remove all records."""
+
+    with _lock:
+        _records.clear()
+
+
+def _new():
+
+    entry = {'calls': 0, 'operations': {}, 'touched': 0, 'survivors': 0,
+             'temp_bytes': 0, 'stages': [], 'peak_temps': 0}
+    for phase in PHASES:
+        entry[phase] = 0.
+    return entry
+
+
+def _entry(name):
+
+    if name is None:
+        stack = getattr(_local, 'stack', None)
+        name = stack[-1] if stack else '<napi>'
+    try:
+        return _records[name]
+    except KeyError:
+        entry = _records[name] = _new()
+        return entry
+
+
+class expression(object):
+
+    """A context manager that groups records made in its context under
+    *source* expression, and counts a call of the expression unless it is
+    already being evaluated.  :meth:`mark` measures time of phases."""
+
+    def __init__(self, source):
+
+        self.source = source
+        self._last = None
+
+    def __enter__(self):
+
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if not stack or stack[-1] != self.source:
+            with _lock:
+                _entry(self.source)['calls'] += 1
+        stack.append(self.source)
+        self._last = time.time()
+        return self
+
+    def __exit__(self, *exc):
+
+        _local.stack.pop()
+
+    def mark(self, phase=None):
+        """Add time passed since the previous mark to *phase*.  When *phase*
+        is **None**, time is not recorded."""
+
+        now = time.time()
+        if phase is not None:
+            with _lock:
+                _entry(self.source)[phase] += now - self._last
+        self._last = now
+
+
+class _Disabled(object):
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        pass
+
+    def mark(self, phase=None):
+
+        pass
+
+
+_disabled = _Disabled()
+
+
+def measure(source):
+    """Return an :class:`expression` context manager for *source*, or one
+    that does nothing when instrumentation is disabled."""
+
+    if enabled:
+        return expression(source)
+    return _disabled
+
+
+def record(strategy, touched=0, survivors=0, temp_bytes=0, stages=None):
+    """Record an operation performed using *strategy* that touched
+    *touched* elements, resulted in *survivors* elements that are **True**,
+    and allocated *temp_bytes* bytes of temporary arrays.  *stages* is a
+    list of counts of undecided elements after each operand of
+    short-circuiting operations.  Record is made for the expression being
+    evaluated."""
+
+    with _lock:
+        entry = _entry(None)
+        operations = entry['operations']
+        operations[strategy] = operations.get(strategy, 0) + 1
+        entry['touched'] += int(touched)
+        entry['survivors'] += int(survivors)
+        entry['temp_bytes'] += int(temp_bytes)
+        if stages is not None:
+            entry['stages'] = list(stages)
+
+
+def record_temps(peak):
+    """Record *peak* number of temporaries that were alive at the same time
+    while evaluating the expression using :class:`.NapiTransformer`."""
+
+    with _lock:
+        entry = _entry(None)
+        entry['peak_temps'] = max(entry['peak_temps'], peak)
+
+
+def stats(reset=False):
+    """Return a dictionary of records keyed by expression.  When *reset* is
+    true, records are removed."""
+
+    with _lock:
+        records = OrderedDict((name, dict(entry, operations=dict(
+                                  entry['operations'])))
+                              for name, entry in _records.items())
+        if reset:
+            _records.clear()
+    return records
+
+
+def report(records=None):
+    """Return a string that lists *records*, or current records, one
+    expression per line."""
+
+    if records is None:
+        records = stats()
+    lines = []
+    for name, entry in records.items():
+        operations = ', '.join('{}={}'.format(key, value) for key, value
+                               in sorted(entry['operations'].items()))
+        lines.append('{}\n  calls={calls} touched={touched} '
+                     'survivors={survivors} temp_bytes={temp_bytes} '
+                     'peak_temps={peak_temps} '
+                     'parse={parse:.3g}s transform={transform:.3g}s '
+                     'evaluate={evaluate:.3g}s\n  operations: {operations}'
+                     .format(name, operations=operations or '-', **dict(
+                         (key, value) for key, value in entry.items()
+                         if key != 'operations')))
+    return '\n'.join(lines)
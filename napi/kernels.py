@@ -0,0 +1,354 @@
+"""This module defines kernels that evaluate logical operations and chained
+comparisons of arrays block by block.
+
+Operands are walked in blocks of *chunk* elements, and comparisons and
+logical reductions are applied to each block, writing into a single output
+mask.  Blocks that are decided by their first operands are not processed
+further.  The default block size, :data:`CHUNK`, is chosen so that blocks of
+a few operands fit in a 256 KB L2 cache.
+
+Chained comparisons that test whether elements of an array are within a
+range, such as ``lo <= a < hi``, are evaluated by :func:`.chunked_range`
+that makes a single pass over each block.  For integer arrays, the range test
+is made using a single unsigned comparison of ``a - lo`` with ``hi - lo``.
+Unless *chunk* or *threads* is given, range tests are fused only for arrays
+that have more than :data:`FUSE` elements, since for smaller arrays the
+per-block overhead outweighs savings of memory traffic and NumPy operations
+are faster.
+
+When *threads* is larger than 1, elements are split into index ranges of at
+least *grain* elements that are evaluated independently by a pool of
+*threads* workers, each writing into a disjoint slice of the output mask.
+NumPy releases the GIL while operating on blocks, so ranges are processed
+in parallel.
+
+:func:`.collect` runs the same kernels with a :class:`.Sink` in place of the
+output mask, which keeps a single block buffer and gathers indices or number
+of **True** elements of each block, so that survivors are obtained in a
+single pass without allocating the output mask."""
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from numbers import Integral
+
+import numpy
+from numpy import ndarray
+
+__all__ = ['CHUNK', 'GRAIN', 'FUSE', 'THREADS', 'chunked_and', 'chunked_or',
+           'chunked_compare', 'chunked_range', 'range_bounds', 'Sink',
+           'collect']
+
+CHUNK = 16384
+
+GRAIN = 262144
+
+FUSE = 1 << 23
+
+THREADS = multiprocessing.cpu_count()
+
+_pools = {}
+
+UFUNCS = {
+    'Eq': numpy.equal,
+    'NotEq': numpy.not_equal,
+    'Lt': numpy.less,
+    'LtE': numpy.less_equal,
+    'Gt': numpy.greater,
+    'GtE': numpy.greater_equal,
+}
+
+
+def flatten(array):
+    """Return a one-dimensional view of *array* if it is contiguous, or a flat
+    iterator that copies elements only when a block is requested."""
+
+    if array.flags.c_contiguous:
+        return array.reshape(-1)
+    else:
+        return array.flat
+
+
+def iter_blocks(start, stop, chunk):
+    """Yield slices of *chunk* elements that cover elements from *start* to
+    *stop*."""
+
+    for i in range(start, stop, chunk):
+        yield slice(i, min(i + chunk, stop))
+
+
+def iter_ranges(size, chunk, threads, grain):
+    """Yield (start, stop) tuples of index ranges of at least *grain*
+    elements, aligned with blocks of *chunk* elements."""
+
+    tasks = max(1, min(size // max(grain, 1), threads * 4))
+    step = -(-size // tasks)
+    step = -(-step // chunk) * chunk
+    for start in range(0, size, step):
+        yield start, min(start + step, size)
+
+
+def get_pool(threads):
+    """Return a pool of *threads* worker threads, which is created once."""
+
+    try:
+        return _pools[threads]
+    except KeyError:
+        pool = _pools[threads] = ThreadPool(threads)
+        return pool
+
+
+def run(kernel, args, size, chunk=CHUNK, threads=0, grain=GRAIN):
+    """Call *kernel* with *args* followed by start and stop indices of
+    ranges of *size* elements and *chunk*.  When *threads* is larger than
+    1 and there is enough work, ranges are processed in parallel."""
+
+    if threads > 1 and size >= 2 * grain:
+        ranges = list(iter_ranges(size, chunk, threads, grain))
+        if len(ranges) > 1:
+            get_pool(threads).map(
+                lambda bounds: kernel(*(args + bounds + (chunk,))), ranges)
+            return
+    kernel(*(args + (0, size, chunk)))
+
+
+class Sink(object):
+
+    """A stand-in for the flat output mask of block kernels.  Requesting a
+    block returns a view of a single buffer of *chunk* elements, after
+    indices of **True** elements of the previous block, or their number when
+    *count* is true, are gathered.  :meth:`result` returns flat indices as
+    an array, or their number."""
+
+    def __init__(self, chunk, count=False):
+
+        self._buffer = numpy.empty(max(chunk, 1), bool)
+        self._count = count
+        self._block = None
+        self._parts = []
+        self._total = 0
+
+    def __getitem__(self, block):
+
+        self.flush()
+        self._block = block
+        return self._buffer[:block.stop - block.start]
+
+    def flush(self):
+        """Gather **True** elements of the current block."""
+
+        block = self._block
+        if block is None:
+            return
+        mask = self._buffer[:block.stop - block.start]
+        if self._count:
+            self._total += int(numpy.count_nonzero(mask))
+        else:
+            index = numpy.flatnonzero(mask)
+            if len(index):
+                index += block.start
+                self._parts.append(index)
+        self._block = None
+
+    def result(self):
+
+        self.flush()
+        if self._count:
+            return self._total
+        if len(self._parts) == 1:
+            return self._parts[0]
+        if self._parts:
+            return numpy.concatenate(self._parts)
+        return numpy.zeros(0, numpy.intp)
+
+
+def collect(kernel, args, size, count=False, chunk=CHUNK, threads=0,
+            grain=GRAIN):
+    """Call *kernel* like :func:`.run` does, passing a :class:`.Sink`
+    instead of the output mask, and return flat indices of **True**
+    elements, or their number when *count* is true."""
+
+    def task(bounds):
+        sink = Sink(min(chunk, bounds[1] - bounds[0]), count)
+        kernel(*(args + (sink,) + bounds + (chunk,)))
+        return sink.result()
+
+    ranges = [(0, size)]
+    if threads > 1 and size >= 2 * grain:
+        ranges = list(iter_ranges(size, chunk, threads, grain))
+    if len(ranges) > 1:
+        parts = get_pool(threads).map(task, ranges)
+    else:
+        parts = [task(ranges[0])]
+    if count:
+        return sum(parts)
+    return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+
+
+def and_blocks(arrays, out, start, stop, chunk):
+    """Write logical *and* of *arrays* into flat *out* from *start* to
+    *stop* in blocks of *chunk* elements."""
+
+    first, rest = flatten(arrays[0]), [flatten(a) for a in arrays[1:]]
+    for block in iter_blocks(start, stop, chunk):
+        mask = out[block]
+        mask[...] = first[block]
+        for flat in rest:
+            if not mask.any():
+                break
+            numpy.logical_and(mask, flat[block], out=mask)
+
+
+def or_blocks(arrays, out, start, stop, chunk):
+    """Write logical *or* of *arrays* into flat *out* from *start* to
+    *stop* in blocks of *chunk* elements."""
+
+    first, rest = flatten(arrays[0]), [flatten(a) for a in arrays[1:]]
+    for block in iter_blocks(start, stop, chunk):
+        mask = out[block]
+        mask[...] = first[block]
+        for flat in rest:
+            if mask.all():
+                break
+            numpy.logical_or(mask, flat[block], out=mask)
+
+
+def compare_blocks(left, ops, comparators, out, start, stop, chunk):
+    """Write outcome of chained comparison of *left* and *comparators* into
+    flat *out* from *start* to *stop* in blocks of *chunk* elements."""
+
+    ufuncs = [UFUNCS[getattr(op, '__name__', op)] for op in ops]
+    operands = [(flatten(value), True)
+                if isinstance(value, ndarray) and value.shape
+                else (value, False) for value in [left] + list(comparators)]
+    temp = numpy.empty(min(chunk, stop - start), bool)
+    for block in iter_blocks(start, stop, chunk):
+        mask = out[block]
+        blocked = (value[block] if flat else value
+                   for value, flat in operands)
+        x = next(blocked)
+        y = next(blocked)
+        ufuncs[0](x, y, out=mask)
+        for ufunc in ufuncs[1:]:
+            if not mask.any():
+                break
+            x, y = y, next(blocked)
+            buf = temp[:mask.size]
+            ufunc(x, y, out=buf)
+            numpy.logical_and(mask, buf, out=mask)
+
+
+def chunked_and(arrays, shape, chunk=CHUNK, threads=0, grain=GRAIN):
+    """Return element-wise logical *and* of *arrays* with *shape*, evaluated
+    in blocks of *chunk* elements, using *threads* workers."""
+
+    result = numpy.empty(shape, bool)
+    out = result.reshape(-1)
+    run(and_blocks, (arrays, out), out.size, chunk, threads, grain)
+    return result
+
+
+def chunked_or(arrays, shape, chunk=CHUNK, threads=0, grain=GRAIN):
+    """Return element-wise logical *or* of *arrays* with *shape*, evaluated
+    in blocks of *chunk* elements, using *threads* workers."""
+
+    result = numpy.empty(shape, bool)
+    out = result.reshape(-1)
+    run(or_blocks, (arrays, out), out.size, chunk, threads, grain)
+    return result
+
+
+def chunked_compare(left, ops, comparators, shape, chunk=CHUNK, threads=0,
+                    grain=GRAIN):
+    """Return outcome of chained comparison of *left* and *comparators*,
+    evaluated in blocks of *chunk* elements, using *threads* workers.
+    Arrays among operands must have *shape*, other operands are compared as
+    they are."""
+
+    result = numpy.empty(shape, bool)
+    out = result.reshape(-1)
+    run(compare_blocks, (left, ops, comparators, out), out.size,
+        chunk, threads, grain)
+    return result
+
+
+def range_bounds(left, ops, comparators):
+    """Return ``(lo, lo_strict, array, hi, hi_strict)`` tuple if chained
+    comparison of *left* and *comparators* tests whether elements of an
+    array are within a range with scalar bounds, e.g. ``lo <= a < hi`` or
+    ``hi > a >= lo``.  Otherwise, return **None**."""
+
+    if len(ops) != 2:
+        return None
+    array = comparators[0]
+    if not isinstance(array, ndarray) or not array.shape:
+        return None
+    if isinstance(left, ndarray) or isinstance(comparators[1], ndarray):
+        return None
+    first, second = [getattr(op, '__name__', op) for op in ops]
+    if first in ('Lt', 'LtE') and second in ('Lt', 'LtE'):
+        return (left, first == 'Lt', array, comparators[1], second == 'Lt')
+    if first in ('Gt', 'GtE') and second in ('Gt', 'GtE'):
+        return (comparators[1], second == 'Gt', array, left, first == 'Gt')
+    return None
+
+
+def _unsigned_range(lo, lo_strict, dtype, hi, hi_strict):
+    """Return unsigned dtype, offset and span for testing whether integers
+    with *dtype* are in range using a single unsigned comparison.  Return
+    **None** when the test is not applicable."""
+
+    if (dtype.kind not in 'iu' or not dtype.isnative or
+        not isinstance(lo, Integral) or not isinstance(hi, Integral)):
+        return None
+    info = numpy.iinfo(dtype)
+    start = max(int(lo) + bool(lo_strict), int(info.min))
+    stop = min(int(hi) + (not hi_strict), int(info.max) + 1)
+    bits = dtype.itemsize * 8
+    unsigned = numpy.dtype('u{}'.format(dtype.itemsize))
+    span = max(stop - start, 0)
+    if span >= 2 ** bits:
+        return None
+    return unsigned, unsigned.type(start % 2 ** bits), unsigned.type(span)
+
+
+def range_blocks(lo, lo_strict, array, hi, hi_strict, out, start, stop,
+                 chunk):
+    """Write outcome of range test of *array* elements into flat *out* from
+    *start* to *stop* in blocks of *chunk* elements."""
+
+    flat = flatten(array)
+    unsigned = _unsigned_range(lo, lo_strict, array.dtype, hi, hi_strict)
+    temp = numpy.empty(min(chunk, stop - start),
+                       bool if unsigned is None else unsigned[0])
+    if unsigned is None:
+        lower = numpy.less if lo_strict else numpy.less_equal
+        upper = numpy.less if hi_strict else numpy.less_equal
+        for block in iter_blocks(start, stop, chunk):
+            mask = out[block]
+            x = flat[block]
+            lower(lo, x, out=mask)
+            if mask.any():
+                buf = temp[:mask.size]
+                upper(x, hi, out=buf)
+                numpy.logical_and(mask, buf, out=mask)
+    else:
+        unsigned, offset, span = unsigned
+        for block in iter_blocks(start, stop, chunk):
+            mask = out[block]
+            buf = temp[:mask.size]
+            numpy.subtract(flat[block].view(unsigned), offset, out=buf)
+            numpy.less(buf, span, out=mask)
+
+
+def chunked_range(lo, lo_strict, array, hi, hi_strict, chunk=CHUNK,
+                  threads=0, grain=GRAIN):
+    """Return a mask of *array* elements that are within the range from *lo*
+    to *hi*, evaluated in a single pass over blocks of *chunk* elements,
+    using *threads* workers.  Bounds are excluded when *lo_strict* or
+    *hi_strict* is true.  See :func:`.range_bounds`."""
+
+    result = numpy.empty(array.shape, bool)
+    out = result.reshape(-1)
+    run(range_blocks, (lo, lo_strict, array, hi, hi_strict, out), out.size,
+        chunk, threads, grain)
+    return result
@@ -2,6 +2,8 @@ from IPython.core.magic import Magics, magics_class, line_magic
 from IPython import get_ipython
 
 from .transformers import LazyTransformer
+from .kernels import CHUNK, GRAIN, THREADS
+from .adaptive import AUTO
 
 __all__ = ['NapiMagics']
 
@@ -16,17 +18,58 @@ class NapiMagics(Magics):
     """
 
     _state = False
-    _kwargs = {'sq': False, 'sc': 0}
+    _kwargs = {'sq': False, 'bc': False, 'sc': 0, 'defer': False, 'chunk': 0,
+               'threads': 0, 'grain': GRAIN, 'reorder': False, 'cse': False,
+               'index': False}
     _option = {'sq': ('sq', 'squeeze',
                       lambda arg: not arg,
                       lambda arg: arg,
                       lambda arg: arg in STATES,
                       lambda arg: bool(STATES[arg])),
+               'bc': ('bc', 'broadcast',
+                      lambda arg: not arg,
+                      lambda arg: arg,
+                      lambda arg: arg in STATES,
+                      lambda arg: bool(STATES[arg])),
                'sc': ('sc', 'shortcircuit',
-                       lambda arg: 0 if arg > 0 else 10000,
+                       lambda arg: 0 if arg else 10000,
+                       lambda arg: arg,
+                       lambda arg: arg.isdigit() or arg == AUTO,
+                       lambda arg: arg if arg == AUTO else int(arg)),
+               'defer': ('defer', 'defer',
+                         lambda arg: not arg,
+                         lambda arg: arg,
+                         lambda arg: arg in STATES,
+                         lambda arg: bool(STATES[arg])),
+               'chunk': ('chunk', 'chunk',
+                         lambda arg: 0 if arg > 0 else CHUNK,
+                         lambda arg: arg,
+                         lambda arg: arg.isdigit(), int),
+               'threads': ('threads', 'threads',
+                           lambda arg: 0 if arg > 1 else THREADS,
+                           lambda arg: arg,
+                           lambda arg: arg.isdigit(), int),
+               'grain': ('grain', 'grain',
+                         lambda arg: GRAIN,
+                         lambda arg: arg,
+                         lambda arg: arg.isdigit(), int),
+               'reorder': ('reorder', 'reorder',
+                           lambda arg: not arg,
+                           lambda arg: arg,
+                           lambda arg: arg in STATES,
+                           lambda arg: bool(STATES[arg])),
+               'cse': ('cse', 'cse',
+                       lambda arg: not arg,
                        lambda arg: arg,
-                       lambda arg: arg.isdigit(), int)}
+                       lambda arg: arg in STATES,
+                       lambda arg: bool(STATES[arg])),
+               'index': ('index', 'index',
+                         lambda arg: not arg,
+                         lambda arg: arg,
+                         lambda arg: arg in STATES,
+                         lambda arg: bool(STATES[arg]))}
     _option['squeeze'] = _option['sq']
+    _option['broadcast'] = _option['bc']
     _option['shortcircuit'] = _option['sc']
     _prefix = '_'
 
@@ -40,12 +83,55 @@ class NapiMagics(Magics):
         **Configuration**:
 
           * ``%napi sc`` or ``%napi shortcircuit`` toggles
-            :term:`short-circuiting`.
+            :term:`short-circuiting`.  ``%napi sc auto`` chooses between
+            dense, short-circuiting, and block-wise evaluation based on
+            density of operands and a cost model calibrated for the machine.
 
           * ``%napi sq`` or ``%napi squeeze`` toggles array :term:`squeezing`.
             ``on`` or ``1`` and ``off`` or ``0`` arguments are also recognized.
+
+          * ``%napi bc`` or ``%napi broadcast`` toggles array
+            :term:`broadcasting`.
+
+          * ``%napi defer`` toggles deferred evaluation of operands, so that
+            operands are evaluated only until the outcome is decided.
+            ``on`` or ``1`` and ``off`` or ``0`` arguments are also recognized.
+
+          * ``%napi chunk`` toggles block-wise evaluation of logical
+            operations and chained comparisons.  ``%napi chunk 65536`` sets
+            the number of elements per block, and ``%napi chunk 0`` turns
+            it off.
+
+          * ``%napi threads`` toggles multithreaded evaluation using all
+            processors.  ``%napi threads 8`` sets the number of worker
+            threads, and ``%napi grain 1000000`` sets the minimum number of
+            elements processed by a thread.
+
+          * ``%napi reorder`` toggles reordering of operands of logical
+            operations by their selectivity when short-circuiting or
+            deferring evaluation, see :mod:`napi.reorder`.
+
+          * ``%napi cse`` toggles common subexpression elimination, so that
+            repeated comparisons are computed once, see :mod:`napi.cse`.
+
+          * ``%napi index`` toggles use of indexes of arrays for single
+            comparisons, see :mod:`napi.indexes`.
+
+          * ``%napi explain expr`` prints evaluation plan of *expr*, and
+            ``%napi explain --run expr`` also evaluates it and reports
+            measured times, see :mod:`napi.explain`.
+
+          * ``%napi stats`` prints records of instrumentation, and
+            ``%napi stats on``, ``%napi stats off``, and
+            ``%napi stats reset`` enable, disable, and reset it, see
+            :mod:`napi.instrument`.
             """
 
+        words = line.split(None, 1)
+        if words and words[0].lower() == 'explain':
+            self._explain(words[1] if len(words) > 1 else '')
+            return
+
         args = line.strip().lower().split()
 
         if args:
@@ -68,6 +154,9 @@ class NapiMagics(Magics):
             self._state = STATES[arg]
             print('napi transformer is {}'.format(('OFF', 'ON')[self._state]))
             return
+        elif arg == 'stats':
+            self._stats(*args[1:])
+            return
         elif arg in self._option:
             (keyword, verbose, toggle,
                 display, validate, convert) = self._option[arg]
@@ -89,16 +178,46 @@ class NapiMagics(Magics):
         print('Invalid napi argument: {}'.format(arg))
         return
 
+    def _explain(self, source):
+
+        from napi.explain import explain
+        run = source.startswith('--run')
+        if run:
+            source = source[len('--run'):]
+        source = source.strip()
+        if not source:
+            print('Usage: %napi explain [--run] expression')
+            return
+        ns = get_ipython().user_ns
+        print(explain(source, ns, ns, transformer=LazyTransformer, run=run,
+                      **self._kwargs))
+
+    def _stats(self, *args):
+
+        from napi import instrument
+        if not args:
+            print(instrument.report() or 'No napi stats recorded')
+        elif len(args) == 1 and args[0] in STATES:
+            if STATES[args[0]]:
+                instrument.enable()
+            else:
+                instrument.disable()
+            print('napi stats are {}'
+                  .format(('OFF', 'ON')[instrument.enabled]))
+        elif args == ('reset',):
+            instrument.reset()
+            print('napi stats are reset')
+        else:
+            print('Invalid napi stats argument: {}'.format(' '.join(args)))
+
     def _append(self):
 
         self._remove()
         ip = get_ipython()
 
-        from napi.transformers import napi_compare, napi_and, napi_or
+        from napi.transformers import runtime
         prefix = self._prefix
-        ip.user_global_ns[prefix + 'napi_compare'] = napi_compare
-        ip.user_global_ns[prefix + 'napi_or'] = napi_or
-        ip.user_global_ns[prefix + 'napi_and'] = napi_and
+        ip.user_global_ns.update(runtime(prefix))
 
         ip.ast_transformers.append(LazyTransformer(prefix=prefix,
                                                    **self._kwargs))
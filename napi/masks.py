@@ -0,0 +1,272 @@
+"""This module defines a boolean mask type that stores one bit per element.
+
+:class:`.PackedMask` stores bits in the order used by :func:`numpy.packbits`
+in an array of 64-bit words, so that logical operations process 64 elements
+at a time and masks take 8 times less memory than boolean arrays:
+
+>>> from numpy import arange
+>>> from napi.masks import PackedMask
+>>> mask = PackedMask.from_bool(arange(10) % 3 == 0)
+>>> mask
+PackedMask(shape=(10,), count=4)
+>>> (~mask).nonzero()
+(array([1, 2, 4, 5, 7, 8]),)
+
+When :func:`.napi_and` and :func:`.napi_or` are called with ``packed=True``
+or when one of their operands is a :class:`.PackedMask`, the outcome is a
+:class:`.PackedMask`.  :func:`.neval` passes *packed* option to the
+transformer."""
+
+import numpy
+
+__all__ = ['PackedMask', 'packed_and', 'packed_or']
+
+POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)], numpy.uint8)
+
+LAST = numpy.array([0xFF] + [(0xFF << (8 - i)) & 0xFF for i in range(1, 8)],
+                   numpy.uint8)
+
+
+class PackedMask(object):
+
+    """A boolean mask with *shape* whose elements are stored as bits of
+    unsigned 64-bit integer *words*.  Bits beyond the number of elements
+    are always zero."""
+
+    __array_priority__ = 20
+
+    def __init__(self, words, shape):
+
+        self.words = words
+        self.shape = tuple(int(n) for n in shape)
+
+    @classmethod
+    def from_bool(cls, array):
+        """Return a mask of *array* elements that are **True**."""
+
+        array = numpy.asarray(array)
+        if array.dtype != bool:
+            array = array.astype(bool)
+        bits = numpy.packbits(array.reshape(-1))
+        words = numpy.zeros(-(-bits.size // 8), numpy.uint64)
+        words.view(numpy.uint8)[:bits.size] = bits
+        return cls(words, array.shape)
+
+    @classmethod
+    def from_indices(cls, indices, shape):
+        """Return a mask with *shape* whose elements at *indices* are set.
+        *indices* may be flat indices or a tuple of index arrays, as returned
+        by :meth:`numpy.ndarray.nonzero`."""
+
+        mask = cls.zeros(shape)
+        if isinstance(indices, tuple):
+            if len(indices) == 1:
+                indices = indices[0]
+            else:
+                indices = numpy.ravel_multi_index(indices, mask.shape)
+        indices = numpy.asarray(indices, numpy.intp)
+        bits = (numpy.uint8(0x80) >> (indices & 7).astype(numpy.uint8))
+        numpy.bitwise_or.at(mask.bytes, indices >> 3, bits)
+        return mask
+
+    @classmethod
+    def zeros(cls, shape):
+        """Return a mask with *shape* whose elements are all **False**."""
+
+        shape = (shape,) if numpy.isscalar(shape) else tuple(shape)
+        size = int(numpy.prod(shape))
+        return cls(numpy.zeros(-(-size // 64), numpy.uint64), shape)
+
+    @classmethod
+    def ones(cls, shape):
+        """Return a mask with *shape* whose elements are all **True**."""
+
+        return ~cls.zeros(shape)
+
+    @property
+    def size(self):
+        """Number of elements."""
+
+        return int(numpy.prod(self.shape))
+
+    @property
+    def ndim(self):
+        """Number of dimensions."""
+
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        """Number of bytes used for storing bits."""
+
+        return self.words.nbytes
+
+    @property
+    def bytes(self):
+        """Bits as an array of unsigned 8-bit integers."""
+
+        return self.words.view(numpy.uint8)
+
+    def __len__(self):
+
+        return self.shape[0]
+
+    def __repr__(self):
+
+        return 'PackedMask(shape={}, count={})'.format(self.shape,
+                                                       self.count())
+
+    def __bool__(self):
+
+        if self.size == 1:
+            return bool(self.words[0])
+        raise ValueError('The truth value of a mask with more than one '
+                         'element is ambiguous. Use a.any() or a.all()')
+
+    __nonzero__ = __bool__
+
+    def __array__(self, dtype=None, copy=None):
+
+        array = self.to_bool()
+        return array if dtype is None else array.astype(dtype)
+
+    def _clear(self):
+        """Set bits beyond the number of elements to zero."""
+
+        size = self.size
+        used = -(-size // 8)
+        self.bytes[used:] = 0
+        if used:
+            self.bytes[used - 1] &= LAST[size % 8]
+        return self
+
+    def _words(self, other):
+
+        if not isinstance(other, PackedMask):
+            other = PackedMask.from_bool(other)
+        if other.size != self.size:
+            raise ValueError('mask shape mismatch')
+        return other.words
+
+    def __and__(self, other):
+
+        return PackedMask(self.words & self._words(other), self.shape)
+
+    def __or__(self, other):
+
+        return PackedMask(self.words | self._words(other), self.shape)
+
+    def __xor__(self, other):
+
+        return PackedMask(self.words ^ self._words(other), self.shape)
+
+    __rand__, __ror__, __rxor__ = __and__, __or__, __xor__
+
+    def __iand__(self, other):
+
+        numpy.bitwise_and(self.words, self._words(other), out=self.words)
+        return self
+
+    def __ior__(self, other):
+
+        numpy.bitwise_or(self.words, self._words(other), out=self.words)
+        return self
+
+    def __invert__(self):
+
+        return PackedMask(~self.words, self.shape)._clear()
+
+    def copy(self):
+        """Return a copy of the mask."""
+
+        return PackedMask(self.words.copy(), self.shape)
+
+    def reshape(self, *shape):
+        """Return the mask with a new *shape*, sharing its bits."""
+
+        if len(shape) == 1 and isinstance(shape[0], tuple):
+            shape = shape[0]
+        if int(numpy.prod(shape)) != self.size:
+            raise ValueError('cannot reshape mask of size {} into shape {}'
+                             .format(self.size, shape))
+        return PackedMask(self.words, shape)
+
+    def squeeze(self):
+        """Return the mask with single-dimensional entries removed from its
+        shape, sharing its bits."""
+
+        return PackedMask(self.words, [n for n in self.shape if n != 1])
+
+    def any(self):
+        """Return **True** if any element is **True**."""
+
+        return bool(self.words.any())
+
+    def all(self):
+        """Return **True** if all elements are **True**."""
+
+        return self.count() == self.size
+
+    def count(self):
+        """Return number of elements that are **True**."""
+
+        return int(POPCOUNT[self.bytes].sum(dtype=numpy.int64))
+
+    def to_bool(self):
+        """Return a boolean array."""
+
+        size = self.size
+        return (numpy.unpackbits(self.bytes)[:size].view(bool)
+                .reshape(self.shape))
+
+    def flatnonzero(self):
+        """Return flat indices of elements that are **True**.  Only bytes
+        with bits set are unpacked."""
+
+        data = self.bytes
+        which = data.nonzero()[0]
+        rows, cols = numpy.unpackbits(data[which]).reshape(-1, 8).nonzero()
+        return which[rows] * 8 + cols
+
+    def nonzero(self):
+        """Return a tuple of index arrays of elements that are **True**."""
+
+        flat = self.flatnonzero()
+        if len(self.shape) == 1:
+            return (flat,)
+        return numpy.unravel_index(flat, self.shape)
+
+
+def packed_and(arrays, shape):
+    """Return logical *and* of *arrays*, which may be :class:`.PackedMask`
+    instances or arrays, as a :class:`.PackedMask` with *shape*.  Arrays are
+    packed only while the outcome is not decided."""
+
+    arrays = iter(arrays)
+    words = _pack(next(arrays)).words.copy()
+    for array in arrays:
+        if not words.any():
+            break
+        numpy.bitwise_and(words, _pack(array).words, out=words)
+    return PackedMask(words, shape)
+
+
+def packed_or(arrays, shape):
+    """Return logical *or* of *arrays*, which may be :class:`.PackedMask`
+    instances or arrays, as a :class:`.PackedMask` with *shape*.  Arrays are
+    packed only while the outcome is not decided."""
+
+    arrays = iter(arrays)
+    mask = PackedMask(_pack(next(arrays)).words.copy(), shape)
+    for array in arrays:
+        if mask.all():
+            break
+        mask |= _pack(array)
+    return mask
+
+
+def _pack(array):
+
+    if isinstance(array, PackedMask):
+        return array
+    return PackedMask.from_bool(array)
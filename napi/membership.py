@@ -0,0 +1,179 @@
+"""This module defines element-wise membership tests, that give ``in`` and
+``not in`` operators array semantics.
+
+When the left operand of ``in`` is an array, the outcome is a mask of its
+elements that are equal to one of the values of the right operand, which
+may be a set, list, tuple, array, or another iterable of values:
+
+>>> ids = arange(10 ** 7)
+>>> neval('ids % 7 == 0 and ids in allowed', dict(allowed={7, 14, 91}))
+... # doctest: +SKIP
+
+Otherwise, operands are tested as in Python, e.g. ``'a' in names``.
+
+:func:`isin` chooses one of the following strategies by comparing the
+estimated cost of each for the number of values and of array elements, see
+:func:`choose_membership`:
+
+  * ``'equal'`` makes an equality test per value and combines outcomes
+    using logical *or*, which suits a few values,
+  * ``'hash'`` looks elements up in a direct-address table of values, a
+    perfect hash that is built when values are integers whose range is not
+    much larger than the array, or in a :class:`set` for object arrays,
+  * ``'sorted'`` sorts values and finds elements among them using
+    :func:`numpy.searchsorted`, which suits other large sets of values.
+
+When the array has a bitmap index, bitmaps of values are combined instead,
+see :mod:`napi.indexes`.  Membership tests are comparisons, so they take part
+in short-circuiting, block-wise reductions, and pushdown like other
+operands of logical operations."""
+
+from math import log
+
+import numpy
+from numpy import ndarray
+
+__all__ = ['STRATEGIES', 'SMALL', 'TABLE', 'values_of', 'choose_membership',
+           'isin', 'member', 'nonmember']
+
+STRATEGIES = ('equal', 'hash', 'sorted')
+
+SMALL = 4
+
+TABLE = 1 << 22
+
+
+def values_of(values):
+    """Return *values*, an array or an iterable such as a set, as a flat
+    array.  Values of different types that NumPy would convert to strings,
+    e.g. ``{1, 'a'}``, are kept in an object array, so that they are
+    compared as in Python."""
+
+    if isinstance(values, ndarray):
+        return values.reshape(-1)
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    array = numpy.array(values)
+    if array.dtype.kind in 'SU' and len(set(map(type, values))) > 1:
+        array = numpy.empty(len(values), object)
+        array[:] = values
+    return array
+
+
+def _table_span(array, values):
+    """Return span of a direct-address table of *values* for *array*, or
+    **None** if a table is not applicable."""
+
+    if (array.dtype.kind not in 'iu' or values.dtype.kind not in 'iu' or
+            not len(values)):
+        return None
+    return int(values.max()) - int(values.min()) + 3
+
+
+def choose_membership(array, values):
+    """Return name of the strategy, one of :data:`STRATEGIES`, that is
+    expected to test membership of elements of *array* in *values*, a flat
+    array, at the lowest cost.  Up to :data:`SMALL` values are always tested
+    for equality.  Costs are rough estimates, in nanoseconds, of NumPy
+    operations that strategies make.  A table is considered when it takes
+    up to :data:`TABLE` bytes or 8 bytes per element of *array*."""
+
+    count = len(values)
+    if count <= SMALL:
+        return 'equal'
+    if array.dtype.kind == 'O' or values.dtype.kind == 'O':
+        return 'hash'
+    size = array.size
+    steps = log(count, 2)
+    costs = {'equal': 1.4 * size * count,
+             'sorted': (10 + 9 * steps) * size + 5 * steps * count}
+    span = _table_span(array, values)
+    if span is not None and span <= max(TABLE, 8 * size):
+        costs['hash'] = 8 * size + span / 20.
+    return min(costs, key=costs.get)
+
+
+def _equal(array, values):
+
+    result = numpy.zeros(array.shape, bool)
+    for value in values:
+        numpy.logical_or(result, array == value, out=result)
+    return result
+
+
+def _sorted(array, values):
+
+    values = numpy.unique(values)
+    if not len(values):
+        return numpy.zeros(array.shape, bool)
+    which = numpy.searchsorted(values, array)
+    numpy.minimum(which, len(values) - 1, out=which)
+    return values[which] == array
+
+
+def _hash(array, values):
+
+    if array.dtype.kind == 'O' or values.dtype.kind == 'O':
+        contains = set(values.tolist()).__contains__
+        return numpy.frompyfunc(contains, 1, 1)(array).astype(bool)
+    info = numpy.iinfo(array.dtype)
+    values = values[(values >= info.min) & (values <= info.max)]
+    if not len(values):
+        return numpy.zeros(array.shape, bool)
+    values = values.astype(array.dtype)
+    lo = max(int(values.min()) - 1, int(info.min))
+    hi = min(int(values.max()) + 1, int(info.max))
+    table = numpy.zeros(hi - lo + 1, bool)
+    unsigned = numpy.dtype(array.dtype.str.replace('i', 'u'))
+    table[(values - array.dtype.type(lo)).view(unsigned)] = True
+    # elements outside the range of values are clipped to its bounds, which
+    # are not members unless they are limits of the array type
+    index = numpy.clip(array, lo, hi)
+    index -= array.dtype.type(lo)
+    return table[index.view(unsigned)]
+
+
+STRATEGY = {'equal': _equal, 'hash': _hash, 'sorted': _sorted}
+
+
+def isin(array, values, invert=False, strategy=None):
+    """Return a mask of elements of *array* that are equal to one of
+    *values*, or of other elements when *invert* is true.  *strategy* is one
+    of :data:`STRATEGIES`, or **None** for choosing one using
+    :func:`choose_membership`.  Object values, which may not be ordered,
+    are looked up in a :class:`set` rather than sorted.  NaNs are not
+    members of any values."""
+
+    values = values_of(values)
+    if strategy is None:
+        strategy = choose_membership(array, values)
+    elif strategy not in STRATEGIES:
+        raise ValueError('strategy must be one of {}'
+                         .format(', '.join(STRATEGIES)))
+    if strategy == 'hash' and not (array.dtype.kind == 'O' or
+                                   _table_span(array, values)):
+        strategy = 'sorted'
+    if strategy == 'sorted' and values.dtype.kind == 'O':
+        strategy = 'hash'
+    result = STRATEGY[strategy](array, values)
+    if invert:
+        numpy.logical_not(result, out=result)
+    return result
+
+
+def member(left, right):
+    """Return outcome of ``left in right``, which is element-wise when
+    *left* is an array, see :func:`isin`."""
+
+    if isinstance(left, ndarray) and left.shape:
+        return isin(left, right)
+    return left in right
+
+
+def nonmember(left, right):
+    """Return outcome of ``left not in right``, which is element-wise when
+    *left* is an array, see :func:`isin`."""
+
+    if isinstance(left, ndarray) and left.shape:
+        return isin(left, right, True)
+    return left not in right
@@ -0,0 +1,271 @@
+"""This module defines an evaluation engine that pushes the set of surviving
+elements of logical operations into their later operands.
+
+When evaluating ``a > 0 and sqrt(b) * c > 1`` using :func:`.neval` with
+``pushdown=True``, the second operand is computed only for elements where
+``a > 0`` is true.  Arrays named in later operands are gathered at surviving
+indices, and arithmetic operations, comparisons, and :class:`numpy.ufunc`
+calls are applied to gathered elements only.  Other sub-expressions, such as
+attribute access, subscripts, and calls to other functions, are evaluated in
+full and then gathered, so that the outcome does not change.
+
+Arrays in later operands are broadcast against the shape of the first array
+operand of a logical operation.  Array :term:`squeezing` is not performed."""
+
+import ast
+import copy
+import operator
+
+from ast import Expression, parse
+from ast import fix_missing_locations as fml
+
+import numpy
+from numpy import ndarray, ufunc
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+from .transformers import COMPARE, RESERVED, LazyTransformer, bind
+
+__all__ = ['PushdownEvaluator', 'pushdown_plan']
+
+BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: getattr(operator, 'div', operator.truediv),
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+
+UNARYOPS = {
+    ast.Invert: operator.invert,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: lambda value: (numpy.logical_not(value)
+                            if isinstance(value, ndarray) else not value),
+}
+
+
+def pushdown_plan(source, cache=True):
+    """Return parsed *source* to be evaluated using
+    :class:`.PushdownEvaluator`.  Parsed expressions are stored in
+    :data:`napi.cache.code_cache`, along with code compiled for their
+    sub-expressions."""
+
+    from .cache import code_cache, make_key
+
+    if cache is True:
+        cache = code_cache
+    elif cache is False:
+        cache = None
+    key = None
+    if cache is not None:
+        key = make_key(source, '<string>', 'pushdown', PushdownEvaluator, {})
+        plan = cache.get(key)
+        if plan is not None:
+            return plan
+    plan = parse(source, '<string>', 'eval')
+    if key is not None:
+        cache.set(key, plan)
+    return plan
+
+
+class PushdownEvaluator(ast.NodeVisitor):
+
+    """An :mod:`ast` visitor that evaluates an expression, evaluating later
+    operands of logical operations and chained comparisons only at indices
+    of elements whose outcome is not yet decided."""
+
+    def __init__(self, globals, locals, **kwargs):
+
+        self._g, self._l = globals, locals
+        self._kwargs = kwargs
+        self._shape = None
+        self._index = None
+
+    def gather(self, value):
+        """Return elements of *value* at surviving indices.  Non-array
+        values are returned as they are."""
+
+        index = self._index
+        if index is None or not isinstance(value, ndarray) or not value.ndim:
+            return value
+        if value.shape != self._shape:
+            value = numpy.broadcast_to(value, self._shape)
+        return value[index]
+
+    def evaluate(self, node):
+        """Evaluate *node* in full using code transformed by
+        :class:`.LazyTransformer`, and return its value gathered at
+        surviving indices."""
+
+        code = getattr(node, '_napi_code', None)
+        if code is None:
+            expr = Expression(body=copy.deepcopy(node))
+            expr = LazyTransformer(bound=True).visit(expr)
+            code = node._napi_code = bind(compile(fml(expr), '<string>',
+                                                  'eval'))
+        return self.gather(eval(code, self._g, self._l))
+
+    generic_visit = evaluate
+
+    def visit_Expression(self, node):
+
+        return self.visit(node.body)
+
+    def visit_Name(self, node):
+
+        name = node.id
+        for ns in (self._l, self._g):
+            try:
+                return self.gather(ns[name])
+            except KeyError:
+                pass
+        try:
+            return getattr(builtins, name)
+        except AttributeError:
+            try:
+                return RESERVED[name]
+            except KeyError:
+                raise NameError('name {} is not defined'.format(repr(name)))
+
+    def visit_Num(self, node):
+
+        return node.n
+
+    def visit_Str(self, node):
+
+        return node.s
+
+    def visit_Constant(self, node):
+
+        return node.value
+
+    visit_NameConstant = visit_Constant
+
+    def visit_BinOp(self, node):
+
+        try:
+            op = BINOPS[node.op.__class__]
+        except KeyError:
+            return self.evaluate(node)
+        return op(self.visit(node.left), self.visit(node.right))
+
+    def visit_UnaryOp(self, node):
+
+        return UNARYOPS[node.op.__class__](self.visit(node.operand))
+
+    def visit_Call(self, node):
+
+        func = self.visit(node.func)
+        if (isinstance(func, ufunc) and not node.keywords and
+            not getattr(node, 'starargs', None) and
+            not getattr(node, 'kwargs', None) and
+            not any(isinstance(arg, getattr(ast, 'Starred', ()))
+                    for arg in node.args)):
+            return func(*[self.visit(arg) for arg in node.args])
+        return self.evaluate(node)
+
+    def visit_BoolOp(self, node):
+
+        values = node.values
+        return self._reduce((lambda node=node: self.visit(node)
+                             for node in values),
+                            isinstance(node.op, ast.And))
+
+    def visit_Compare(self, node):
+
+        ops, comparators = node.ops, node.comparators
+        if len(ops) == 1:
+            return COMPARE[ops[0].__class__](self.visit(node.left),
+                                             self.operand(ops[0],
+                                                          comparators[0]))
+        state = {'left': self.visit(node.left)}
+
+        def compare(op, right):
+            right = self.operand(op, right)
+            value = COMPARE[op.__class__](state['left'], right)
+            state['left'] = right
+            return value
+
+        def narrowed(mask):
+            left = state['left']
+            if isinstance(left, ndarray) and left.ndim:
+                if left.shape != mask.shape:
+                    left = numpy.broadcast_to(left, mask.shape)
+                state['left'] = left[mask]
+
+        return self._reduce((lambda op=op, right=right: compare(op, right)
+                             for op, right in zip(ops, comparators)),
+                            True, narrowed)
+
+    def operand(self, op, node):
+        """Return value of *node* compared using *op*.  Right operands of
+        membership tests are values to look elements up in, so they are not
+        gathered at surviving indices."""
+
+        if not isinstance(op, (ast.In, ast.NotIn)):
+            return self.visit(node)
+        index = self._index
+        self._index = None
+        try:
+            return self.visit(node)
+        finally:
+            self._index = index
+
+    def _reduce(self, thunks, conjunction, narrowed=None):
+        """Perform logical *and* (when *conjunction* is true) or *or*
+        operation on values returned by *thunks*, narrowing the set of
+        surviving indices after evaluation of each array operand."""
+
+        outer, shape = self._index, self._shape
+        pos = None
+        value = None
+        try:
+            for thunk in thunks:
+                value = thunk()
+                if isinstance(value, ndarray) and value.ndim:
+                    mask = value if value.dtype == bool else value.astype(bool)
+                    if not conjunction:
+                        mask = numpy.logical_not(mask)
+                    if pos is None:
+                        if outer is None:
+                            self._shape = size = mask.shape
+                            pos = self._index = mask.nonzero()
+                        else:
+                            size = mask.shape
+                            pos = mask.nonzero()
+                            self._index = tuple(i[pos[0]] for i in outer)
+                    else:
+                        pos = tuple(p[mask] for p in pos)
+                        self._index = tuple(i[mask] for i in self._index)
+                    if not len(pos[0]):
+                        break
+                    if narrowed is not None:
+                        narrowed(mask)
+                elif bool(value) != conjunction:
+                    if pos is None:
+                        return value
+                    pos = tuple(p[:0] for p in pos)
+                    break
+        finally:
+            self._index, self._shape = outer, shape
+
+        if pos is None:
+            return value
+        if conjunction:
+            result = numpy.zeros(size, bool)
+            result[pos] = True
+        else:
+            result = numpy.ones(size, bool)
+            result[pos] = False
+        return result
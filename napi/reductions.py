@@ -0,0 +1,159 @@
+"""This module defines reductions of logical operations and comparisons of
+arrays that are evaluated block by block and stop at the first block that
+decides the outcome.
+
+:func:`.any_of`, :func:`.all_of`, and :func:`.count_of` evaluate an
+expression for blocks of elements of arrays it refers to, so that the whole
+mask is never built:
+
+>>> from napi import any_of
+>>> a, b = arange(10 ** 8), zeros(10 ** 8)
+>>> any_of('a > 0 and b < a')
+True
+
+Only the first block is evaluated in this example.  Blocks start with
+:data:`FIRST` elements and grow up to *chunk* elements, :data:`.CHUNK` by
+default, so that early exits are cheap and long scans have little overhead.
+
+An expression is evaluated block by block when it consists of names,
+constants, comparisons, and arithmetic, logical, and unary operations, and
+when arrays it refers to have the same shape.  Other expressions are
+evaluated as a whole and reduced.  Note that reductions consider all
+elements of multi-dimensional arrays.
+
+:class:`.LazyTransformer` replaces calls of :func:`any` and :func:`all`
+whose argument is a logical operation or a comparison with calls to
+:func:`.napi_any` and :func:`.napi_all`, e.g. ``if any(a > 0 and b < c):``
+is evaluated block by block.  Names ``any`` and ``all`` are resolved when
+the call is made, and other functions bound to them, or operands that are
+not arrays, are handled as in Python."""
+
+import ast
+from numbers import Number
+
+import numpy
+from numpy import ndarray
+
+from .kernels import CHUNK, flatten
+
+__all__ = ['FIRST', 'KINDS', 'block_names', 'reduce_value', 'reduce_blocks',
+           'reduce_expression']
+
+FIRST = 1024
+
+KINDS = ('any', 'all', 'count')
+
+SCALARS = (Number, numpy.generic, str, bytes)
+
+NODES = tuple(getattr(ast, name) for name in
+              ('Name', 'Constant', 'Num', 'Str', 'NameConstant', 'Compare',
+               'BoolOp', 'BinOp', 'UnaryOp', 'operator', 'cmpop', 'boolop',
+               'unaryop', 'Load') if hasattr(ast, name))
+
+
+def block_names(node):
+    """Return sorted names that *node* refers to, if it can be evaluated
+    block by block, i.e. it consists of names, constants, comparisons, and
+    arithmetic, logical, and unary operations.  Otherwise, return **None**."""
+
+    names = set()
+    for item in ast.walk(node):
+        if not isinstance(item, NODES):
+            return None
+        if isinstance(item, ast.Name):
+            names.add(item.id)
+    return sorted(names)
+
+
+def reduce_value(kind, value):
+    """Return the outcome of reduction *kind* of *value*, an array, a
+    :class:`.PackedMask`, or another object that is tested for truth."""
+
+    if hasattr(value, 'shape') and value.shape:
+        if kind == 'any':
+            return bool(value.any())
+        if kind == 'all':
+            return bool(value.all())
+        if hasattr(value, 'count'):
+            return int(value.count())
+        return int(numpy.count_nonzero(value))
+    if kind == 'count':
+        return int(bool(value))
+    return bool(value)
+
+
+def reduce_blocks(kind, func, args, chunk=CHUNK):
+    """Return the outcome of reduction *kind* of ``func(*args)``, calling
+    *func* with blocks of arrays in *args*.  For ``'any'`` and ``'all'``,
+    evaluation stops at the first block that decides the outcome.  When
+    arrays do not have the same shape, or other items of *args* are not
+    scalars, e.g. lists, *func* is called once with *args*."""
+
+    shapes = set()
+    for arg in args:
+        if isinstance(arg, ndarray) and arg.shape:
+            shapes.add(arg.shape)
+        elif not (isinstance(arg, SCALARS) or isinstance(arg, ndarray)):
+            return reduce_value(kind, func(*args))
+    if len(shapes) != 1:
+        return reduce_value(kind, func(*args))
+    size = int(numpy.prod(shapes.pop()))
+    flats = [(flatten(arg), True) if isinstance(arg, ndarray) and arg.shape
+             else (arg, False) for arg in args]
+    chunk = max(chunk or CHUNK, 1)
+    count = 0
+    start, step = 0, min(FIRST, chunk)
+    while start < size:
+        stop = min(start + step, size)
+        value = func(*[arg[start:stop] if flat else arg
+                       for arg, flat in flats])
+        if not (hasattr(value, 'shape') and value.shape):
+            return reduce_value(kind, value)
+        if kind == 'any':
+            if value.any():
+                return True
+        elif kind == 'all':
+            if not value.all():
+                return False
+        else:
+            count += reduce_value(kind, value)
+        start, step = stop, min(step * 2, chunk)
+    if kind == 'count':
+        return count
+    return kind == 'all'
+
+
+def reduce_expression(kind, expression, globals, locals, **kwargs):
+    """Return the outcome of reduction *kind* of *expression* evaluated
+    using *globals* and *locals*, block by block when possible.  Keyword
+    arguments are passed to :func:`.neval` and :func:`.ncompile`."""
+
+    from napi import neval, ncompile
+    from napi.transformers import CompiledTransformer, runtime
+
+    if kind not in KINDS:
+        raise ValueError('kind must be one of {}'.format(', '.join(KINDS)))
+    names = block_names(ast.parse(expression.strip(), '<string>',
+                                  'eval').body)
+    if not names:
+        if kind == 'count':
+            kwargs['output'] = 'count'
+            return int(neval(expression, globals, locals, **kwargs))
+        return reduce_value(kind, neval(expression, globals, locals,
+                                        **kwargs))
+
+    args = []
+    for name in names:
+        try:
+            args.append(locals[name])
+        except KeyError:
+            try:
+                args.append(globals[name])
+            except KeyError:
+                raise NameError('name {} is not defined'.format(repr(name)))
+    kwargs.setdefault('transformer', CompiledTransformer)
+    kwargs.setdefault('prefix', '_napi_')
+    source = 'lambda {}: ({})'.format(', '.join(names), expression.strip())
+    code = ncompile(source, '<string>', 'eval', **kwargs)
+    func = eval(code, runtime(kwargs['prefix']))
+    return reduce_blocks(kind, func, args, kwargs.get('chunk') or CHUNK)
@@ -0,0 +1,223 @@
+"""This module defines reordering of operands of logical operations, so
+that operands that are cheap or decide many elements are used first.
+
+When *reorder* option is true, e.g. ``neval(expr, sc=1, reorder=True)``,
+elements of array operands of ``and`` and ``or`` operations are gathered in
+order of increasing rank ``cost / (1 - p)``, where *p* is the fraction of
+elements whose outcome is still undecided after the operand, i.e. fraction
+of **True** elements for ``and`` and of **False** elements for ``or``, and
+*cost* is the relative cost of gathering an element of the operand.  This
+order minimizes the expected number of elements that are gathered when
+operands are independent.
+
+Fractions are estimated from a small sample of each operand.  When a *key*
+identifying the expression is given, fractions observed during evaluation
+are stored in :data:`selectivities` and used in later calls, so that order
+of operands of recurring expressions converges on the fastest one.
+:class:`.NapiTransformer` and :class:`.LazyTransformer` use a dump of the
+expression AST as the key.
+
+Without *defer* option, only operands that are already evaluated arrays
+are reordered, which reduces the number of elements gathered from them,
+but all operands are evaluated.  With *defer* option, operands are
+evaluated only until the outcome is decided, and :func:`iter_reordered`
+evaluates side effect free operands in order of their rank, with *cost*
+being the evaluation time of the operand, so that an expensive operand is
+skipped when cheaper ones decide the outcome.  Fractions and evaluation
+times are observed as operands are evaluated, so the first evaluation of
+an expression keeps the source order.  Operands with side effects, such
+as function calls, are evaluated in their place, and other operands are
+not moved across them."""
+
+from timeit import default_timer
+from collections import OrderedDict
+
+import numpy
+from numpy import ndarray
+
+from .adaptive import density
+
+__all__ = ['SelectivityStore', 'selectivities', 'reorder_operands',
+           'iter_reordered']
+
+WEIGHT = 0.5
+
+
+class SelectivityStore(object):
+
+    """A bounded store of fractions of undecided elements and evaluation
+    times observed for operands of at most *maxsize* expressions.  Least
+    recently used expressions are discarded first."""
+
+    def __init__(self, maxsize=1024):
+
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._costs = {}
+
+    def __len__(self):
+
+        return len(self._data)
+
+    def __contains__(self, key):
+
+        return key in self._data
+
+    def get(self, key, count):
+        """Return list of fractions for *count* operands of expression with
+        *key*, **None** for operands that are not observed yet."""
+
+        try:
+            fractions = self._data.pop(key)
+        except KeyError:
+            return [None] * count
+        self._data[key] = fractions
+        if len(fractions) != count:
+            return [None] * count
+        return list(fractions)
+
+    def costs(self, key, count):
+        """Return list of evaluation times in seconds for *count* operands of
+        expression with *key*, **None** for operands not observed yet."""
+
+        costs = self._costs.get(key)
+        if costs is None or len(costs) != count:
+            return [None] * count
+        return list(costs)
+
+    def observe(self, key, count, position, fraction, cost=None):
+        """Record *fraction*, and evaluation time *cost* when given, observed
+        for operand at *position* among *count* operands of expression with
+        *key*, averaging them with earlier observations."""
+
+        fractions = self._data.pop(key, None)
+        if fractions is None or len(fractions) != count:
+            fractions = [None] * count
+        fractions[position] = _average(fractions[position], fraction)
+        self._data[key] = fractions
+        if cost is not None:
+            costs = self._costs.get(key)
+            if costs is None or len(costs) != count:
+                costs = self._costs[key] = [None] * count
+            costs[position] = _average(costs[position], cost)
+        while len(self._data) > self.maxsize:
+            self._costs.pop(self._data.popitem(last=False)[0], None)
+
+    def clear(self):
+        """Remove all observations."""
+
+        self._data.clear()
+        self._costs.clear()
+
+
+def _average(old, new):
+
+    if old is None:
+        return new
+    return old + WEIGHT * (new - old)
+
+
+selectivities = SelectivityStore()
+
+
+def rank(array, fraction):
+    """Return rank of *array* operand whose *fraction* of elements remains
+    undecided.  Operands with lower ranks should be evaluated first."""
+
+    cost = array.dtype.itemsize + (array.dtype != bool)
+    return cost / max(1. - fraction, 1e-9)
+
+
+def reorder_operands(arrays, conjunction=True, key=None, store=None):
+    """Return *arrays* reordered for :func:`.short_circuit_and` (when
+    *conjunction* is true) or :func:`.short_circuit_or`, that evaluate the
+    first array followed by the rest in reverse order, and a callable that
+    records counts of undecided elements after each operand, or **None**
+    when *key* is **None**."""
+
+    if store is None:
+        store = selectivities
+    count = len(arrays)
+    observed = store.get(key, count) if key is not None else [None] * count
+    fractions = []
+    for array, fraction in zip(arrays, observed):
+        if fraction is None:
+            fraction = density(array)
+            if not conjunction:
+                fraction = 1. - fraction
+        fractions.append(fraction)
+    order = sorted(range(count),
+                   key=lambda i: (rank(arrays[i], fractions[i]), i))
+    ordered = [arrays[order[0]]] + [arrays[i] for i in reversed(order[1:])]
+
+    if key is None:
+        return ordered, None
+
+    size = float(arrays[0].size)
+
+    def observe(counts):
+        """Record *counts* of undecided elements after each operand."""
+
+        before = size
+        for position, after in zip(order, counts):
+            if not before:
+                break
+            store.observe(key, count, position, after / before)
+            before = after
+
+    return ordered, observe
+
+
+def _undecided(value, conjunction):
+    """Return fraction of elements of operand *value* whose outcome is not
+    decided by it."""
+
+    if isinstance(value, ndarray) and value.shape:
+        if not value.size:
+            return 0.
+        fraction = numpy.count_nonzero(value) / float(value.size)
+    else:
+        fraction = 1. if value else 0.
+    return fraction if conjunction else 1. - fraction
+
+
+def iter_reordered(thunks, pure, conjunction=True, key=None, store=None):
+    """Yield operands returned by calling *thunks*, for :func:`.deferred_and`
+    (when *conjunction* is true) or :func:`.deferred_or`.  Items of *pure*
+    tell whether operands have no side effects.  Thunks of runs of pure
+    operands are called in order of increasing rank ``cost / (1 - p)`` of
+    evaluation time and fraction of undecided elements observed for
+    expression with *key*, and operands that are not observed yet are
+    called after observed ones, in order.  Observations are recorded for
+    operands that are evaluated."""
+
+    if store is None:
+        store = selectivities
+    count = len(thunks)
+    fractions = costs = [None] * count
+    if key is not None:
+        fractions = store.get(key, count)
+        costs = store.costs(key, count)
+
+    runs = []
+    run = 0
+    for flag in pure:
+        run += not flag
+        runs.append(run)
+        run += not flag
+
+    def order(i):
+
+        if fractions[i] is None or costs[i] is None:
+            return (runs[i], 1, 0., i)
+        return (runs[i], 0, max(costs[i], 1e-9) /
+                max(1. - fractions[i], 1e-9), i)
+
+    for position in sorted(range(count), key=order):
+        start = default_timer()
+        value = thunks[position]()
+        if key is not None:
+            store.observe(key, count, position,
+                          _undecided(value, conjunction),
+                          default_timer() - start)
+        yield value
@@ -1,10 +1,12 @@
+import ast
+
 from nose.tools import raises
 import numpy as np
 
 from napi import neval
 from napi.transformers import NapiTransformer, LazyTransformer
-from napi.transformers import short_circuit_and
-TRANSFORMERS = [NapiTransformer]#, LazyTransformer]
+from napi.transformers import short_circuit_and, COMPARE
+TRANSFORMERS = [NapiTransformer, LazyTransformer]
 
 randbools = lambda *n: np.random.randn(*n) < 0
 
@@ -39,8 +41,13 @@ def test_napi_magic_configuration():
     magic._remove = magic._append = lambda: None
     func = magic.napi
     for line in ['', '', 'on', 'off', '1', '0', 'sq', 'sq', 'sc', 'sc',
-                 'sq on', 'sq off', 'sq 1', 'sq 0',
-                 'sc 0', 'sc 10000']:
+                 'sq on', 'sq off', 'sq 1', 'sq 0', 'bc', 'broadcast off',
+                 'sc 0', 'sc 10000', 'defer', 'defer', 'defer on',
+                 'defer off', 'chunk', 'chunk', 'chunk 100', 'chunk 0',
+                 'threads', 'threads', 'threads 4', 'grain', 'grain 1000',
+                 'sc auto', 'sc', 'reorder', 'reorder off', 'stats on',
+                 'stats', 'stats reset', 'stats off', 'explain', 'cse',
+                 'cse off', 'index', 'index off']:
 
         yield check_napi_magic_configuration, func, line
 
@@ -223,6 +230,1157 @@ def test_name_problem(debug=False):
     neval('a and b', {}, debug=debug)
 
 
+def test_code_cache():
+
+    from napi import ncompile
+    from napi.cache import CodeCache
+
+    cache = CodeCache(maxsize=2)
+    code = ncompile('a and b', cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert ncompile('a and b', cache=cache) is code
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert ncompile('a and b', sc=100, cache=cache) is not code
+    ncompile('a or b', cache=cache)
+    assert len(cache) == 2
+    ncompile('a and b', cache=cache)
+    assert cache.misses == 4
+    cache.clear()
+    assert cache.info() == {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 2}
+
+
+def test_lazy_neval(debug=False):
+
+    a = np.arange(10)
+    b = randbools(10)
+
+    ns = {'a': a, 'b': b}
+    for src, res in [
+        ('2 <= a < 6 or b', np.logical_or((2 <= a) & (a < 6), b)),
+        ('a > 2 and b', np.logical_and(a > 2, b)),
+        ]:
+        for i in range(2):
+            result = neval(src, ns, transformer=LazyTransformer)
+            assert np.all(result == res), '{} != {}'.format(result, res)
+
+
+
+def test_deferred_evaluation():
+
+    calls = []
+    def f(x):
+        calls.append(x)
+        return x
+
+    a = np.zeros(10, bool)
+    b = randbools(10)
+    ns = {'a': a, 'b': b, 'f': f}
+    for src, res, ncalls in [
+        ('a and f(b) and f(b)', np.zeros(10, bool), 0),
+        ('~a or f(b) or f(b)', np.ones(10, bool), 0),
+        ('b and f(~a) and f(b)', b, 2),
+        ('0 and f(b)', 0, 0),
+        ('1 < f(2) < f(a.sum()) < f(b)', False, 2),
+        ('0 <= b < f(2)', np.ones(10, bool), 1),
+        ]:
+        del calls[:]
+        result = neval(src, ns, transformer=LazyTransformer, defer=True)
+        assert np.all(result == res), '{} != {}'.format(result, res)
+        assert len(calls) == ncalls, '{}: {} calls'.format(src, len(calls))
+
+
+
+def check_pushdown(source, ns):
+
+    result = neval(source, ns, pushdown=True)
+    expect = neval(source, ns)
+    assert np.all(result == expect), '{} != {}'.format(result, expect)
+
+
+def test_pushdown(debug=False):
+
+    a = np.arange(-4, 6)
+    b = np.arange(10.)
+    c = randbools(10)
+    m = np.arange(30).reshape(3, 10) % 7
+    ns = {'a': a, 'b': b, 'c': c, 'm': m, 'np': np}
+    for src in [
+        'a > 0 and np.sqrt(b) * 2 > 3',
+        'a > 0 and c or a < -2',
+        'a > 100 and a < 0',
+        '-2 < a < 3 and b < 5 and c',
+        '(a > 0 or c) and not c',
+        'm > 2 and m < 5 or m == 0',
+        'm > 2 and m.T.T < 5',
+        '0 <= a < 5 < b + 10',
+        ]:
+        yield check_pushdown, src, ns
+
+    calls = []
+    ns['check'] = np.frompyfunc(calls.append, 1, 1)
+    neval('a > 0 and check(b)', ns, pushdown=True)
+    assert len(calls) == 5, calls
+
+
+
+def check_chunked(func, args, expect, options):
+
+    result = func(*args, **options)
+    assert np.all(result == expect), '{} != {}'.format(result, expect)
+
+
+def test_chunked_evaluation():
+
+    from napi.transformers import napi_and, napi_or, napi_compare
+
+    a, b, c = [randbools(30, 20) for i in range(3)]
+    x = np.arange(1200.).reshape(40, 30)[::2, ::-1].T
+    y = np.arange(600).reshape(30, 20) % 7
+    for options in [{'chunk': 7}, {'chunk': 64}, {'chunk': 1000},
+                    {'threads': 3, 'grain': 50},
+                    {'threads': 4, 'grain': 10, 'chunk': 16}]:
+        for func, args, expect in [
+            (napi_and, ([a, b, c],), a & b & c),
+            (napi_or, ([a, b, c],), a | b | c),
+            (napi_and, ([a, y, 1],), a & (y > 0)),
+            (napi_or, ([y, x[::-1, ::-1]],), (y > 0) | (x[::-1, ::-1] > 0)),
+            (napi_compare, (0, ['Lt', 'LtE'], [y, 4]), (0 < y) & (y <= 4)),
+            (napi_compare, (x, ['Gt', 'LtE'], [200, 900]), x > 200),
+            ]:
+            yield check_chunked, func, args, expect, options
+
+    ns = {'a': a, 'y': y}
+    for trans in TRANSFORMERS:
+        result = neval('a and 1 <= y < 5', ns, chunk=50, transformer=trans)
+        assert np.all(result == (a & (1 <= y) & (y < 5)))
+
+
+
+def test_packed_masks():
+
+    from napi.masks import PackedMask
+    from napi.transformers import napi_and, napi_or
+
+    for shape in [(1,), (7,), (64,), (130,), (5, 13)]:
+        a, b, c = [randbools(*shape) for i in range(3)]
+        pa = PackedMask.from_bool(a)
+        assert np.all(pa.to_bool() == a)
+        assert np.all((~pa).to_bool() == ~a)
+        assert pa.count() == a.sum()
+        assert all(np.all(i == j) for i, j in zip(pa.nonzero(), a.nonzero()))
+        assert np.all(PackedMask.from_indices(a.nonzero(), shape).to_bool()
+                      == a)
+        result = napi_and([pa, b, c])
+        assert isinstance(result, PackedMask)
+        assert np.all(result.to_bool() == a & b & c)
+        result = napi_or([a, b, c], packed=True)
+        assert np.all(result.to_bool() == a | b | c)
+        assert np.all(napi_and([pa, 0]).to_bool() == False)
+        assert np.all(napi_or([pa, 1]).to_bool() == True)
+
+    ns = {'a': a, 'b': b, 'x': np.arange(65)}
+    for trans in TRANSFORMERS:
+        result = neval('a and ~b', ns, packed=True, transformer=trans)
+        assert np.all(result.to_bool() == a & ~b)
+        result = neval('0 < x < 10', ns, packed=True, transformer=trans)
+        assert np.all(result.to_bool() == (0 < ns['x']) & (ns['x'] < 10))
+
+
+
+def check_fused_range(left, ops, comparators, expect):
+
+    from napi.transformers import napi_compare
+
+    for options in [{}, {'chunk': 100}, {'threads': 3, 'grain': 1000}]:
+        result = napi_compare(left, ops, comparators, **options)
+        assert np.all(result == expect), (left, ops, comparators, options)
+
+
+def test_fused_range():
+
+    for dtype in ['i1', 'u1', 'i2', 'i8', 'u8', 'f8']:
+        info = np.iinfo(dtype) if dtype[0] in 'iu' else None
+        lo, hi = (info.min, info.max) if info else (-1e300, 1e300)
+        a = np.linspace(lo, hi, 40000).astype(dtype)
+        a[::7] = lo
+        a[::11] = hi
+        for left, right in [(0, 100), (lo, hi), (-1000, 0), (-1, lo),
+                            (hi - 1, 10 ** 30), (-10 ** 30, lo + 1)]:
+            for ops in [['Lt', 'Lt'], ['Lt', 'LtE'], ['LtE', 'Lt'],
+                        ['LtE', 'LtE']]:
+                expect = np.logical_and(
+                    COMPARE[ops[0]](left, a), COMPARE[ops[1]](a, right))
+                yield check_fused_range, left, ops, [a, right], expect
+            expect = np.logical_and(right > a, a >= left)
+            yield check_fused_range, right, ['Gt', 'GtE'], [a, left], expect
+
+    a = np.arange(40000.)
+    a[::3] = np.nan
+    ns = {'a': a}
+    for trans in TRANSFORMERS:
+        result = neval('10 < a <= 30000', ns, transformer=trans)
+        assert np.all(result == ((10 < a) & (a <= 30000)))
+
+
+
+def test_broadcasting():
+
+    from napi.transformers import napi_and, napi_or
+
+    a, b, c = randbools(30, 1), randbools(1, 20), randbools(20)
+    for options in [{}, {'sc': 1}, {'chunk': 64}, {'packed': True}]:
+        result = napi_and([a, b, c], bc=True, **options)
+        assert np.all(np.asarray(result) == a & b & c), options
+        result = napi_or([a, b, c], bc=True, **options)
+        assert np.all(np.asarray(result) == a | b | c), options
+        result = napi_and([a, 0, b], bc=True, **options)
+        assert np.asarray(result).shape == (30, 20)
+
+    ns = {'a': a, 'b': b, 'c': c}
+    for trans in TRANSFORMERS:
+        result = neval('a and b or c', ns, bc=True, transformer=trans)
+        assert np.all(result == (a & b) | c)
+    result = neval('a and b or c', ns, bc=True, transformer=LazyTransformer,
+                   defer=True)
+    assert np.all(result == (a & b) | c)
+
+
+@raises(ValueError)
+def test_broadcasting_problem():
+
+    from napi.transformers import napi_and
+    napi_and([randbools(3, 2), randbools(2, 3)], bc=True)
+
+
+
+def test_benchmarks():
+
+    from napi import bench
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+
+    baseline = dict(bench.BASELINE, size=100)
+    cases = list(bench.iter_cases(bench.BENCHMARKS, baseline,
+                                  {'density': [0.1], 'operands': [2]}))
+    assert len(cases) == 3 * len(bench.BENCHMARKS)
+    results = bench.run(cases[:3], repeat=1)
+    assert len(results['results']) == 3
+    assert all(result['napi'] > 0 for result in results['results'])
+    stream = StringIO()
+    assert bench.compare(results, results, stream=stream) == []
+    assert len(stream.getvalue().splitlines()) == 3
+
+
+def test_adaptive():
+
+    import os
+    import shutil
+    import tempfile
+    from napi import adaptive
+
+    costs = {'dense': 1., 'scan': 1., 'emit': 1., 'gather': 1.,
+             'scatter': 1., 'chunk': 1.}
+    sparse = [np.zeros(100000, bool), randbools(100000), randbools(100000)]
+    assert adaptive.choose_strategy(sparse, True, costs) != 'dense'
+    assert adaptive.choose_strategy(sparse, False, costs) == 'dense'
+    estimates = adaptive.estimate(sparse, True, costs)
+    assert sorted(estimates) == sorted(adaptive.STRATEGIES)
+
+    temp = tempfile.mkdtemp()
+    try:
+        calibrate = adaptive.calibrate
+        adaptive.calibrate = lambda: calibrate(size=1000, repeat=1)
+        try:
+            costs = adaptive.load_costs(temp)
+        finally:
+            adaptive.calibrate = calibrate
+        assert sorted(costs) == sorted(adaptive.calibrate(1000, 1))
+        assert os.path.isfile(os.path.join(temp, 'calibration.json'))
+        assert adaptive.load_costs(temp) is costs
+        adaptive._costs.clear()
+        assert adaptive.load_costs(temp) == costs
+
+        os.environ['NAPI_HOME'] = temp
+        arrays = dict(('a{}'.format(i), randbools(1000)) for i in range(4))
+        arrays['z'] = np.zeros(1000, bool)
+        for src in ['a0 and a1', 'a0 or a1 or a2', 'z and a0 and a1',
+                    'z or a0 or a1 or a2 or a3']:
+            expected = neval(src, arrays)
+            assert all(neval(src, arrays, sc='auto') == expected), src
+            for t in TRANSFORMERS:
+                assert all(neval(src, arrays, sc='auto', transformer=t) ==
+                           expected), src
+    finally:
+        os.environ.pop('NAPI_HOME', None)
+        shutil.rmtree(temp)
+
+
+def test_reorder():
+
+    from napi.reorder import SelectivityStore, reorder_operands, selectivities
+
+    sparse = np.zeros(1000, bool)
+    sparse[::100] = True
+    dense = np.ones(1000, bool)
+    ints = np.ones(1000, int)
+    arrays, observe = reorder_operands([dense, ints, sparse])
+    assert observe is None
+    assert arrays[0] is sparse and arrays[-1] is dense
+    arrays, observe = reorder_operands([sparse, dense], False)
+    assert arrays[0] is dense
+
+    store = SelectivityStore(maxsize=2)
+    arrays, observe = reorder_operands([dense, sparse], True, 'x', store)
+    observe([10, 10])
+    assert store.get('x', 2) == [1., 0.01]
+    store.observe('y', 1, 0, 0.5)
+    store.observe('z', 1, 0, 0.5)
+    assert len(store) == 2 and 'x' not in store
+
+    selectivities.clear()
+    ns = {'a': dense, 'b': randbools(1000), 'c': sparse}
+    for src in ['a and b and c', 'c or b or a', 'a and (b or c) and a']:
+        expected = neval(src, ns)
+        for t in TRANSFORMERS:
+            for i in range(2):
+                result = neval(src, ns, sc=1, reorder=True, transformer=t)
+                assert all(result == expected), src
+    assert len(selectivities) == 4
+
+
+class Counted(np.ndarray):
+
+    calls = 0
+
+    def __ge__(self, other):
+
+        Counted.calls += 1
+        return np.asarray(self) >= other
+
+    def __lt__(self, other):
+
+        Counted.calls += 1
+        return np.asarray(self) < other
+
+
+def test_reorder_deferred():
+
+    from napi.reorder import selectivities
+    from napi.transformers import CompiledTransformer
+
+    calls = []
+    ns = {'x': np.arange(1000).view(Counted), 'y': np.arange(1000),
+          'f': lambda a: calls.append(1) or a > 0}
+    for trans in [LazyTransformer, CompiledTransformer]:
+        selectivities.clear()
+        Counted.calls = 0
+        for i in range(3):
+            result = neval('x >= 0 and y < 0', ns, transformer=trans,
+                           defer=True, reorder=True)
+            assert not result.any()
+            result = neval('x < 0 or y >= 0', ns, transformer=trans,
+                           defer=True, reorder=True)
+            assert result.all()
+        assert Counted.calls == 2, trans
+
+        del calls[:]
+        for i in range(3):
+            neval('f(y) and y < 0', ns, transformer=trans, defer=True,
+                  reorder=True)
+        assert len(calls) == 3
+
+
+def test_instrument():
+
+    from napi import instrument, stats
+
+    ns = {'a': np.arange(10000), 'b': randbools(10000)}
+    instrument.reset()
+    neval('a > 10 and b', ns)
+    assert stats() == {}
+
+    instrument.enable()
+    try:
+        neval('a > 10 and b', ns, sc=0)
+        neval('a > 10 and b', ns, sc=1)
+        neval('a < 0 or b', ns, sc=1, transformer=LazyTransformer)
+        neval('0 < a < 100', ns, chunk=100)
+        records = stats(reset=True)
+    finally:
+        instrument.disable()
+    assert stats() == {}
+
+    entry = records['a > 10 and b']
+    assert entry['calls'] == 2
+    assert entry['operations'] == {'dense': 1, 'shortcircuit': 1}
+    assert entry['survivors'] == 2 * np.count_nonzero((ns['a'] > 10) &
+                                                      ns['b'])
+    assert entry['stages'][-1] == entry['survivors'] // 2
+    assert entry['touched'] > 0 and entry['temp_bytes'] > 0
+    assert entry['parse'] > 0 and entry['evaluate'] > 0
+    entry = records['a < 0 or b']
+    assert entry['operations'] == {'shortcircuit': 1}
+    assert entry['transform'] > 0
+    assert records['0 < a < 100']['operations'] == {'fused': 1}
+    assert 'calls=2' in instrument.report(records)
+
+    instrument.enable()
+    try:
+        neval('0 < a < 100', ns)
+        records = stats(reset=True)
+    finally:
+        instrument.disable()
+    assert 'fused' not in records['0 < a < 100']['operations']
+
+
+def test_explain():
+
+    from napi.explain import Plan
+
+    ns = {'a': np.arange(20000), 'b': randbools(20000, 1),
+          'c': randbools(20000)}
+    plan = neval('a > 10 and (b or c) and 0 < a < 100', ns, explain=True)
+    assert isinstance(plan, Plan)
+    assert [item.kind for item in plan] == [
+        'napi_and', 'operand', 'napi_or', 'operand', 'operand',
+        'napi_compare', 'operand', 'operand', 'operand']
+    assert plan.shape == (20000,) and plan.dtype == bool
+    assert plan.details['strategy'] == 'shortcircuit'
+    assert plan.children[1].details['squeeze']
+    assert plan.children[2].details['strategy'] != 'fused'
+    assert 'time' not in plan.details
+    assert str(plan).splitlines()[1].startswith('  operand')
+    plan = neval('0 < a < 100', ns, explain=True, chunk=1024)
+    assert plan.details['strategy'] == 'fused'
+
+    plan = neval('a > 10 and c', ns, explain=True, sc=0,
+                 transformer=LazyTransformer)
+    assert plan.details['strategy'] == 'dense'
+    assert not plan.details['shortcircuit']
+    assert plan.details['visits'] == 40000
+
+    plan = neval('a > 10 and c', ns, explain='run')
+    expected = np.count_nonzero((ns['a'] > 10) & ns['c'])
+    assert plan.details['survivors'] == expected
+    assert plan.details['time'] >= 0
+
+
+def test_scoped_temporaries():
+
+    from napi import nexec, instrument, stats
+    from napi.transformers import Frame
+
+    x, y, a = randbools(100), randbools(100), np.arange(100)
+    ns = {}
+    local = {'x': x, 'y': y, 'a': a}
+    result = neval('(x and y) + ((a > 10 and a < 90) < x < y)', ns, local,
+                   transformer=NapiTransformer)
+    inner = (a > 10) & (a < 90)
+    assert all(result == (x & y) + ((inner < x) & (x < y)))
+    assert not [name for name in local if name.startswith('__temp__')]
+
+    nexec('z = x and not y\nfor i in range(3): w = x or y', ns, local,
+          transformer=NapiTransformer)
+    assert all(local['z'] == x & ~y) and all(local['w'] == x | y)
+    assert not [name for name in local if name.startswith('__temp__')]
+
+    names = sorted(local)
+    result = neval('(x and y) or (a > 10 and a < 90)', ns, local,
+                   transformer=NapiTransformer, subscript='_napi_temp_ns')
+    assert all(result == (x & y) | ((a > 10) & (a < 90)))
+    assert sorted(local) == names
+
+    frame = Frame('_napi_temp_ns')
+    frame.add(frame.name(), 1)
+    scope = frame.scope({'b': 4})
+    assert scope['_napi_temp_ns'] == {'__temp__1': 1} and scope['b'] == 4
+    frame.release(ast.parse("_napi_temp_ns['__temp__1']"))
+    assert len(frame) == 0
+
+    frame = Frame()
+    frame.add(frame.name(), 1)
+    frame.add(frame.name(), 2)
+    assert frame.pop('__temp__1') == 1
+    frame.add(frame.name(), 3)
+    assert frame.peak == 2 and len(frame) == 2
+    assert frame.scope({'b': 4})['__temp__3'] == 3
+
+    instrument.enable()
+    try:
+        neval('x and (y or x) and not (x and y)', ns, local,
+              transformer=NapiTransformer)
+        neval('(x and y) + (x or y)', ns, local, transformer=NapiTransformer)
+        records = stats(reset=True)
+    finally:
+        instrument.disable()
+    assert records['x and (y or x) and not (x and y)']['peak_temps'] == 1
+    assert records['(x and y) + (x or y)']['peak_temps'] == 2
+
+
+def check_compiled_transformer(source, ns):
+
+    from napi.transformers import CompiledTransformer
+
+    expected = neval(source, {}, dict(ns), transformer=NapiTransformer)
+    result = neval(source, {}, dict(ns), transformer=CompiledTransformer)
+    assert type(result) == type(expected), source
+    assert np.all(result == expected), source
+
+
+def test_compiled_transformer():
+
+    ns = {'a': np.arange(20), 'b': randbools(20), 'c': randbools(20, 1),
+          'z': np.zeros(20, bool), 'x': 1, 'y': 0}
+    for source in ['a > 5 and b', 'not b', 'not (a > 5 and c) or b',
+                   '3 < a < 10', '3 < a <= 10 != a', 'x and y', 'x or y',
+                   '(b and c) + (a > 5)', 'z and b or not c', 'not x',
+                   'list(a[b or z])', '0 < a + 1 < (b and 10)']:
+        yield check_compiled_transformer, source, ns
+
+
+def test_compiled_transformer_reuse():
+
+    from napi import ncompile
+    from napi.cache import CodeCache
+    from napi.transformers import CompiledTransformer
+
+    cache = CodeCache()
+    neval('a > 5 and not b', {'a': np.arange(10), 'b': randbools(10)},
+          cache=cache)
+    assert cache.misses == 1 and cache.hits == 0
+    neval('a > 5 and not b', {'a': np.arange(20), 'b': randbools(20)},
+          cache=cache)
+    assert cache.misses == 1 and cache.hits == 1
+    code = ncompile('a > 5 and not b', transformer=CompiledTransformer,
+                    bound=True, cache=cache)
+    assert cache.hits == 2
+    assert 'napi_not' in code.co_names and 'napi_and' in code.co_names
+    code = ncompile('a > 5 and not b', transformer=CompiledTransformer,
+                    prefix='_', cache=cache)
+    assert cache.misses == 2
+    assert '_napi_not' in code.co_names and '_napi_and' in code.co_names
+
+
+def test_nexec_compile_once():
+
+    from napi import nexec
+    from napi.cache import CodeCache
+
+    cache = CodeCache()
+    a = np.arange(10)
+    ns = {'a': a}
+    source = '\n'.join([
+        'masks = []',
+        'for i in range(5):',
+        '    masks.append(i < a < 2 * i + 1 and not a == 4)',
+        'def between(lo, hi):',
+        '    return lo <= a < hi or a == 9',
+        'last = between(2, 4)'])
+    nexec(source, ns, ns, cache=cache)
+    for i, mask in enumerate(ns['masks']):
+        assert all(mask == ((i < a) & (a < 2 * i + 1) & (a != 4)))
+    assert all(ns['last'] == ((2 <= a) & (a < 4)) | (a == 9))
+    assert all(ns['between'](0, 2) == (a < 2) | (a == 9))
+    nexec(source, ns, ns, cache=cache)
+    assert cache.misses == 1 and cache.hits == 1
+
+
+def test_vectorize_logic():
+
+    from napi import vectorize_logic
+    from napi.cache import CodeCache
+
+    cache = CodeCache()
+
+    def factory(k):
+        @vectorize_logic(cache=cache)
+        def func(a, lo=1):
+            return lo <= a < k and a != 3
+        return func
+
+    a = np.arange(10)
+    f4, f6 = factory(4), factory(6)
+    assert all(f4(a) == ((1 <= a) & (a < 4) & (a != 3)))
+    assert all(f6(a, 0) == ((0 <= a) & (a < 6) & (a != 3)))
+    assert f4.__name__ == 'func' and f4.__code__ is f6.__code__
+    assert cache.misses == 1 and cache.hits == 1
+
+    class Klass(object):
+        __low = 2
+
+        @vectorize_logic(sc=0)
+        def method(self, a):
+            return a > self.__low or a == 0
+
+    assert all(Klass().method(a) == ((a > 2) | (a == 0)))
+
+
+@raises(ValueError)
+def test_vectorize_logic_wrapped():
+
+    import functools
+    from napi import vectorize_logic
+
+    def func(a):
+        return a > 0 and a < 5
+
+    vectorize_logic(functools.wraps(func)(lambda a: func(a)))
+
+
+def test_importer():
+
+    import os
+    import sys
+    import shutil
+    import tempfile
+    from napi import importer
+
+    tmp = tempfile.mkdtemp()
+    os.mkdir(os.path.join(tmp, 'napitestpkg'))
+    sources = {
+        os.path.join('napitestpkg', '__init__.py'): '',
+        os.path.join('napitestpkg', 'filters.py'):
+            'def between(a, lo, hi):\n    return lo <= a < hi or a == 0\n',
+        'napitestmarked.py':
+            '# napi: transform\ndef positive(a, b):\n'
+            '    return a > 0 and b > 0\n'}
+    for name, source in sources.items():
+        with open(os.path.join(tmp, name), 'w') as out:
+            out.write(source)
+    names = ['napitestpkg', 'napitestpkg.filters', 'napitestmarked']
+    sys.path.insert(0, tmp)
+    finder = importer.install(prefixes='napitestpkg')
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = False
+    try:
+        a = np.arange(6)
+        from napitestpkg import filters
+        assert all(filters.between(a, 2, 4) == ((a == 0) | (a == 2) |
+                                                (a == 3)))
+        import napitestmarked
+        assert all(napitestmarked.positive(a, a - 2) == (a > 2))
+        for module in (filters, napitestmarked):
+            assert not [name for name in vars(module) if 'napi_' in name]
+        cached = os.listdir(os.path.join(tmp, 'napitestpkg', '__pycache__'))
+        assert any('.napi-' in name and name.startswith('filters.')
+                   for name in cached)
+
+        calls = []
+        source_to_code = importer.NapiLoader.source_to_code
+        importer.NapiLoader.source_to_code = lambda *args: calls.append(
+            args) or source_to_code(*args)
+        try:
+            for name in names:
+                sys.modules.pop(name, None)
+            from napitestpkg import filters
+            assert all(filters.between(a, 2, 4) == ((a == 0) | (a == 2) |
+                                                    (a == 3)))
+            assert not calls
+        finally:
+            importer.NapiLoader.source_to_code = source_to_code
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+        importer.uninstall(finder)
+        sys.path.remove(tmp)
+        for name in names:
+            sys.modules.pop(name, None)
+        shutil.rmtree(tmp)
+    assert finder not in sys.meta_path
+
+
+def test_disk_cache():
+
+    import os
+    import shutil
+    import tempfile
+    from napi import ncompile
+    from napi.cache import CodeCache, DiskCache
+    from napi.transformers import runtime
+
+    tmp = tempfile.mkdtemp()
+    try:
+        disk = DiskCache(tmp)
+        code = ncompile('a and b', cache=CodeCache(disk=disk))
+        assert len(os.listdir(tmp)) == 1
+
+        cache = CodeCache(disk=DiskCache(tmp))
+        loaded = ncompile('a and b', cache=cache)
+        assert (cache.hits, cache.misses) == (1, 0)
+        assert cache.info()['disk']['hits'] == 1
+        assert loaded is not code and loaded.co_code == code.co_code
+        a = np.arange(4)
+        b = a > 1
+        assert all(eval(loaded, runtime(), {'a': a, 'b': b}) == (a > 1))
+        ncompile('a and b', sc=100, cache=cache)
+        assert cache.disk.misses == 1 and len(os.listdir(tmp)) == 2
+
+        disk.set((ncompile.__code__, 'function'), code)
+        assert len(os.listdir(tmp)) == 2
+        disk.set(('plan',), ast.parse('a and b', mode='eval'))
+        assert len(os.listdir(tmp)) == 2
+
+        bounded = CodeCache(maxsize=1, disk=DiskCache(tmp))
+        ncompile('a and b', cache=bounded)
+        ncompile('a and b', sc=100, cache=bounded)
+        assert bounded.disk.hits == 2 and len(bounded) == 1
+
+        with open(os.path.join(tmp, disk.digest(('key',))), 'wb') as out:
+            out.write(b'corrupt')
+        assert disk.get(('key',)) is None
+        assert len(os.listdir(tmp)) == 2
+
+        small = DiskCache(tmp, maxbytes=disk.size())
+        ncompile('a or b', cache=CodeCache(disk=small))
+        assert 0 < len(os.listdir(tmp)) < 3
+        assert small.size() <= small.maxbytes
+        small.clear()
+        assert not os.listdir(tmp)
+
+        from napi.cache import code_cache
+        previous = code_cache.disk
+        code_cache.disk = DiskCache(tmp)
+        try:
+            x = np.arange(10)
+            assert neval('x > 3 and x < 5', {'x': x},
+                         pushdown=True).sum() == 1
+        finally:
+            code_cache.disk = previous
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_cse():
+
+    from napi import neval
+    from napi.cse import NamedExpr, eliminate
+    from napi.transformers import CompiledTransformer
+
+    class Table(object):
+
+        reads = 0
+
+        @property
+        def x(self):
+            self.reads += 1
+            return np.arange(-3, 5)
+
+    x = np.arange(-3, 5)
+    y, z = x % 2 == 0, x % 3 == 0
+    expected = ((x > 0) & y) | ((x > 0) & z)
+    source = '(t.x > 0 and y) or (t.x > 0 and z)'
+    for transformer in (NapiTransformer, LazyTransformer,
+                        CompiledTransformer):
+        ns = {'t': Table(), 'y': y, 'z': z}
+        result = neval(source, {}, ns, transformer=transformer, cse=True)
+        assert all(result == expected)
+        assert sorted(ns) == ['t', 'y', 'z']
+        if transformer is NapiTransformer or NamedExpr is not None:
+            assert ns['t'].reads == 1
+
+    if NamedExpr is not None:
+        tree = eliminate(ast.parse('f(a + 1 > 0) or f(a + 1 > 0) or '
+                                   '(b > 0 if a + 1 > 0 else b > 0)',
+                                   mode='eval'))
+        names = [node for node in ast.walk(tree)
+                 if isinstance(node, NamedExpr)]
+        assert len(names) == 1
+        assert ast.dump(names[0].value) == ast.dump(
+            ast.parse('a + 1 > 0', mode='eval').body)
+
+
+def check_output(expression, ns, mask, kwargs):
+
+    for output in ('indices', 'flat', 'count'):
+        result = neval(expression, dict(ns), {}, output=output, **kwargs)
+        if output == 'count':
+            assert result == np.count_nonzero(mask)
+        elif output == 'flat':
+            assert np.array_equal(result, np.flatnonzero(mask))
+        else:
+            assert len(result) == mask.ndim
+            for index, expected in zip(result, mask.nonzero()):
+                assert np.array_equal(index, expected)
+
+
+def test_output():
+
+    from napi.transformers import CompiledTransformer
+
+    a = np.arange(24000).reshape(40, 600) % 7
+    b = a % 2 == 0
+    ns = {'a': a, 'b': b}
+    for expression in ['a > 3 and b', 'a < 2 or b and a > 4', '1 <= a < 4',
+                       'a != 3', 'b', 'a > 9 and b', 'a > 5 or True']:
+        mask = neval(expression, dict(ns), transformer=NapiTransformer)
+        for kwargs in [{}, {'sc': 0}, {'sc': 1000}, {'chunk': 1000},
+                       {'threads': 4, 'grain': 1000}, {'defer': True},
+                       {'packed': True}, {'transformer': NapiTransformer},
+                       {'transformer': LazyTransformer, 'sc': 1000}]:
+            yield check_output, expression, ns, mask, kwargs
+
+
+def test_output_runtime():
+
+    from napi.transformers import napi_and, napi_or, napi_compare
+
+    a = np.arange(20)
+    assert napi_and([a > 3, a < 8], output='count') == 4
+    assert np.array_equal(napi_or([a < 2, a > 17], output='flat'),
+                          [0, 1, 18, 19])
+    index, = napi_compare(2, ['Lt', 'LtE'], [a, 5], output='indices')
+    assert np.array_equal(index, [3, 4, 5])
+
+
+@raises(ValueError)
+def test_output_invalid():
+
+    neval('a > 0 and a < 3', {'a': np.arange(4)}, output='mask_')
+
+
+def test_reductions():
+
+    from napi import any_of, all_of, count_of, nexec
+    from napi.reductions import reduce_blocks
+
+    calls = []
+
+    def func(a, b):
+        calls.append(len(a))
+        return (a > 0) & (b < a)
+
+    a = np.arange(100000)
+    b = np.zeros(100000)
+    assert reduce_blocks('any', func, (a, b)) and calls == [1024]
+    assert not reduce_blocks('all', func, (a, b))
+    assert reduce_blocks('count', func, (a, b)) == 99999
+
+    ns = {'a': a, 'b': b}
+    assert any_of('a > 0 and b < a', {}, ns)
+    assert not any_of('a < 0 or b > 0', {}, ns)
+    assert all_of('a >= 0 and b < 1', {}, ns)
+    assert not all_of('a < 99999', {}, ns)
+    assert count_of('a % 3 == 0 or a < 10', {}, ns) == 33340
+    assert count_of('a[::2] > 10', {}, ns) == 49994
+
+    x = a.reshape(100, 1000)
+    assert count_of('x > 10 and x < 20', {}, {'x': x}) == 9
+
+    for seq in (list(a), tuple(a)):
+        calls = []
+        assert not reduce_blocks('any', func, (a, seq)) and calls == [100000]
+        ns = {'a': a, 'b': seq}
+        assert count_of('a > 10 and b < a', {}, ns) == 0
+        assert all_of('a == b', {}, ns)
+        nexec('r = any(a > 0 and b < a)', ns, ns)
+        assert ns['r'] is False
+    ns = {'a': a, 'b': b}
+    assert not all_of('x.T > 0', {}, {'x': x})
+
+    nexec('r = any(a > 0 and b < a), all(a > 10 and b < 1), any(a < 0)',
+          ns, ns)
+    assert ns['r'] == (True, False, False)
+
+
+def test_reductions_names():
+
+    from napi.transformers import CompiledTransformer
+
+    a = np.arange(10)
+    ns = {'a': a, 'b': a > 5, 'x': 3, 'any': lambda value: 'mine',
+          'all': np.all}
+    for transformer in TRANSFORMERS + [CompiledTransformer]:
+        assert neval('any(a > 0 and b)', ns,
+                     transformer=transformer) == 'mine'
+        assert not neval('all(a > 0 and b)', ns, transformer=transformer)
+    for transformer in TRANSFORMERS + [CompiledTransformer]:
+        try:
+            neval('any(x > 0)', {'x': 3}, transformer=transformer)
+        except TypeError:
+            pass
+        else:
+            assert False, 'any of a scalar did not raise TypeError'
+
+
+def test_sorted_index():
+
+    from napi.indexes import register_sorted, unregister, lookup
+    from napi.transformers import CompiledTransformer
+
+    t = np.sort(np.random.RandomState(0).rand(20000) * 100)
+    t[-3:] = np.nan
+    u = np.random.RandomState(1).rand(20000) * 100
+    x = np.arange(20000) % 3 == 0
+    ns = {'t': t, 'u': u, 'x': x}
+    expressions = ['10 <= t < 20', '20 > t >= 10', '10 < t <= 20 and x',
+                   't == t[5]', 't != t[5]', 't < 10', '10 > t', 't >= 90',
+                   '30 <= u < 40', 'u > 95 or x']
+    masks = [neval(expression, ns, transformer=NapiTransformer)
+             for expression in expressions]
+    register_sorted(t, check=True)
+    register_sorted(u, order=True)
+    try:
+        assert not t.flags.writeable and lookup(t) is not None
+        for transformer in (NapiTransformer, LazyTransformer,
+                            CompiledTransformer):
+            for expression, mask in zip(expressions, masks):
+                result = neval(expression, ns, transformer=transformer,
+                               index=True)
+                assert np.array_equal(result, mask)
+                result = neval(expression, ns, transformer=transformer,
+                               index=True, output='flat')
+                assert np.array_equal(result, np.flatnonzero(mask))
+        assert neval('t < 200', ns, index=True, output='count') == 19997
+    finally:
+        unregister(t)
+        unregister(u)
+    assert t.flags.writeable and lookup(t) is None
+
+
+def test_index_views():
+
+    from napi.indexes import register_sorted, register_bitmap, lookup
+    from napi.indexes import unregister
+
+    b = np.arange(10)
+    v = b[:]
+    for register in (register_sorted, register_bitmap):
+        try:
+            register(v)
+        except ValueError:
+            pass
+        else:
+            assert False, 'view of a writeable array was registered'
+    assert v.flags.writeable and lookup(v) is None
+    b.flags.writeable = False
+    register_sorted(v)
+    try:
+        assert lookup(v) is not None
+        b.flags.writeable = True
+        b[:] = b[::-1]
+        assert lookup(v) is None
+        assert neval('v < 3', {'v': v}, index=True).sum() == 3
+        assert neval('v < 3', {'v': v}, index=True)[-1]
+    finally:
+        unregister(v)
+
+
+@raises(ValueError)
+def test_sorted_index_check():
+
+    from napi.indexes import register_sorted
+
+    register_sorted(np.arange(10)[::-1], check=True)
+
+
+def test_bitmap_index():
+
+    from napi.indexes import register_bitmap, unregister, lookup
+    from napi.masks import PackedMask
+    from napi.transformers import CompiledTransformer
+
+    c = np.random.RandomState(0).randint(0, 7, 20001).astype(float)
+    c[::97] = np.nan
+    s = np.random.RandomState(1).randint(0, 3, (101, 99)).astype(np.int8)
+    x = np.arange(20001) % 3 == 0
+    ns = {'c': c, 's': s, 'x': x}
+    expressions = ['c == 3', 'c != 3', '3.5 == c', 'c == 3 or c == 5',
+                   'c != 2 and x', '2 <= c < 5', 'c > 4', 'c == 9 or x',
+                   's == 1', 's != 2 and s > 0']
+    masks = [neval(expression, ns, transformer=NapiTransformer)
+             for expression in expressions]
+    register_bitmap(c)
+    register_bitmap(s)
+    try:
+        assert not c.flags.writeable
+        assert list(lookup(c).positions({3, 5, 9, np.nan})) == [3, 5]
+        for transformer in (NapiTransformer, LazyTransformer,
+                            CompiledTransformer):
+            for expression, mask in zip(expressions, masks):
+                result = neval(expression, ns, transformer=transformer,
+                               index=True)
+                assert isinstance(result, np.ndarray)
+                assert np.array_equal(result, mask)
+                result = neval(expression, ns, transformer=transformer,
+                               index=True, packed=True)
+                assert np.array_equal(np.asarray(result), mask)
+                for output in ('flat', 'count'):
+                    result = neval(expression, ns, transformer=transformer,
+                                   index=True, output=output)
+                    assert np.array_equal(result, np.flatnonzero(mask)
+                                          if output == 'flat' else
+                                          mask.sum())
+        assert isinstance(neval('c == 3 or c == 4', ns, index=True,
+                                packed=True), PackedMask)
+    finally:
+        unregister(c)
+        unregister(s)
+    assert c.flags.writeable and lookup(c) is None
+
+
+@raises(ValueError)
+def test_bitmap_index_values():
+
+    from napi.indexes import register_bitmap
+
+    register_bitmap(np.arange(1000), maxvalues=100)
+
+
+def check_membership(expression, mask, ns, transformer, kwargs):
+
+    result = neval(expression, ns, transformer=transformer, **kwargs)
+    assert np.array_equal(result, mask)
+    result = neval(expression, ns, transformer=transformer, output='count',
+                   **kwargs)
+    assert result == mask.sum()
+
+
+def test_membership():
+
+    from napi.transformers import CompiledTransformer
+    from napi.indexes import register_bitmap, unregister
+    from napi.membership import STRATEGIES, isin
+
+    rs = np.random.RandomState(0)
+    x = rs.randint(0, 1000, 5000)
+    y = rs.rand(5000)
+    c = x % 6
+    ns = {'x': x, 'y': y, 'c': c, 'few': {1, 3, 5},
+          'arr': np.arange(0, 1000, 7), 'many': list(range(0, 1000, 3)),
+          'f': y[::10].copy()}
+    masks = {'x in few': np.isin(x, [1, 3, 5]),
+             'x not in many': ~np.isin(x, ns['many']),
+             'y > 0.5 and x in arr': (y > .5) & np.isin(x, ns['arr']),
+             'x in arr or y < 0.1': np.isin(x, ns['arr']) | (y < .1),
+             'y in f': np.isin(y, ns['f']),
+             'c in (1, 4) and y > 0.3': np.isin(c, [1, 4]) & (y > .3)}
+    for transformer, kwargs in [(NapiTransformer, {}),
+                                (LazyTransformer, {}),
+                                (LazyTransformer, {'defer': True}),
+                                (CompiledTransformer, {}),
+                                (CompiledTransformer, {'sc': 10})]:
+        for expression, mask in masks.items():
+            yield (check_membership, expression, mask, ns, transformer,
+                   kwargs)
+    for expression, mask in masks.items():
+        assert np.array_equal(neval(expression, ns, pushdown=True), mask)
+    assert neval("3 in few and 'a' not in many", ns) is True
+    for strategy in STRATEGIES:
+        assert np.array_equal(isin(np.arange(3), {1, 'a'}, strategy=strategy),
+                              [False, True, False])
+    mixed = {'x': np.arange(3), 's': {1, 'a'}}
+    for transformer in TRANSFORMERS:
+        assert np.array_equal(neval('x in s', mixed, transformer=transformer),
+                              [False, True, False])
+    register_bitmap(c)
+    try:
+        for expression, mask in masks.items():
+            yield (check_membership, expression, mask, ns,
+                   CompiledTransformer, {'index': True})
+    finally:
+        unregister(c)
+
+
+def test_membership_scalars():
+
+    from napi import nexec
+    from napi.transformers import CompiledTransformer, napi_compare
+
+    for trans in [LazyTransformer, CompiledTransformer]:
+        tree = trans().visit(ast.parse('found = key in table'))
+        assert 'napi_compare' not in ast.dump(tree)
+        tree = trans().visit(ast.parse('found = key in table and a'))
+        assert 'napi_compare' in ast.dump(tree)
+        tree = trans().visit(ast.parse('any(a in b)', mode='eval'))
+        assert 'napi_compare' in ast.dump(tree)
+
+    ns = {'key': 'b', 'table': {'a': 1, 'b': 2}}
+    for trans in TRANSFORMERS:
+        nexec("found = key in table\nmissing = 'z' not in 'abc'", ns, ns,
+              transformer=trans)
+        assert ns['found'] is True and ns['missing'] is True
+    assert napi_compare('b', ['In'], ['abc']) is True
+    assert napi_compare('b', ['NotIn'], [lambda: 'abc'], defer=True) is False
+    assert napi_compare(np.int64(3), ['In'], [{3}]) is True
+    assert np.array_equal(neval('x in table', {'x': np.arange(3),
+                                               'table': {1, 2}}),
+                          [False, True, True])
+
+
+def test_membership_strategies():
+
+    from napi.membership import isin, choose_membership, values_of
+
+    rs = np.random.RandomState(1)
+    for dtype in (np.int8, np.uint16, np.int64, np.float64):
+        array = rs.randint(0, 120, 1000).astype(dtype)
+        array[:2] = np.iinfo(dtype).min if dtype != np.float64 else np.nan
+        for values in ([3, 7], list(range(0, 120, 5)), [-5, 3, 127],
+                       np.arange(100, 130), []):
+            mask = np.isin(array, values)
+            for strategy in ('equal', 'hash', 'sorted', None):
+                assert np.array_equal(isin(array, values, False, strategy),
+                                      mask)
+            assert np.array_equal(isin(array, values, True), ~mask)
+    names = np.array(['a', 'b', 'c', 'a'], object)
+    assert isin(names, list('abxyz'), strategy='hash').tolist() == [
+        True, True, False, True]
+    assert choose_membership(np.arange(10 ** 6),
+                             values_of({1, 2})) == 'equal'
+    assert choose_membership(np.arange(10 ** 6),
+                             values_of(range(1000))) == 'hash'
+    assert choose_membership(np.random.rand(10 ** 6),
+                             values_of(np.random.rand(1000))) == 'sorted'
+
+
+def test_nexec_globals():
+
+    from napi import nexec
+    from napi.transformers import CompiledTransformer
+
+    for trans in [LazyTransformer, CompiledTransformer]:
+        ns = {'a': np.arange(10), 'counter': 0, 'x': 1}
+        nexec('def count():\n    global counter\n    counter += 1\n'
+              '    return a > counter and a < 5', ns, ns, transformer=trans)
+        assert all(ns['count']() == (ns['a'] > 1) & (ns['a'] < 5))
+        assert ns['counter'] == 1, trans
+        ns['a'] = np.arange(20)
+        assert len(ns['count']()) == 20 and ns['counter'] == 2, trans
+        nexec('del x', ns, ns, transformer=trans)
+        assert 'x' not in ns, trans
+
+
+def test_private_globals():
+
+    from napi import nexec, vectorize_logic
+
+    a = np.arange(10)
+    mask = (a > 2) & (a < 5)
+    ns = {'a': a}
+    names = lambda: sorted(name for name in ns if name != '__builtins__')
+    for kwargs in ({}, {'pushdown': True}, {'explain': 'run'},
+                   {'transformer': LazyTransformer, 'defer': True}):
+        neval('a > 2 and a < 5', ns, **kwargs)
+        assert names() == ['a'], kwargs
+
+    local = {}
+    nexec('b = a > 2 and a < 5', ns, local)
+    assert names() == ['a'] and all(local['b'] == mask)
+    nexec('def f(x):\n    return x > 2 and x < 5', ns, local)
+    assert names() == ['a'] and all(local['f'](a) == mask)
+    assert local['f'].__globals__ is ns
+    nexec('global c\nc = a > 2 and a < 5', ns)
+    assert names() == ['a', 'c'] and all(ns['c'] == mask)
+
+    @vectorize_logic(prefix='_private_', defer=True)
+    def between(x):
+        return x > 2 and x < 5
+
+    assert all(between(a) == mask)
+    assert '_private_napi_and' not in globals()
+
+
 '''
 
 
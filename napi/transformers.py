@@ -26,6 +26,18 @@ napi ASTs has the following options:
          In [2]: ones(4, bool) or zeros((1,4,1), bool)
 
 
+   broadcasting
+      when shapes of arrays in a logical operation do not match,
+      broadcasting evaluates the operation over the shape that arrays
+      broadcast to, using views of arrays rather than expanded copies:
+
+      .. ipython::
+
+         In [1]: %napi broadcast
+
+         In [2]: ones((4,1), bool) and ones((1,3), bool)
+
+
    short-circuiting
       *napi* ASTs perform short-circuit evaluation in the same way Python
       boolean operators does. This is performed when the number of elements
@@ -67,31 +79,72 @@ napi ASTs has the following options:
          perform worse, but since the cost of operation is negligible
          such performance loss will usually be acceptable.
 
+      When threshold is ``'auto'``, density of operands is sampled and
+      short-circuiting is used only when it is estimated to be faster than
+      dense or block-wise evaluation, see :mod:`napi.adaptive`.
+
 
 .. _truth: http://docs.python.org/library/stdtypes.html#truth-value-testing
 
 """
 
 import ast
+import sys
+import types
 import operator
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 from ast import fix_missing_locations as fml
 from ast import copy_location, parse
 from _ast import Name, Expression, Num, Str, keyword
-from _ast import And, Or, Not, Eq, NotEq, Lt, LtE, Gt, GtE
+from _ast import And, Or, Not, Eq, NotEq, Lt, LtE, Gt, GtE, In, NotIn
 from _ast import BoolOp, Compare, Subscript, Load, Index, Call, List
-from _ast import Dict
+from _ast import Dict, UnaryOp, Attribute, Tuple
 
 from numbers import Number
 
+try:
+    basestring
+except NameError:
+    basestring = str
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
 import numpy
 from numpy import ndarray
 
+from .kernels import CHUNK, GRAIN, FUSE, chunked_and, chunked_or
+from .kernels import chunked_compare, chunked_range, range_bounds, collect
+from .kernels import and_blocks, or_blocks, compare_blocks, range_blocks
+from .masks import PackedMask, packed_and, packed_or
+from .adaptive import AUTO, choose_strategy
+from .reorder import reorder_operands, iter_reordered
+from .cse import eliminate, is_pure
+from .reductions import block_names, reduce_blocks
+from .indexes import indexed_compare
+from .membership import member, nonmember
+from . import instrument
+
 _setdefault = {}.setdefault
 ZERO = lambda dtype: _setdefault(dtype, numpy.zeros(1, dtype)[0])
 
-__all__ = ['NapiTransformer', 'LazyTransformer',
-           'napi_compare', 'napi_and', 'napi_or']
+__all__ = ['NapiTransformer', 'LazyTransformer', 'CompiledTransformer',
+           'napi_compare', 'napi_and', 'napi_or', 'napi_not', 'napi_any',
+           'napi_all', 'survivors', 'bind', 'unbind']
+
+RUNTIME = ('napi_compare', 'napi_and', 'napi_or', 'napi_not', 'napi_any',
+           'napi_all')
+
+BOUND = '<napi runtime>'
+
+OUTPUTS = ('mask', 'indices', 'flat', 'count')
 
 
 def ast_name(id, ctx=Load()):
@@ -122,14 +175,20 @@ COMPARE = {
     LtE: operator.le,
     Gt: operator.gt,
     GtE: operator.ge,
+    In: member,
+    NotIn: nonmember,
     'Eq': operator.eq,
     'NotEq': operator.ne,
     'Lt': operator.lt,
     'LtE': operator.le,
     'Gt': operator.gt,
     'GtE': operator.ge,
+    'In': member,
+    'NotIn': nonmember,
 }
 
+MEMBERSHIP = (In, NotIn, 'In', 'NotIn')
+
 ATTRMAP = {
     Num: 'n',
     Str: 's',
@@ -141,22 +200,321 @@ EVALSET = {List: '',
 
 RESERVED = {'True': True, 'False': False, 'None': None}
 
+ARRAYS = (ndarray, PackedMask)
 
-def napi_compare(left, ops, comparators, **kwargs):
-    """Make pairwise comparisons of comparators."""
 
-    values = []
-    for op, right in zip(ops, comparators):
-        value = COMPARE[op](left, right)
-        values.append(value)
-        left = right
-    result = napi_and(values, **kwargs)
-    if isinstance(result, ndarray):
+def ast_thunk(node):
+    """Return a :class:`ast.Lambda` node that takes no arguments and
+    returns the value of *node* when called."""
+
+    thunk = parse('lambda: None', '<string>', 'eval').body
+    thunk.body = node
+    return copy_location(thunk, node)
+
+
+def napi_compare(left, ops, comparators, **kwargs):
+    """Make pairwise comparisons of comparators.
+
+    When *defer* is true, *comparators* are expected to be callables that
+    return the values to be compared.  They are called in order, only
+    until the outcome is decided, see :func:`.deferred_and`.
+
+    Range tests of large arrays, and comparisons when *chunk* or *threads*
+    is given and operand arrays have the same shape, are made in blocks
+    without intermediate arrays, see :func:`.fused_compare`.
+
+    When *output* is ``'indices'``, ``'flat'``, or ``'count'``, survivors
+    are returned instead of a mask, see :func:`.napi_and`.
+
+    Membership tests, ``'In'`` and ``'NotIn'``, are element-wise when the
+    left operand is an array, see :mod:`napi.membership`.  Otherwise, a
+    single membership test is made as in Python.
+
+    Range tests and comparisons with a scalar of arrays that have an index
+    are answered using the index, see :mod:`napi.indexes`.  When *packed*
+    or *index* is true, masks obtained using a bitmap index are returned as
+    :class:`.PackedMask` instances."""
+
+    output = _output(kwargs)
+    if (len(ops) == 1 and ops[0] in MEMBERSHIP and not output and
+            not (isinstance(left, ndarray) and left.shape)):
+        right = comparators[0]
+        if kwargs.get('defer', False):
+            right = right()
+        return COMPARE[ops[0]](left, right)
+    if not kwargs.get('defer', False):
+        result = indexed_compare(left, ops, comparators, output,
+                                 kwargs.get('packed', False) or
+                                 kwargs.get('index', False))
+        if result is not None:
+            _record('indexed', (), result)
+            return result
+    if kwargs.get('defer', False):
+        values = iter_compare(left, ops, comparators)
+        result = _record('deferred', (), deferred_and(values, **kwargs))
+        if output:
+            return survivors(result, output)
+    else:
+        blocks = not any(op in MEMBERSHIP for op in ops)
+        if output and blocks:
+            result = output_compare(left, ops, comparators, kwargs, output)
+            if result is not None:
+                return result
+        if blocks:
+            result = fused_compare(left, ops, comparators, kwargs)
+            if result is not None:
+                return result
+        values = []
+        for op, right in zip(ops, comparators):
+            value = COMPARE[op](left, right)
+            values.append(value)
+            left = right
+        if len(values) == 1 and not output:
+            return values[0]
+        result = napi_and(values, **kwargs)
+        if output and any(isinstance(value, ARRAYS) and value.shape
+                          for value in values):
+            return result
+    if isinstance(result, ARRAYS):
         return result
     else:
         return bool(result)
 
 
+def fused_compare(left, ops, comparators, kwargs):
+    """Return outcome of chained comparison evaluated block by block, or
+    **None** if the comparison is not suitable for it.
+
+    Range tests with scalar bounds, e.g. ``lo <= a < hi``, are evaluated in
+    a single pass by :func:`.chunked_range` when the array has more than
+    :data:`.FUSE` elements, or *chunk* or *threads* is given, unless *fuse*
+    is false.  Other comparisons of
+    same shape arrays are evaluated by :func:`.chunked_compare` when *chunk*
+    or *threads* is given."""
+
+    bounds = None
+    if kwargs.get('fuse', True):
+        bounds = range_bounds(left, ops, comparators)
+    if bounds is not None:
+        shape = bounds[2].shape
+        options = blockwise(shape, kwargs)
+        if options is None and bounds[2].size > FUSE:
+            options = {}
+        if options is not None:
+            result = chunked_range(*bounds, **options)
+        else:
+            return None
+        arrays = [bounds[2]]
+    else:
+        shapes = set(value.shape for value in [left] + list(comparators)
+                     if isinstance(value, ndarray) and value.shape)
+        if len(shapes) != 1:
+            return None
+        shape = shapes.pop()
+        options = blockwise(shape, kwargs)
+        if options is None:
+            return None
+        result = chunked_compare(left, ops, comparators, shape, **options)
+        arrays = [value for value in [left] + list(comparators)
+                  if isinstance(value, ndarray) and value.shape]
+    _record('fused', arrays, result)
+    if kwargs.get('packed', False):
+        return PackedMask.from_bool(result)
+    return result
+
+
+def broadcast_shape(shapes):
+    """Return the shape that arrays with *shapes* broadcast to.  If shapes
+    are not compatible, raise :exc:`ValueError`."""
+
+    ndim = max(len(shape) for shape in shapes)
+    result = [1] * ndim
+    for shape in shapes:
+        for i, n in enumerate(shape, ndim - len(shape)):
+            if n != 1:
+                if result[i] not in (1, n):
+                    raise ValueError('array shape mismatch, cannot broadcast')
+                result[i] = n
+    return tuple(result)
+
+
+def broadcast(arrays, shapes, kwargs):
+    """Replace *arrays* with read-only views that have the shape they
+    broadcast to, when *bc* option is true and *shapes* do not match.
+    Views are made using zero strides, so arrays are not expanded in memory.
+    Return **True** if arrays were broadcast."""
+
+    if len(shapes) < 2 or not kwargs.get('bc', kwargs.get('broadcast', False)):
+        return False
+    shape = broadcast_shape(shapes)
+    for i, a in enumerate(arrays):
+        if a.shape != shape:
+            arrays[i] = numpy.broadcast_to(numpy.asarray(a), shape)
+    shapes.clear()
+    shapes.add(shape)
+    return True
+
+
+def reduce_arrays(ufunc, arrays):
+    """Return outcome of applying *ufunc* to *arrays* successively, without
+    stacking them."""
+
+    result = ufunc(arrays[0], arrays[1])
+    for array in arrays[2:]:
+        ufunc(result, array, out=result)
+    return result
+
+
+def _packed(arrays, kwargs):
+    """Return **True** if outcome should be a :class:`.PackedMask`."""
+
+    return (kwargs.get('packed', False) or
+            any(isinstance(a, PackedMask) for a in arrays))
+
+
+def blockwise(shape, kwargs):
+    """Return options for block-wise evaluation of arrays with *shape*, if
+    *kwargs* ask for block-wise or multithreaded evaluation and there are
+    enough elements.  Otherwise, return **None**."""
+
+    chunk = kwargs.get('chunk', 0)
+    threads = kwargs.get('threads', 0)
+    if not chunk and threads <= 1:
+        return None
+    size = numpy.prod(shape)
+    grain = kwargs.get('grain', GRAIN)
+    if threads > 1 and size >= 2 * grain or chunk and size > chunk:
+        return {'chunk': chunk or CHUNK, 'threads': threads, 'grain': grain}
+
+
+def _output(kwargs):
+    """Return *output* option, or **None** when a mask is requested."""
+
+    output = kwargs.get('output')
+    if output is None or output == 'mask':
+        return None
+    if output not in OUTPUTS:
+        raise ValueError('output must be one of {}'.format(
+            ', '.join(repr(item) for item in OUTPUTS)))
+    return output
+
+
+def _format(flat, shape, output):
+    """Return *flat* indices of survivors of an array with *shape* in
+    *output* form."""
+
+    if output == 'count':
+        return len(flat)
+    if output == 'flat':
+        return flat
+    return numpy.unravel_index(flat, shape)
+
+
+def survivors(mask, output='indices'):
+    """Return indices of **True** elements of *mask*, per axis like
+    :func:`numpy.nonzero` when *output* is ``'indices'``, or into the
+    flattened mask when *output* is ``'flat'``, or their number when
+    *output* is ``'count'``.  Objects other than arrays are returned as they
+    are."""
+
+    if isinstance(mask, PackedMask):
+        if output == 'count':
+            return mask.count()
+        return _format(mask.flatnonzero(), mask.shape, output)
+    if not isinstance(mask, ndarray) or not mask.shape:
+        return mask
+    if output == 'count':
+        return int(numpy.count_nonzero(mask))
+    if output == 'flat':
+        return numpy.flatnonzero(mask)
+    return mask.nonzero()
+
+
+def _decided(value, shape, output):
+    """Return survivors of an operation whose elements are all *value*."""
+
+    size = int(numpy.prod(shape))
+    if output == 'count':
+        return size if value else 0
+    flat = numpy.arange(size if value else 0)
+    return _format(flat, shape, output)
+
+
+def _collected(kernel, args, arrays, shape, output, kwargs):
+    """Return survivors of *kernel* applied in blocks, see
+    :func:`.collect`."""
+
+    options = blockwise(shape, kwargs) or {}
+    flat = collect(kernel, args, int(numpy.prod(shape)), output == 'count',
+                   **options)
+    if instrument.enabled:
+        count = flat if output == 'count' else len(flat)
+        instrument.record('collected', sum(a.size for a in arrays), count,
+                          getattr(flat, 'nbytes', 0))
+    if output == 'count':
+        return flat
+    return _format(flat, shape, output)
+
+
+def output_and(arrays, shape, kwargs, output, node=None):
+    """Return survivors of logical *and* of *arrays* in *output* form.
+    When short-circuiting, surviving indices are returned as they are
+    found, otherwise blocks are evaluated and survivors are gathered in a
+    single pass, without allocating the outcome mask."""
+
+    if _packed(arrays, kwargs):
+        return survivors(_record('packed', arrays, packed_and(arrays, shape)),
+                         output)
+    sc = kwargs.get('sc', kwargs.get('shortcircuit', 0))
+    if sc == AUTO:
+        shortcircuit = choose_strategy(arrays, True) == 'shortcircuit'
+    else:
+        shortcircuit = (sc and numpy.prod(shape) >= sc and
+                        not blockwise(shape, kwargs))
+    if shortcircuit:
+        return short_circuit_and(*_reorder(arrays, shape, True, kwargs, node),
+                                 output=output)
+    return _collected(and_blocks, (arrays,), arrays, shape, output, kwargs)
+
+
+def output_or(arrays, shape, kwargs, output, node=None):
+    """Return survivors of logical *or* of *arrays* in *output* form.
+    Short-circuiting finds elements that are **False**, so it is used only
+    for counting survivors."""
+
+    if _packed(arrays, kwargs):
+        return survivors(_record('packed', arrays, packed_or(arrays, shape)),
+                         output)
+    sc = kwargs.get('sc', kwargs.get('shortcircuit', 0))
+    if output == 'count':
+        if sc == AUTO:
+            shortcircuit = choose_strategy(arrays, False) == 'shortcircuit'
+        else:
+            shortcircuit = (sc and numpy.prod(shape) >= sc and
+                            not blockwise(shape, kwargs))
+        if shortcircuit:
+            return short_circuit_or(*_reorder(arrays, shape, False, kwargs,
+                                              node), output=output)
+    return _collected(or_blocks, (arrays,), arrays, shape, output, kwargs)
+
+
+def output_compare(left, ops, comparators, kwargs, output):
+    """Return survivors of chained comparison in *output* form, evaluated
+    in blocks, or **None** if operand arrays do not have the same shape."""
+
+    bounds = range_bounds(left, ops, comparators)
+    if bounds is not None:
+        return _collected(range_blocks, bounds, [bounds[2]], bounds[2].shape,
+                          output, kwargs)
+    arrays = [value for value in [left] + list(comparators)
+              if isinstance(value, ndarray) and value.shape]
+    shapes = set(array.shape for array in arrays)
+    if len(shapes) != 1:
+        return None
+    return _collected(compare_blocks, (left, ops, comparators), arrays,
+                      shapes.pop(), output, kwargs)
+
+
 def napi_and(values, **kwargs):
     """Perform element-wise logical *and* operation on arrays.
 
@@ -165,21 +523,48 @@ def napi_and(values, **kwargs):
     being evaluated. Non-array objects with truth value **True** are omitted.
 
     If array shapes do not match (after squeezing when enabled by user),
-    :exc:`ValueError` is raised.
+    :exc:`ValueError` is raised.  When *bc* (or *broadcast*) option is true,
+    arrays are broadcast to a common shape instead, see :func:`.broadcast`.
+
+    When *defer* is true, items of *values* after the first one are expected
+    to be callables that return operands, see :func:`.deferred_and`.  When
+    *pure* is also given, all items are callables that are called in an
+    order learned for expression *key*, see :func:`.iter_reordered`.
+
+    When *chunk* or *threads* is given, the operation is performed in
+    blocks, see :func:`.chunked_and`.
+
+    When *output* is ``'indices'``, a tuple of indices of **True** elements
+    per axis is returned, like :func:`numpy.nonzero` does, and when it is
+    ``'flat'``, indices into the flattened outcome are returned.  When
+    *output* is ``'count'``, the number of **True** elements is returned.
+    Survivors are gathered while arrays are evaluated, without allocating
+    the outcome mask, see :func:`.output_and`.
 
     This function uses :obj:`numpy.logical_and` or :obj:`numpy.all`."""
 
+    output = _output(kwargs)
+    if kwargs.get('defer', False):
+        if kwargs.get('pure') is None:
+            values = iter_deferred(values)
+        else:
+            values = iter_reordered(values, kwargs['pure'], True,
+                                    kwargs.get('key'))
+        result = _record('deferred', (), deferred_and(values, **kwargs))
+        return survivors(result, output) if output else result
+
     arrays = []
     result = None
     shapes = set()
 
     for value in values:
-        if isinstance(value, ndarray) and value.shape:
+        if isinstance(value, ARRAYS) and value.shape:
             arrays.append(value)
             shapes.add(value.shape)
         elif not value:
             result = value
 
+    bc = broadcast(arrays, shapes, kwargs)
     if len(shapes) > 1 and kwargs.get('sq', kwargs.get('squeeze', False)):
         shapes.clear()
         for i, a in enumerate(arrays):
@@ -187,45 +572,122 @@ def napi_and(values, **kwargs):
             shapes.add(a.shape)
         if len(shapes) > 1:
             raise ValueError('array shape mismatch, even after squeezing')
+        _record('squeezed', arrays)
 
     if len(shapes) > 1:
         raise ValueError('array shape mismatch')
 
     shape = shapes.pop() if shapes else None
+    packed = _packed(arrays, kwargs)
 
     if result is not None:
         if shape:
-            return numpy.zeros(shape, bool)
+            if output:
+                return _decided(False, shape, output)
+            if packed:
+                return _record('decided', (), PackedMask.zeros(shape))
+            return _record('decided', (), numpy.zeros(shape, bool))
         else:
             return result
     elif arrays:
+        if output:
+            return output_and(arrays, shape, kwargs, output)
         sc = kwargs.get('sc', kwargs.get('shortcircuit', 0))
-        if sc and numpy.prod(shape) >= sc:
-            return short_circuit_and(arrays, shape)
+        options = blockwise(shape, kwargs)
+        if packed:
+            return _record('packed', arrays, packed_and(arrays, shape))
+        elif options:
+            return _record('chunked', arrays,
+                           chunked_and(arrays, shape, **options))
+        elif sc == AUTO:
+            return adaptive_and(arrays, shape, kwargs)
+        elif sc and numpy.prod(shape) >= sc:
+            return short_circuit_and(*_reorder(arrays, shape, True, kwargs))
         elif len(arrays) == 2:
-            return numpy.logical_and(*arrays)
+            return _record('dense', arrays, numpy.logical_and(*arrays))
+        elif bc:
+            return _record('dense', arrays,
+                           reduce_arrays(numpy.logical_and, arrays))
         else:
-            return numpy.all(arrays, 0)
+            return _record('dense', arrays, numpy.all(arrays, 0))
     else:
         return value
 
 
-def short_circuit_and(arrays, shape):
+def _record(strategy, arrays, result=None):
+    """Record an operation on *arrays* that was performed using *strategy*
+    when instrumentation is enabled, see :mod:`napi.instrument`, and return
+    *result*."""
+
+    if instrument.enabled:
+        if isinstance(result, PackedMask):
+            survivors = result.count()
+        elif isinstance(result, ndarray):
+            survivors = numpy.count_nonzero(result)
+        else:
+            survivors = 0
+        instrument.record(strategy, sum(a.size for a in arrays), survivors,
+                          getattr(result, 'nbytes', 0))
+    return result
+
+
+def _nbytes(index):
+    """Return number of bytes of *index* array or tuple of arrays."""
+
+    if isinstance(index, tuple):
+        return sum(i.nbytes for i in index)
+    return index.nbytes
+
+
+def _reorder(arrays, shape, conjunction, kwargs, node=None):
+    """Return *arrays*, *shape*, and a callable for recording counts of
+    undecided elements, with *arrays* reordered when *reorder* option is
+    true, see :func:`.reorder_operands`.  The expression is identified by
+    *key* option or by a dump of *node*."""
+
+    if not kwargs.get('reorder', False) or len(arrays) < 2:
+        return arrays, shape, None
+    key = ast.dump(node) if node is not None else kwargs.get('key')
+    arrays, observe = reorder_operands(arrays, conjunction, key)
+    return arrays, shape, observe
+
+
+def short_circuit_and(arrays, shape, observe=None, output=None):
 
     a = arrays.pop(0)
     nz = (a if a.dtype == bool else a.astype(bool)).nonzero()
+    counts = [len(nz[0])]
     if len(nz) > 1:
         while arrays:
             a = arrays.pop()[nz]
             which = a if a.dtype == bool else a.astype(bool)
             nz = tuple(i[which] for i in nz)
+            counts.append(len(nz[0]))
     else:
         nz = nz[0]
         while arrays:
             a = arrays.pop()[nz]
             nz = nz[a if a.dtype == bool else a.astype(bool)]
+            counts.append(len(nz))
+    if observe is not None:
+        observe(counts)
+    if output:
+        if instrument.enabled:
+            instrument.record('shortcircuit', numpy.prod(shape) +
+                              sum(counts[:-1]), counts[-1], _nbytes(nz),
+                              counts)
+        if output == 'count':
+            return counts[-1]
+        if isinstance(nz, tuple):
+            if output == 'flat':
+                return numpy.ravel_multi_index(nz, shape)
+            return nz
+        return nz if output == 'flat' else (nz,)
     result = numpy.zeros(shape, bool)
     result[nz] = True
+    if instrument.enabled:
+        instrument.record('shortcircuit', result.size + sum(counts[:-1]),
+                          counts[-1], result.nbytes + _nbytes(nz), counts)
     return result
 
 
@@ -237,21 +699,44 @@ def napi_or(values, **kwargs):
     being evaluated. Non-array objects with truth value **False** are omitted.
 
     If array shapes do not match (after squeezing when enabled by user),
-    :exc:`ValueError` is raised.
+    :exc:`ValueError` is raised.  When *bc* (or *broadcast*) option is true,
+    arrays are broadcast to a common shape instead, see :func:`.broadcast`.
+
+    When *defer* is true, items of *values* after the first one are expected
+    to be callables that return operands, see :func:`.deferred_or`.  When
+    *pure* is also given, all items are callables that are called in an
+    order learned for expression *key*, see :func:`.iter_reordered`.
+
+    When *chunk* or *threads* is given, the operation is performed in
+    blocks, see :func:`.chunked_or`.
+
+    *output* option is handled as :func:`.napi_and` does, see
+    :func:`.output_or`.
 
     This function uses :obj:`numpy.logical_or` or :obj:`numpy.any`."""
 
+    output = _output(kwargs)
+    if kwargs.get('defer', False):
+        if kwargs.get('pure') is None:
+            values = iter_deferred(values)
+        else:
+            values = iter_reordered(values, kwargs['pure'], False,
+                                    kwargs.get('key'))
+        result = _record('deferred', (), deferred_or(values, **kwargs))
+        return survivors(result, output) if output else result
+
     arrays = []
     result = None
     shapes = set()
 
     for value in values:
-        if isinstance(value, ndarray) and value.shape:
+        if isinstance(value, ARRAYS) and value.shape:
             arrays.append(value)
             shapes.add(value.shape)
         elif value:
             result = value
 
+    bc = broadcast(arrays, shapes, kwargs)
     if len(shapes) > 1 and kwargs.get('squeeze', kwargs.get('sq', False)):
         shapes.clear()
         for i, a in enumerate(arrays):
@@ -259,72 +744,507 @@ def napi_or(values, **kwargs):
             shapes.add(a.shape)
         if len(shapes) > 1:
             raise ValueError('array shape mismatch, even after squeezing')
+        _record('squeezed', arrays)
 
     if len(shapes) > 1:
         raise ValueError('array shape mismatch')
 
     shape = shapes.pop() if shapes else None
+    packed = _packed(arrays, kwargs)
 
     if result is not None:
         if shape:
-            return numpy.ones(shape, bool)
+            if output:
+                return _decided(True, shape, output)
+            if packed:
+                return _record('decided', (), PackedMask.ones(shape))
+            return _record('decided', (), numpy.ones(shape, bool))
         else:
             return result
     elif arrays:
+        if output:
+            return output_or(arrays, shape, kwargs, output)
         sc = kwargs.get('sc', kwargs.get('shortcircuit', 0))
-        if sc and numpy.prod(shape) >= sc:
-            return short_circuit_or(arrays, shape)
+        options = blockwise(shape, kwargs)
+        if packed:
+            return _record('packed', arrays, packed_or(arrays, shape))
+        elif options:
+            return _record('chunked', arrays,
+                           chunked_or(arrays, shape, **options))
+        elif sc == AUTO:
+            return adaptive_or(arrays, shape, kwargs)
+        elif sc and numpy.prod(shape) >= sc:
+            return short_circuit_or(*_reorder(arrays, shape, False, kwargs))
         elif len(arrays) == 2:
-            return numpy.logical_or(*arrays)
+            return _record('dense', arrays, numpy.logical_or(*arrays))
+        elif bc:
+            return _record('dense', arrays,
+                           reduce_arrays(numpy.logical_or, arrays))
         else:
-            return numpy.any(arrays, 0)
+            return _record('dense', arrays, numpy.any(arrays, 0))
     else:
         return value
 
 
-def short_circuit_or(arrays, shape):
+def short_circuit_or(arrays, shape, observe=None, output=None):
 
     a = arrays.pop(0)
     z = ZERO(a.dtype)
     nz = (a == z).nonzero()
+    counts = [len(nz[0])]
     if len(nz) > 1:
         while arrays:
             a = arrays.pop()
             which = a[nz] == ZERO(a.dtype)
             nz = tuple(i[which] for i in nz)
+            counts.append(len(nz[0]))
     else:
         nz = nz[0]
         while arrays:
             a = arrays.pop()[nz]
             nz = nz[a == ZERO(a.dtype)]
+            counts.append(len(nz))
+    if observe is not None:
+        observe(counts)
+    if output == 'count':
+        size = int(numpy.prod(shape))
+        if instrument.enabled:
+            instrument.record('shortcircuit', size + sum(counts[:-1]),
+                              size - counts[-1], _nbytes(nz), counts)
+        return size - counts[-1]
     result = numpy.ones(shape, bool)
     result[nz] = False
+    if instrument.enabled:
+        instrument.record('shortcircuit', result.size + sum(counts[:-1]),
+                          result.size - counts[-1],
+                          result.nbytes + _nbytes(nz), counts)
     return result
 
 
+def adaptive_and(arrays, shape, kwargs=None, node=None):
+    """Perform logical *and* operation on *arrays* using the strategy with
+    the lowest estimated cost, see :func:`.choose_strategy`."""
+
+    strategy = choose_strategy(arrays, True)
+    if strategy == 'shortcircuit':
+        return short_circuit_and(*_reorder(arrays, shape, True, kwargs or {},
+                                           node))
+    elif strategy == 'chunked':
+        return _record('chunked', arrays, chunked_and(arrays, shape))
+    elif len(arrays) == 1:
+        return _record('dense', arrays, arrays[0].astype(bool))
+    else:
+        return _record('dense', arrays,
+                       reduce_arrays(numpy.logical_and, arrays))
+
+
+def adaptive_or(arrays, shape, kwargs=None, node=None):
+    """Perform logical *or* operation on *arrays* using the strategy with
+    the lowest estimated cost, see :func:`.choose_strategy`."""
+
+    strategy = choose_strategy(arrays, False)
+    if strategy == 'shortcircuit':
+        return short_circuit_or(*_reorder(arrays, shape, False, kwargs or {},
+                                           node))
+    elif strategy == 'chunked':
+        return _record('chunked', arrays, chunked_or(arrays, shape))
+    elif len(arrays) == 1:
+        return _record('dense', arrays, arrays[0].astype(bool))
+    else:
+        return _record('dense', arrays,
+                       reduce_arrays(numpy.logical_or, arrays))
+
+
+def iter_deferred(values):
+    """Yield the first item of *values* and values returned by calling the
+    rest of the items."""
+
+    values = iter(values)
+    for value in values:
+        yield value
+        break
+    for thunk in values:
+        yield thunk()
+
+
+def iter_compare(left, ops, comparators):
+    """Yield pairwise comparisons, calling *comparators* to obtain values
+    to be compared."""
+
+    for op, right in zip(ops, comparators):
+        right = right()
+        yield COMPARE[op](left, right)
+        left = right
+
+
+def _match_shapes(mask, owned, value, kwargs):
+    """Return *mask*, whether it is *owned*, and *value* after making their
+    shapes match."""
+
+    if mask.shape != value.shape:
+        if kwargs.get('bc', kwargs.get('broadcast', False)):
+            shape = broadcast_shape([mask.shape, value.shape])
+            if mask.shape != shape:
+                mask, owned = numpy.broadcast_to(mask, shape), False
+            return mask, owned, value
+        if not kwargs.get('sq', kwargs.get('squeeze', False)):
+            raise ValueError('array shape mismatch')
+        mask, value = mask.squeeze(), value.squeeze()
+        if mask.shape != value.shape:
+            raise ValueError('array shape mismatch, even after squeezing')
+    return mask, owned, value
+
+
+def deferred_and(values, **kwargs):
+    """Perform element-wise logical *and* operation on operands yielded by
+    *values* iterator.  Operands are requested from the iterator only until
+    the outcome is decided, i.e. when elements of all arrays evaluated so far
+    are **False** or when a non-array object with truth_ value **False** is
+    encountered.  In the latter case, the object itself is returned if no
+    arrays were evaluated yet, like Python ``and`` operator does."""
+
+    mask = None
+    owned = False
+    value = None
+    for value in values:
+        if isinstance(value, ndarray) and value.shape:
+            value = value if value.dtype == bool else value.astype(bool)
+            if mask is None:
+                mask = value
+            else:
+                mask, owned, value = _match_shapes(mask, owned, value,
+                                                   kwargs)
+                if owned:
+                    numpy.logical_and(mask, value, out=mask)
+                else:
+                    mask, owned = numpy.logical_and(mask, value), True
+            if not mask.any():
+                break
+        elif not value:
+            if mask is None:
+                return value
+            return numpy.zeros(mask.shape, bool)
+    if mask is None:
+        return value
+    return mask if owned else mask.copy()
+
+
+def deferred_or(values, **kwargs):
+    """Perform element-wise logical *or* operation on operands yielded by
+    *values* iterator.  Operands are requested from the iterator only until
+    the outcome is decided, i.e. when elements of all arrays evaluated so far
+    are **True** or when a non-array object with truth_ value **True** is
+    encountered.  In the latter case, the object itself is returned if no
+    arrays were evaluated yet, like Python ``or`` operator does."""
+
+    mask = None
+    owned = False
+    value = None
+    for value in values:
+        if isinstance(value, ndarray) and value.shape:
+            value = value if value.dtype == bool else value.astype(bool)
+            if mask is None:
+                mask = value
+            else:
+                mask, owned, value = _match_shapes(mask, owned, value,
+                                                   kwargs)
+                if owned:
+                    numpy.logical_or(mask, value, out=mask)
+                else:
+                    mask, owned = numpy.logical_or(mask, value), True
+            if mask.all():
+                break
+        elif value:
+            if mask is None:
+                return value
+            return numpy.ones(mask.shape, bool)
+    if mask is None:
+        return value
+    return mask if owned else mask.copy()
+
+
+def napi_not(value):
+    """Perform element-wise logical *not* operation using
+    :obj:`numpy.logical_not`, or ``~`` operator for :class:`.PackedMask`
+    instances."""
+
+    if isinstance(value, PackedMask):
+        return ~value
+    return numpy.logical_not(value)
+
+
+def _blocked(reduce, kind, args):
+    """Return **True** if *reduce*, the function called in place of
+    :func:`.napi_any` or :func:`.napi_all`, is the builtin or NumPy function
+    for reduction *kind*, and *args* include arrays."""
+
+    return (reduce in (getattr(builtins, kind), getattr(numpy, kind)) and
+            any(isinstance(arg, ndarray) and arg.shape for arg in args))
+
+
+def napi_any(reduce, func, *args, **kwargs):
+    """Return **True** if any element of ``func(*args)`` is true, calling
+    *func* with blocks of arrays in *args* until a block with a true element
+    is found, see :func:`.reduce_blocks`.  *reduce* is the function that the
+    name ``any`` refers to, which is called with ``func(*args)`` instead
+    when it is not :func:`any` or :func:`numpy.any`, or when *args* do not
+    include arrays."""
+
+    if not _blocked(reduce, 'any', args):
+        return reduce(func(*args))
+    return reduce_blocks('any', func, args, kwargs.get('chunk') or CHUNK)
+
+
+def napi_all(reduce, func, *args, **kwargs):
+    """Return **True** if all elements of ``func(*args)`` are true, calling
+    *func* with blocks of arrays in *args* until a block with a false
+    element is found, see :func:`.reduce_blocks`.  *reduce* is handled as
+    by :func:`.napi_any`."""
+
+    if not _blocked(reduce, 'all', args):
+        return reduce(func(*args))
+    return reduce_blocks('all', func, args, kwargs.get('chunk') or CHUNK)
+
+
+def runtime(prefix=''):
+    """Return a dictionary that maps *prefix* added names to functions that
+    are called by code transformed using :class:`.LazyTransformer`."""
+
+    module = globals()
+    return dict((prefix + name, module[name]) for name in RUNTIME)
+
+
+def _with_consts(code, consts):
+    """Return a copy of *code* with *consts* as its constants."""
+
+    if hasattr(code, 'replace'):
+        return code.replace(co_consts=consts)
+    args = [code.co_argcount]
+    if hasattr(code, 'co_kwonlyargcount'):
+        args.append(code.co_kwonlyargcount)
+    args.extend([code.co_nlocals, code.co_stacksize, code.co_flags,
+                 code.co_code, consts, code.co_names, code.co_varnames,
+                 code.co_filename, code.co_name, code.co_firstlineno,
+                 code.co_lnotab, code.co_freevars, code.co_cellvars])
+    return types.CodeType(*args)
+
+
+def _replace(code, old, new):
+    """Return *code* with constant *old* replaced with *new*, also in nested
+    code objects, or *code* itself when it does not contain *old*."""
+
+    consts = []
+    changed = False
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            value = _replace(const, old, new)
+        elif type(const) is type(old) and const == old:
+            value = new
+        else:
+            value = const
+        changed = changed or value is not const
+        consts.append(value)
+    if not changed:
+        return code
+    return _with_consts(code, tuple(consts))
+
+
+def bind(code):
+    """Return *code* compiled from an AST transformed with *bound* option,
+    see :class:`.LazyTransformer`, with runtime functions bound to it as
+    constants, so that it can be evaluated using any namespace without
+    adding names to it.  Bound code objects cannot be marshalled, see
+    :func:`unbind`."""
+
+    return _replace(code, BOUND, sys.modules[__name__])
+
+
+def unbind(code):
+    """Return *code* returned by :func:`bind` with runtime functions
+    replaced with the :data:`BOUND` constant, e.g. for marshalling."""
+
+    return _replace(code, sys.modules[__name__], BOUND)
+
+
 class LazyTransformer(ast.NodeTransformer):
 
     """An :mod:`ast` transformer that replaces chained comparison and logical
-    operation expressions with function calls."""
+    operation expressions with function calls.
+
+    When *defer* option is true, operands after the first one are wrapped in
+    argument-less :keyword:`lambda` expressions, so that they are evaluated
+    only if the outcome of the operation is not yet decided.  Note that names
+    in class bodies are not visible to :keyword:`lambda` expressions.  When
+    *reorder* option is also true, all operands are wrapped, and operands
+    without side effects are evaluated in an order learned from earlier
+    evaluations, see :mod:`napi.reorder`.
+
+    When *cse* option is true, repeated pure subexpressions are computed
+    once, see :mod:`napi.cse`.
+
+    Runtime functions are called by their names with *prefix* added, which
+    need to be defined where the code is evaluated, see :func:`.runtime`.
+    When *bound* option is true, they are called as attributes of the
+    :data:`.BOUND` constant instead, and compiled code is passed to
+    :func:`.bind`, so that it can be evaluated in any namespace.
+
+    When *output* option is given, the outermost operation of an expression
+    returns survivors in *output* form instead of a mask, see
+    :func:`.napi_and`.  This applies to expressions compiled in ``'eval'``
+    mode.
+
+    When *index* option is true, single comparisons are also replaced with
+    calls to :func:`.napi_compare`, so that indexes of arrays are used, and
+    masks obtained using bitmap indexes are combined packed, see
+    :mod:`napi.indexes`.  Membership tests, ``in`` and ``not in``, are
+    replaced when they are operands of logical operations or arguments of
+    :func:`any` and :func:`all`, or make up an expression compiled in
+    ``'eval'`` mode, so that they are element-wise for arrays, see
+    :mod:`napi.membership`.  Others, e.g. ``key in mapping`` in a
+    statement, are left as they are.
+
+    Calls of :func:`any` and :func:`all` whose argument is a logical
+    operation or a comparison are replaced with calls to :func:`.napi_any`
+    and :func:`.napi_all`, that evaluate the argument block by block and
+    stop at the first decisive block, when the names refer to the builtin
+    or NumPy functions, see :mod:`napi.reductions`."""
 
 
     def __init__(self, **kwargs):
 
         self._prefix = kwargs.pop('prefix', '')
+        self._bound = kwargs.pop('bound', False)
+        self._cse = kwargs.pop('cse', False)
+        self._index = kwargs.get('index', False)
+        self._output = kwargs.pop('output', None)
+        if self._output == 'mask':
+            self._output = None
+        self._defer = kwargs.get('defer', False)
+        self._reorder = kwargs.get('reorder', False)
         self._kwargs = [keyword(arg=key, value=ast_smart(value))
                         for key, value in kwargs.items()]
+        self._depth = 0
+
+    def visit(self, node):
+
+        if not self._cse or self._defer:
+            return ast.NodeTransformer.visit(self, node)
+        if not self._depth:
+            node = eliminate(node)
+        self._depth += 1
+        try:
+            return ast.NodeTransformer.visit(self, node)
+        finally:
+            self._depth -= 1
+
+    def _runtime(self, name):
+        """Return a node that refers to runtime function *name*, see
+        :func:`.runtime`."""
+
+        if self._bound:
+            return Attribute(value=Str(BOUND), attr=name, ctx=Load())
+        return Name(id=self._prefix + name, ctx=Load())
+
+    def _calls(self, node, names):
+        """Return **True** if *node* is a call of one of runtime functions
+        *names*."""
+
+        if not isinstance(node, Call):
+            return False
+        func = node.func
+        if isinstance(func, Attribute):
+            return (isinstance(func.value, Str) and func.value.s == BOUND and
+                    func.attr in names)
+        return (isinstance(func, Name) and func.id.startswith(self._prefix)
+                and func.id[len(self._prefix):] in names)
+
+    def _thunks(self, nodes):
+
+        if self._defer:
+            return [ast_thunk(node) for node in nodes]
+        return nodes
+
+    def visit_Expression(self, node):
+        """Pass *output* option to the outermost call, replacing single
+        comparisons with calls to :func:`.napi_compare` and wrapping other
+        expressions in calls to :func:`.napi_and`."""
+
+        if not self._output:
+            node.body = self._operand(node.body)
+            return self.generic_visit(node)
+        body = node.body
+        if isinstance(body, Compare) and len(body.ops) == 1:
+            func = self._runtime('napi_compare')
+            body = Call(func=func, args=[body.left, List(elts=[
+                Str(body.ops[0].__class__.__name__)], ctx=Load()),
+                List(elts=self._thunks(body.comparators), ctx=Load())],
+                keywords=self._kwargs)
+            body = self.generic_visit(copy_location(body, node.body))
+        else:
+            body = self.visit(body)
+        if not self._calls(body, RUNTIME[:3]):
+            func = self._runtime('napi_and')
+            body = copy_location(Call(func=func, args=[List(
+                elts=[body], ctx=Load())], keywords=self._kwargs), node.body)
+        body.keywords = body.keywords + [keyword(arg='output',
+                                                 value=Str(self._output))]
+        node.body = fml(body)
+        return node
+
+    def visit_Call(self, node):
+        """Replace ``any(...)`` and ``all(...)`` calls around a logical
+        operation or a comparison with calls to :func:`.napi_any` and
+        :func:`.napi_all` that take the called function, a :keyword:`lambda`
+        expression of the operation, and names it refers to."""
+
+        func = node.func
+        if (isinstance(func, Name) and func.id in ('any', 'all') and
+                len(node.args) == 1 and not node.keywords and
+                isinstance(node.args[0], (BoolOp, Compare))):
+            names = block_names(node.args[0])
+            if names:
+                thunk = parse('lambda {}: None'.format(', '.join(names)),
+                              '<string>', 'eval').body
+                thunk.body = self._operand(node.args[0])
+                call = Call(func=self._runtime('napi_' + func.id),
+                            args=[Name(id=func.id, ctx=Load()), thunk] +
+                                 [Name(id=name, ctx=Load())
+                                  for name in names],
+                            keywords=self._kwargs)
+                node = fml(copy_location(call, node))
+        self.generic_visit(node)
+        return node
+
+    def _compare(self, node):
+        """Return a call to :func:`.napi_compare` that replaces comparison
+        *node*."""
+
+        func = self._runtime('napi_compare')
+        args = [node.left,
+                List(elts=[Str(op.__class__.__name__)
+                           for op in node.ops], ctx=Load()),
+                List(elts=self._thunks(node.comparators), ctx=Load())]
+        return fml(copy_location(Call(func=func, args=args,
+                                      keywords=self._kwargs), node))
+
+    def _operand(self, node):
+        """Return *node*, an operand of a logical operation, replacing a
+        membership test, possibly negated, with a call to
+        :func:`.napi_compare`."""
+
+        if isinstance(node, UnaryOp) and isinstance(node.op, Not):
+            node.operand = self._operand(node.operand)
+        elif (isinstance(node, Compare) and len(node.ops) == 1 and
+                node.ops[0].__class__ in MEMBERSHIP):
+            node = self._compare(node)
+        return node
 
     def visit_Compare(self, node):
         """Replace chained comparisons with calls to :func:`.napi_compare`."""
 
-        if len(node.ops) > 1:
-            func = Name(id=self._prefix + 'napi_compare', ctx=Load())
-            args = [node.left,
-                    List(elts=[Str(op.__class__.__name__)
-                               for op in node.ops], ctx=Load()),
-                    List(elts=node.comparators, ctx=Load())]
-            node = Call(func=func, args=args, keywords=self._kwargs)
-            fml(node)
+        if (len(node.ops) > 1 or
+                (self._index and node.ops[0].__class__ in COMPARE)):
+            node = self._compare(node)
         self.generic_visit(node)
         return node
 
@@ -333,25 +1253,196 @@ class LazyTransformer(ast.NodeTransformer):
         :func:`.napi_or`."""
 
         if isinstance(node.op, And):
-            func = Name(id=self._prefix + 'napi_and', ctx=Load())
+            func = self._runtime('napi_and')
+        else:
+            func = self._runtime('napi_or')
+        keywords = self._kwargs
+        if self._reorder:
+            keywords = keywords + [keyword(arg='key',
+                                           value=Str(ast.dump(node)))]
+        values = [self._operand(value) for value in node.values]
+        if self._defer and self._reorder:
+            pure = Tuple(elts=[Num(n=int(is_pure(value)))
+                               for value in node.values], ctx=Load())
+            keywords = keywords + [keyword(arg='pure', value=pure)]
+            values = self._thunks(values)
         else:
-            func = Name(id=self._prefix + 'napi_or', ctx=Load())
-        args = [List(elts=node.values, ctx=Load())]
-        node = Call(func=func, args=args, keywords=self._kwargs)
+            values = values[:1] + self._thunks(values[1:])
+        args = [List(elts=values, ctx=Load())]
+        node = Call(func=func, args=args, keywords=keywords)
         fml(node)
         self.generic_visit(node)
         return node
 
 
+class CompiledTransformer(LazyTransformer):
+
+    """An :mod:`ast` transformer that replaces chained comparison and logical
+    operation expressions with function calls that behave like
+    :class:`.NapiTransformer`: arrays are always squeezed,
+    :term:`short-circuiting` threshold is 10000 by default, and ``not``
+    operations are replaced with calls to :func:`.napi_not`.
+
+    :class:`.NapiTransformer` evaluates operands of each operation while
+    transforming the AST, compiling and evaluating nested expressions
+    separately.  This transformer makes a single pass over the AST without
+    evaluating it, so that the code is compiled once and can be reused, see
+    :func:`.ncompile`.  :func:`.neval` uses this transformer by default."""
+
+    def __init__(self, **kwargs):
+
+        kwargs['sq'] = True
+        kwargs.setdefault('sc', 10000)
+        LazyTransformer.__init__(self, **kwargs)
+
+    def visit_UnaryOp(self, node):
+        """Replace ``not`` operations with calls to :func:`.napi_not`."""
+
+        if isinstance(node.op, Not):
+            func = self._runtime('napi_not')
+            node = copy_location(Call(func=func, args=[node.operand],
+                                      keywords=[]), node)
+            fml(node)
+        self.generic_visit(node)
+        return node
+
+
+class Frame(object):
+
+    """A private namespace of temporary values of :class:`.NapiTransformer`.
+
+    Temporaries are named ``__temp__N`` and are stored in *values*
+    dictionary, instead of the caller's namespace.  A temporary is released
+    when it is consumed by the operation that refers to it, or when the
+    frame is cleared after the transformed code is evaluated.  *peak* is the
+    largest number of temporaries that were alive at the same time.  *memo*
+    keeps values of pure subexpressions when *cse* option is true.  When
+    *subscript* is given, code refers to temporaries as items of a mapping
+    with that name, e.g. ``_napi_temp_ns['__temp__1']``."""
+
+    def __init__(self, subscript=None):
+
+        self.subscript = subscript
+        self.values = {}
+        self.memo = {}
+        self.count = 0
+        self.peak = 0
+
+    def __contains__(self, name):
+
+        return name in self.values
+
+    def __len__(self):
+
+        return len(self.values)
+
+    def name(self):
+        """Return a new temporary name."""
+
+        self.count += 1
+        return '__temp__' + str(self.count)
+
+    def add(self, name, value):
+        """Store temporary *value* under *name*."""
+
+        self.values[name] = value
+        self.peak = max(self.peak, len(self.values))
+
+    def pop(self, name):
+        """Release temporary *name* and return its value."""
+
+        return self.values.pop(name)
+
+    def release(self, node):
+        """Release temporaries referred to in *node*."""
+
+        for item in ast.walk(node):
+            if isinstance(item, Name):
+                self.values.pop(item.id, None)
+            elif (isinstance(item, Subscript) and
+                  isinstance(item.value, Name) and
+                  item.value.id == self.subscript):
+                for key in ast.walk(item.slice):
+                    if isinstance(key, Str):
+                        self.values.pop(key.s, None)
+
+    def clear(self):
+        """Release all temporaries, and report their peak number when
+        instrumentation is enabled."""
+
+        self.values.clear()
+        self.memo.clear()
+        if instrument.enabled:
+            instrument.record_temps(self.peak)
+
+    def scope(self, locals):
+        """Return a namespace for evaluating transformed code, where names
+        are looked up in temporaries and then in *locals*, and are assigned
+        in *locals*."""
+
+        return Scope(self.values, locals, self.subscript)
+
+
+class Scope(MutableMapping):
+
+    """A namespace that looks up names in *temps* and then in *locals*
+    dictionary, and writes to *locals*.  When *subscript* is given, the name
+    refers to *temps* itself."""
+
+    def __init__(self, temps, locals, subscript=None):
+
+        self._temps = temps
+        self._locals = locals
+        self._subscript = subscript
+
+    def __getitem__(self, key):
+
+        try:
+            return self._temps[key]
+        except KeyError:
+            if key == self._subscript:
+                return self._temps
+            return self._locals[key]
+
+    def __setitem__(self, key, value):
+
+        self._locals[key] = value
+
+    def __delitem__(self, key):
+
+        del self._locals[key]
+
+    def __iter__(self):
+
+        return iter(self._locals)
+
+    def __len__(self):
+
+        return len(self._locals)
+
+    def __contains__(self, key):
+
+        return (key in self._temps or key == self._subscript or
+                key in self._locals)
+
+
 class NapiTransformer(ast.NodeTransformer):
 
     """An :mod:`ast` transformer that evaluates chained comparison and logical
-    operation expressions of arrays while transforming the AST."""
+    operation expressions of arrays while transforming the AST.
+
+    Intermediate values are kept in a private :class:`.Frame`, *frame*,
+    that nested transformers share.  Code returned by the transformer must
+    be evaluated in ``frame.scope(locals)`` namespace, after which the frame
+    should be cleared.  When *cse* option is true, values of repeated pure
+    subexpressions are taken from the frame, see :mod:`napi.cse`."""
 
     def __init__(self, **kwargs):
 
         self._g, self._l = kwargs.pop('globals', {}), kwargs.pop('locals', {})
-        self._ti = 0
+        self.frame = kwargs.pop('frame', None)
+        if self.frame is None:
+            self.frame = Frame(kwargs.get('subscript'))
         self._kwargs = kwargs
         self._indent = 0
         if not kwargs.get('debug', False):
@@ -360,11 +1451,14 @@ class NapiTransformer(ast.NodeTransformer):
         #self._which = None
         self._evaluate = kwargs.get('evaluate', False)
         self._subscript = kwargs.get('subscript')
+        self._cse = kwargs.get('cse', False)
 
     def __getitem__(self, node):
 
         if isinstance(node, Name):
             name = node.id
+            if name in self.frame:
+                return self.frame.pop(name)
             try:
                 return self._l[name]
             except KeyError:
@@ -380,13 +1474,23 @@ class NapiTransformer(ast.NodeTransformer):
             return getattr(node, ATTRMAP[node.__class__])
         except KeyError:
             self._debug('_get', node)
+            key = None
+            if self._cse and is_pure(node):
+                key = ast.dump(node)
+                if key in self.frame.memo:
+                    return self.frame.memo[key]
             expr = Expression(fml(NapiTransformer(globals=self._g,
                                                   locals=self._l,
+                                                  frame=self.frame,
                                                   **self._kwargs).visit(node)))
             try:
-                return eval(compile(expr, '<string>', 'eval'), self._g, self._l)
-            except Exception as err:
-                raise err
+                value = eval(compile(expr, '<string>', 'eval'), self._g,
+                             self.frame.scope(self._l))
+            finally:
+                self.frame.release(expr)
+            if key is not None:
+                self.frame.memo[key] = value
+            return value
         if node.__class__ in EVALSET:
             return eval(node)
         else:
@@ -395,16 +1499,12 @@ class NapiTransformer(ast.NodeTransformer):
     def __setitem__(self, name, value):
 
         self._debug('self[{}] = {}'.format(name ,value))
-        if self._subscript:
-            self._l[self._subscript][name] = value
-        else:
-            self._l[name] = value
+        self.frame.add(name, value)
 
     def _tn(self):
         """Return a temporary variable name."""
 
-        self._ti += 1
-        return '__temp__' + str(self._ti)
+        return self.frame.name()
 
     def _incr(self):
 
@@ -427,7 +1527,10 @@ class NapiTransformer(ast.NodeTransformer):
             operand = self[node.operand]
             self._debug('|-', operand, incr=2)
             tn = self._tn()
-            result = numpy.logical_not(operand)
+            if isinstance(operand, PackedMask):
+                result = ~operand
+            else:
+                result = numpy.logical_not(operand)
             self._debug('|_', result, incr=2)
             self[tn] = result
             return ast_name(tn)
@@ -437,11 +1540,27 @@ class NapiTransformer(ast.NodeTransformer):
     def visit_Compare(self, node):
 
         self._debug('Compare', node.ops, incr=1)
+        index = self._kwargs.get('index', False)
+        if len(node.ops) == 1 and (index or node.ops[0].__class__ in
+                                   MEMBERSHIP):
+            op = node.ops[0].__class__
+            if op in COMPARE:
+                left, right = self[node.left], self[node.comparators[0]]
+                result = indexed_compare(left, [op], [right], None, index)
+                if result is None:
+                    result = COMPARE[op](left, right)
+                return self._return(result, node)
         if len(node.ops) > 1:
             values = []
             left = self[node.left]
-            for op, right in zip(node.ops, node.comparators):
-                right = self[right]
+            rights = [self[right] for right in node.comparators]
+            ops = [op.__class__ for op in node.ops]
+            result = indexed_compare(left, ops, rights, None, index)
+            if result is None and not any(op in MEMBERSHIP for op in ops):
+                result = fused_compare(left, ops, rights, self._kwargs)
+            if result is not None:
+                return self._return(result, node)
+            for op, right in zip(node.ops, rights):
                 tn = self._tn()
                 value = COMPARE[op.__class__](left, right)
                 self[tn] = value
@@ -476,12 +1595,13 @@ class NapiTransformer(ast.NodeTransformer):
         for item in node.values:
             value = self[item]
             self._debug('|-', value, incr=1)
-            if isinstance(value, ndarray) and value.shape:
+            if isinstance(value, ARRAYS) and value.shape:
                 arrays.append(value)
                 shapes.add(value.shape)
             elif not value:
                 result = value
 
+        bc = broadcast(arrays, shapes, self._kwargs)
         if len(shapes) > 1:
             shapes.clear()
             for i, a in enumerate(arrays):
@@ -489,22 +1609,38 @@ class NapiTransformer(ast.NodeTransformer):
                 shapes.add(a.shape)
             if len(shapes) > 1:
                 raise ValueError('array shape mismatch, even after squeezing')
+            _record('squeezed', arrays)
 
         shape = shapes.pop() if shapes else None
+        packed = _packed(arrays, self._kwargs)
 
         if result is not None:
             if shape:
-                return numpy.zeros(shape, bool)
+                if packed:
+                    return _record('decided', (), PackedMask.zeros(shape))
+                return _record('decided', (), numpy.zeros(shape, bool))
             else:
                 return result
         elif arrays:
             self._debug('|~ Arrays:', arrays, incr=1)
-            if self._sc and numpy.prod(shape) >= self._sc:
-                return short_circuit_and(arrays, shape)
+            options = blockwise(shape, self._kwargs)
+            if packed:
+                return _record('packed', arrays, packed_and(arrays, shape))
+            elif options:
+                return _record('chunked', arrays,
+                               chunked_and(arrays, shape, **options))
+            elif self._sc == AUTO:
+                return adaptive_and(arrays, shape, self._kwargs, node)
+            elif self._sc and numpy.prod(shape) >= self._sc:
+                return short_circuit_and(*_reorder(arrays, shape, True,
+                                                   self._kwargs, node))
             elif len(arrays) == 2:
-                return numpy.logical_and(*arrays)
+                return _record('dense', arrays, numpy.logical_and(*arrays))
+            elif bc:
+                return _record('dense', arrays,
+                               reduce_arrays(numpy.logical_and, arrays))
             else:
-                return numpy.all(arrays, 0)
+                return _record('dense', arrays, numpy.all(arrays, 0))
         else:
             return value
 
@@ -517,12 +1653,13 @@ class NapiTransformer(ast.NodeTransformer):
         for item in node.values:
             value = self[item]
             self._debug('|-', value, incr=1)
-            if isinstance(value, ndarray) and value.shape:
+            if isinstance(value, ARRAYS) and value.shape:
                 arrays.append(value)
                 shapes.add(value.shape)
             elif value:
                 result = value
 
+        bc = broadcast(arrays, shapes, self._kwargs)
         if len(shapes) > 1:
             shapes.clear()
             for i, a in enumerate(arrays):
@@ -530,37 +1667,51 @@ class NapiTransformer(ast.NodeTransformer):
                 shapes.add(a.shape)
             if len(shapes) > 1:
                 raise ValueError('array shape mismatch, even after squeezing')
+            _record('squeezed', arrays)
 
         shape = shapes.pop() if shapes else None
+        packed = _packed(arrays, self._kwargs)
 
         if result is not None:
             if shape:
-                return numpy.ones(shape, bool)
+                if packed:
+                    return _record('decided', (), PackedMask.ones(shape))
+                return _record('decided', (), numpy.ones(shape, bool))
             else:
                 return result
         elif arrays:
             self._debug('|~ Arrays:', arrays, incr=1)
-            if self._sc and numpy.prod(shape) >= self._sc:
-                return short_circuit_or(arrays, shape)
+            options = blockwise(shape, self._kwargs)
+            if packed:
+                return _record('packed', arrays, packed_or(arrays, shape))
+            elif options:
+                return _record('chunked', arrays,
+                               chunked_or(arrays, shape, **options))
+            elif self._sc == AUTO:
+                return adaptive_or(arrays, shape, self._kwargs, node)
+            elif self._sc and numpy.prod(shape) >= self._sc:
+                return short_circuit_or(*_reorder(arrays, shape, False,
+                                                   self._kwargs, node))
             elif len(arrays) == 2:
-                return numpy.logical_or(*arrays)
+                return _record('dense', arrays, numpy.logical_or(*arrays))
+            elif bc:
+                return _record('dense', arrays,
+                               reduce_arrays(numpy.logical_or, arrays))
             else:
-                return numpy.any(arrays, 0)
+                return _record('dense', arrays, numpy.any(arrays, 0))
         else:
             return value
 
     def _return(self, val, node):
 
         tn = self._tn()
+        self[tn] = val
         if self._subscript:
-            self._l['_napi_temp_ns'][tn] = val
             return Subscript(
                 value=Name(id=self._subscript, ctx=Load()),
                 slice=Index(value=Str(s=tn)),
                 ctx=getattr(node, 'ctx', Load()))
-        else:
-            self[tn] = val
-            return ast_name(tn)
+        return ast_name(tn)
 
 
     def _default(self, node):